@@ -0,0 +1,102 @@
+"""
+actor_writer.py
+Write-behind persistence of actor state.
+
+The processor records each actor's latest state here instead of upserting
+actors_state per event. Pending entries are keyed by actor_id, so an actor
+that produces many events between flushes costs one write. A background task
+flushes with one unordered bulk_write every flush_ms, or sooner once flush_max
+distinct actors are pending; shutdown flushes what is left. A worker killed
+outright loses at most one interval, which startup recovery tolerates: the
+event log stays authoritative.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict
+
+from .repos import actors_repo
+from . import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+class ActorStateWriter:
+    def __init__(self, flush_ms: int = 250, flush_max: int = 500):
+        self.flush_s = max(1, flush_ms) / 1000.0
+        self.flush_max = max(1, flush_max)
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self.recorded = 0
+        self.flushed = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+        self.last_flush_size = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def record(self, actor_id: str, actor: object) -> None:
+        if actor is None:
+            return
+        # Copy zones: the runtime state keeps mutating the same dict.
+        self._pending[actor_id] = {
+            "actor_id": actor_id,
+            "last_seen_ms": actor.last_seen_ms,
+            "zones": dict(actor.zones),
+        }
+        self.recorded += 1
+        instrumentation.ACTOR_WRITE_PENDING.set(len(self._pending))
+        if len(self._pending) >= self.flush_max:
+            self._wake.set()
+
+    def forget(self, actor_id: str) -> None:
+        # Expired actor: a pending write would resurrect its document.
+        self._pending.pop(actor_id, None)
+        instrumentation.ACTOR_WRITE_PENDING.set(len(self._pending))
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            started = time.perf_counter()
+            try:
+                with instrumentation.MONGO_WRITE_SECONDS.labels(op="actor_state").time():
+                    await actors_repo.upsert_actor_states(list(batch.values()))
+                self.flushed += len(batch)
+            except Exception as exc:
+                self.flush_errors += 1
+                instrumentation.MONGO_WRITE_ERRORS.labels(op="actor_state").inc()
+                logger.warning("actor state flush of %s actors failed: %s", len(batch), exc)
+                # Retry next pass; states recorded meanwhile are newer and win.
+                for actor_id, doc in batch.items():
+                    self._pending.setdefault(actor_id, doc)
+            finally:
+                self.last_flush_ms = (time.perf_counter() - started) * 1000.0
+                self.last_flush_size = len(batch)
+                instrumentation.ACTOR_WRITE_PENDING.set(len(self._pending))
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "last_flush_size": self.last_flush_size,
+        }
@@ -0,0 +1,95 @@
+"""
+archiver.py
+Moves completed runs out of the hot events collection.
+
+Runs that ended more than ROPT_ARCHIVE_AFTER_S ago are claimed one at a time,
+streamed into a compressed archive file (see repos/archive_repo.py) and then
+deleted from Mongo. events_repo serves archived runs from disk, so queries,
+exports and replay keep working while the hot set stays small.
+
+Only the rows read back from the archive file are deleted. Once the file
+exists, ingest refuses events for the run (routers/events.py and
+main._process_event), so a row that landed during the copy is picked up by a
+second copy; if the run still changed, the file is dropped and the next pass
+starts over.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict
+
+from .repos import archive_repo, events_repo, runs_repo
+from .runtime_state import now_ms
+from .db.mongo import col_events
+
+logger = logging.getLogger(__name__)
+
+STALE_CLAIM_MS = 3600 * 1000
+COPY_ATTEMPTS = 2
+
+
+async def archive_run(run_id: str, batch_size: int = 1000) -> Dict[str, Any]:
+    summary = None
+    try:
+        for _ in range(COPY_ATTEMPTS):
+            summary = await _copy_to_archive(run_id, batch_size)
+            # Nothing deletes the run's rows before this point, so equal counts mean
+            # the file holds every one of them.
+            hot_count = await col_events().count_documents({"run_id": run_id})
+            if hot_count == summary["count"]:
+                break
+        else:
+            raise RuntimeError(f"run changed during archive ({hot_count} != {summary['count']})")
+        await runs_repo.mark_archived(run_id, summary)
+    except BaseException:
+        if summary is not None and os.path.exists(summary["path"]):
+            os.remove(summary["path"])
+        raise
+    summary["deleted"] = await _delete_archived(run_id)
+    return summary
+
+
+async def _copy_to_archive(run_id: str, batch_size: int) -> Dict[str, Any]:
+    writer = archive_repo.ArchiveWriter(run_id)
+    try:
+        async for batch in events_repo.iter_event_batches(run_id, batch_size=batch_size, hot_only=True):
+            await asyncio.to_thread(writer.write_rows, batch)
+        return await asyncio.to_thread(writer.close)
+    except BaseException:
+        await asyncio.to_thread(writer.abort)
+        raise
+
+
+async def _delete_archived(run_id: str) -> int:
+    deleted = 0
+    async for batch in archive_repo.iter_archived_batches(run_id):
+        deleted += await events_repo.delete_events([r["_id"] for r in batch])
+    return deleted
+
+
+async def run_archiver(interval_s: float, archive_after_s: int, batch_size: int = 1000) -> None:
+    while True:
+        await asyncio.sleep(interval_s)
+        while True:
+            try:
+                run_id = await runs_repo.claim_run_for_archive(
+                    now_ms() - archive_after_s * 1000, STALE_CLAIM_MS
+                )
+            except Exception as exc:
+                logger.warning("archive claim failed: %s", exc)
+                break
+            if run_id is None:
+                break
+            try:
+                summary = await archive_run(run_id, batch_size=batch_size)
+                logger.info("archived run %s: %s events", run_id, summary["count"])
+            except Exception as exc:
+                logger.warning("archive of run %s failed: %s", run_id, exc)
+                try:
+                    await runs_repo.release_archive_claim(run_id)
+                except Exception:
+                    pass
+                break
@@ -23,15 +23,70 @@ class Settings(BaseSettings):
     mongo_db: str = Field(default="ropt", alias="ROPT_MONGO_DB")
     mongo_min_pool_size: int = Field(default=0, alias="ROPT_MONGO_MIN_POOL_SIZE")
     mongo_max_pool_size: int = Field(default=100, alias="ROPT_MONGO_MAX_POOL_SIZE")
+    # "mongo", or "embedded": file-backed storage in this process (single worker, no server).
+    storage: str = Field(default="mongo", alias="ROPT_STORAGE")
+    storage_dir: str = Field(default="./data", alias="ROPT_STORAGE_DIR")
+    # Embedded write-ahead log group commit; 0 makes each write wait for its fsync.
+    storage_flush_ms: int = Field(default=50, alias="ROPT_STORAGE_FLUSH_MS")
+    # Embedded log size that triggers a snapshot and starts a fresh log.
+    storage_compact_mb: int = Field(default=64, alias="ROPT_STORAGE_COMPACT_MB")
 
     events_ttl_days: int = Field(default=0, alias="ROPT_EVENTS_TTL_DAYS")
     metrics_ttl_days: int = Field(default=7, alias="ROPT_METRICS_TTL_DAYS")
 
+    # Cold tier: ended runs are compacted to files here and dropped from Mongo.
+    archive_dir: str | None = Field(default=None, alias="ROPT_ARCHIVE_DIR")
+    archive_after_s: int = Field(default=3600, alias="ROPT_ARCHIVE_AFTER_S")
+    archive_interval_s: float = Field(default=300.0, alias="ROPT_ARCHIVE_INTERVAL_S")
+
+    # Memory-mapped planning snapshot (graph, zone map, cost table); unset disables it.
+    planning_artifact_dir: str | None = Field(default=None, alias="ROPT_PLANNING_ARTIFACT_DIR")
+    planning_cost_table_max_nodes: int = Field(
+        default=2000, alias="ROPT_PLANNING_COST_TABLE_MAX_NODES"
+    )
+    # Local multi-robot planning pool; 0 sends every replan to the solver.
+    planning_workers: int = Field(default=0, alias="ROPT_PLANNING_WORKERS")
+    # "robot_id:start_node[:end_node],..."; empty means a single robot_1.
+    planning_fleet: str = Field(default="", alias="ROPT_PLANNING_FLEET")
+
     cuopt_base_url: str = Field(default="http://127.0.0.1:5000", alias="ROPT_CUOPT_URL")
     cuopt_timeout_s: float = Field(default=0.05, alias="ROPT_CUOPT_TIMEOUT_S")
+    # Consecutive failures that open the solver circuit breaker.
+    cuopt_breaker_failures: int = Field(default=3, alias="ROPT_CUOPT_BREAKER_FAILURES")
+    # Background solver health probe interval; also how soon an open breaker is retried.
+    cuopt_probe_interval_s: float = Field(default=5.0, alias="ROPT_CUOPT_PROBE_INTERVAL_S")
+
+    metrics_flush_ms: int = Field(default=250, alias="ROPT_METRICS_FLUSH_MS")
+    metrics_flush_max: int = Field(default=500, alias="ROPT_METRICS_FLUSH_MAX")
+    metrics_buffer_max: int = Field(default=50000, alias="ROPT_METRICS_BUFFER_MAX")
+
+    # Actors with no event for this long get implicit exits and are dropped; 0 keeps them.
+    actor_ttl_s: float = Field(default=0.0, alias="ROPT_ACTOR_TTL_S")
+    # Write-behind actor state: flush every N ms or once M actors are pending.
+    actor_flush_ms: int = Field(default=250, alias="ROPT_ACTOR_FLUSH_MS")
+    actor_flush_max: int = Field(default=500, alias="ROPT_ACTOR_FLUSH_MAX")
+
+    trace_flush_ms: int = Field(default=500, alias="ROPT_TRACE_FLUSH_MS")
 
     event_queue_max: int = Field(default=20000, alias="ROPT_EVENT_QUEUE_MAX")
     max_events: int = Field(default=5000, alias="ROPT_MAX_EVENTS")
+    # Redis Streams ingestion queue shared by all workers (needs ROPT_REDIS_URL).
+    # ROPT_EVENT_QUEUE_MAX then caps each partition stream.
+    event_stream: bool = Field(default=False, alias="ROPT_EVENT_STREAM")
+    event_stream_partitions: int = Field(default=8, alias="ROPT_EVENT_STREAM_PARTITIONS")
+    event_stream_lease_ms: int = Field(default=10000, alias="ROPT_EVENT_STREAM_LEASE_MS")
+    event_stream_batch: int = Field(default=100, alias="ROPT_EVENT_STREAM_BATCH")
+
+    ws_send_queue_max: int = Field(default=256, alias="ROPT_WS_SEND_QUEUE_MAX")
+    # drop_oldest | disconnect
+    ws_slow_consumer_policy: str = Field(default="drop_oldest", alias="ROPT_WS_SLOW_CONSUMER_POLICY")
+    # Max coalesced snapshot broadcasts per second; 0 broadcasts on every event.
+    ws_tick_hz: float = Field(default=15.0, alias="ROPT_WS_TICK_HZ")
+
+    replay_batch_size: int = Field(default=500, alias="ROPT_REPLAY_BATCH_SIZE")
+    replay_prefetch_batches: int = Field(default=2, alias="ROPT_REPLAY_PREFETCH_BATCHES")
+    replay_checkpoint_events: int = Field(default=500, alias="ROPT_REPLAY_CHECKPOINT_EVENTS")
+    replay_checkpoint_s: float = Field(default=30.0, alias="ROPT_REPLAY_CHECKPOINT_S")
 
     cors_allow_origins: str = Field(default="*", alias="ROPT_CORS_ALLOW_ORIGINS")
     edge_api_key: str | None = Field(default=None, alias="ROPT_EDGE_API_KEY")
@@ -1,35 +1,65 @@
 """
 cuopt_client.py
 Minimal HTTP client for cuOpt. Provides a stubbed response if cuOpt is absent.
+
+A circuit breaker opens after ROPT_CUOPT_BREAKER_FAILURES consecutive solve
+failures; while open, solves return the fallback without touching the
+network. The background checker (run_health_checker) probes /health on an
+interval, which doubles as the half-open trial: a good probe closes the
+breaker. Health endpoints read its cached status instead of calling out.
 """
 
 from __future__ import annotations
 
+import asyncio
+import json
 import logging
-from typing import Any, Dict, List
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 
 from .config import settings
+from . import instrumentation
 
 logger = logging.getLogger(__name__)
 
 
+def _dumps(obj: Any) -> bytes:
+    # Same encoding requests uses for json=.
+    return json.dumps(obj, allow_nan=False).encode("utf-8")
+
+
 class CuOptClient:
-    def __init__(self, base_url: str | None = None, timeout_s: float | None = None):
+    def __init__(
+        self,
+        base_url: str | None = None,
+        timeout_s: float | None = None,
+        breaker_failures: int | None = None,
+        probe_interval_s: float | None = None,
+    ):
         self.base_url = base_url or settings.cuopt_base_url
         self.timeout_s = timeout_s or settings.cuopt_timeout_s
+        self.breaker_failures = max(1, breaker_failures or settings.cuopt_breaker_failures)
+        self.probe_interval_s = max(0.1, probe_interval_s or settings.cuopt_probe_interval_s)
+        self.failures = 0
+        self.breaker_open = False
+        self.opened_ms: int | None = None
+        self._status: Dict[str, Any] = {"ok": False, "error": "not_checked", "checked_ms": None}
+        # ((graph_version, blocked nodes), weights list, JSON) for the last waypoint graph sent.
+        self._graph_json: Optional[Tuple[Tuple[Any, Any], List[float], bytes]] = None
 
     def solve(self, matrix_data: Dict[str, Any], constraints: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Send a VRP request to cuOpt using a cost matrix. Falls back if unavailable.
+        Send a VRP request to cuOpt. matrix_data is either a waypoint graph
+        (offsets/edges/weights from GraphManager.get_waypoint_graph) or a dense
+        cost matrix ("matrix"); both carry node_map. Falls back if unavailable.
         """
+        # Short-circuit before building the request body; it is only needed for cuOpt.
+        if self.breaker_open:
+            instrumentation.CUOPT_SOLVES.labels(outcome="short_circuit").inc()
+            return self._fallback_local_solve(matrix_data)
         payload = {
-            "cost_matrix_data": {
-                "cost_matrix": {
-                    0: matrix_data["matrix"]
-                }
-            },
             "fleet_data": {
                 "vehicle_locations": constraints.get("vehicles", []),
                 "vehicle_ids": constraints.get("vehicle_ids", ["robot_1"]),
@@ -42,17 +72,93 @@ class CuOptClient:
                 "time_limit": constraints.get("time_limit", 0.05),
             },
         }
-        try:
-            resp = requests.post(
-                f"{self.base_url.rstrip('/')}/cuopt/routes",
-                json=payload,
-                timeout=self.timeout_s,
-            )
-            resp.raise_for_status()
-            return self._map_solution(resp.json(), matrix_data["node_map"])
-        except Exception as exc:  # noqa: BLE001 - want to catch connection + HTTP errors
-            logger.warning("cuOpt unreachable, returning stub solution: %s", exc)
-            return self._fallback_local_solve(matrix_data)
+        with instrumentation.CUOPT_SOLVE_SECONDS.time():
+            try:
+                if "offsets" in matrix_data:
+                    # Splice the cached graph JSON in front of the per-solve fields.
+                    graph = self._waypoint_graph_json(matrix_data)
+                    body = b'{"waypoint_graph_data":' + graph + b"," + _dumps(payload)[1:]
+                else:
+                    graph_data = {"cost_matrix_data": {"cost_matrix": {0: matrix_data["matrix"]}}}
+                    body = _dumps({**graph_data, **payload})
+                resp = requests.post(
+                    f"{self.base_url.rstrip('/')}/cuopt/routes",
+                    data=body,
+                    headers={"Content-Type": "application/json"},
+                    timeout=self.timeout_s,
+                )
+                resp.raise_for_status()
+                out = self._map_solution(resp.json(), matrix_data["node_map"])
+                instrumentation.CUOPT_SOLVES.labels(outcome="cuopt").inc()
+                self.failures = 0
+                return out
+            except Exception as exc:  # noqa: BLE001 - want to catch connection + HTTP errors
+                logger.warning("cuOpt unreachable, returning stub solution: %s", exc)
+                instrumentation.CUOPT_SOLVES.labels(outcome="fallback").inc()
+                self.failures += 1
+                if self.failures >= self.breaker_failures:
+                    self._set_breaker(True)
+                return self._fallback_local_solve(matrix_data)
+
+    def _waypoint_graph_json(self, matrix_data: Dict[str, Any]) -> bytes:
+        """
+        Serialized waypoint_graph_data, reused until the graph version or the
+        blocked set changes. Encoding every edge is most of a solve request.
+        """
+        key = (matrix_data.get("graph_version"), matrix_data.get("blocked"))
+        cached = self._graph_json
+        # The weights list is replaced whenever they change; the identity check also
+        # covers an in-memory patch whose version bump is still being written.
+        if cached is not None and cached[0] == key and cached[1] is matrix_data["weights"]:
+            return cached[2]
+        body = _dumps({
+            "waypoint_graph": {
+                0: {
+                    "offsets": matrix_data["offsets"],
+                    "edges": matrix_data["edges"],
+                    "weights": matrix_data["weights"],
+                }
+            }
+        })
+        self._graph_json = (key, matrix_data["weights"], body)
+        return body
+
+    def _set_breaker(self, is_open: bool) -> None:
+        if is_open == self.breaker_open:
+            return
+        self.breaker_open = is_open
+        self.opened_ms = int(time.time() * 1000) if is_open else None
+        if is_open:
+            logger.warning("cuOpt circuit breaker open after %s failures", self.failures)
+        else:
+            self.failures = 0
+            logger.info("cuOpt circuit breaker closed")
+        instrumentation.CUOPT_BREAKER_OPEN.set(1 if is_open else 0)
+
+    def status(self) -> dict:
+        """
+        Last background probe plus breaker state; never does I/O.
+        """
+        return {
+            **self._status,
+            "breaker": "open" if self.breaker_open else "closed",
+            "consecutive_failures": self.failures,
+            "opened_ms": self.opened_ms,
+        }
+
+    async def run_health_checker(self) -> None:
+        while True:
+            # Blocking HTTP probe off the event loop.
+            result = await asyncio.to_thread(self.health_check)
+            self._status = {**result, "checked_ms": int(time.time() * 1000)}
+            if result.get("ok"):
+                self._set_breaker(False)
+            elif not self.breaker_open:
+                # A failed probe counts like a failed solve.
+                self.failures += 1
+                if self.failures >= self.breaker_failures:
+                    self._set_breaker(True)
+            await asyncio.sleep(self.probe_interval_s)
 
     def health_check(self) -> dict:
         try:
@@ -0,0 +1,954 @@
+"""
+db/embedded.py
+What this file does:
+- File-backed, in-process storage with the Motor collection API the repos use
+  (find/sort/limit/hint, find_one_and_update, bulk_write, aggregate, ...), so
+  ROPT_STORAGE=embedded runs the backend without a Mongo server.
+- Documents live in memory; every collection index (same specs as
+  db/mongo.ensure_indexes) is a SortedList of keys (O(log n) inserts and
+  deletes) used for equality/range lookups, keyset paging order and unique
+  constraints.
+- Durability: each write appends a BSON record to a write-ahead log buffer and
+  returns; a background task group-commits the buffer (one write + fsync) every
+  ROPT_STORAGE_FLUSH_MS. With 0, writes wait for their group commit instead.
+- When the log passes ROPT_STORAGE_COMPACT_MB it is rotated and a snapshot of
+  all collections is written beside it; startup loads the newest snapshot and
+  replays the log segments after it, dropping a torn final record.
+
+Layout under <ROPT_STORAGE_DIR>/<db>/: LOCK, snapshot-<seq>.bson, wal-<seq>.log.
+One process owns a directory (flock), so run a single backend worker.
+
+Limits: memory holds every document plus one entry per index it is in, and
+each compaction writes the whole dataset to a new snapshot (in a thread, but
+proportional to what is retained). Nothing expires events by itself (their
+TTL index is on integer ts_ms, which TTL ignores, as in Mongo), so bound
+retention with ROPT_ARCHIVE_DIR, which moves ended runs to disk.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import glob
+import itertools
+import logging
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import bson
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError
+from pymongo.results import (
+    BulkWriteResult,
+    DeleteResult,
+    InsertManyResult,
+    InsertOneResult,
+    UpdateResult,
+)
+from sortedcontainers import SortedList
+
+from .query import (
+    EMPTY_ARRAY_KEY,
+    MAX_KEY,
+    apply_update,
+    clone,
+    equality_fields,
+    get_path,
+    is_operator_dict,
+    matches,
+    normalize_sort,
+    project,
+    run_pipeline,
+    set_path,
+    sort_docs,
+    sort_key,
+)
+
+logger = logging.getLogger(__name__)
+
+CODEC = CodecOptions(tz_aware=True, tzinfo=timezone.utc)
+SCAN_CHUNK = 512  # index entries copied per re-seek while a cursor scans
+YIELD_EVERY = 1000  # cursors hand the loop back after this many documents
+TTL_SWEEP_S = 60.0
+
+
+class _Index:
+    def __init__(self, name: str, keys: List[Tuple[str, int]], unique: bool, ttl_s: Optional[int]):
+        self.name = name
+        self.keys = keys
+        self.fields = [f for f, _ in keys]
+        self.unique = unique
+        self.ttl_s = ttl_s
+        # Sorted (sort_key(field value)..., sort_key(_id)); one per array element for multikey.
+        self.entries: SortedList = SortedList()
+        self.multikey = False
+
+    def spec(self) -> Dict[str, Any]:
+        return {"name": self.name, "keys": [list(k) for k in self.keys], "unique": self.unique, "ttl": self.ttl_s}
+
+    def entry_keys(self, doc: Dict[str, Any], idkey: Tuple) -> List[Tuple]:
+        options = []
+        for field in self.fields:
+            value = get_path(doc, field)
+            if isinstance(value, list):
+                # Multikey: one entry per distinct element.
+                self.multikey = True
+                options.append(sorted({sort_key(v) for v in value}) or [EMPTY_ARRAY_KEY])
+            else:
+                options.append([sort_key(value)])
+        if all(len(o) == 1 for o in options):
+            return [(*(o[0] for o in options), idkey)]
+        return [(*combo, idkey) for combo in itertools.product(*options)]
+
+    def add(self, doc: Dict[str, Any], idkey: Tuple) -> None:
+        for entry in self.entry_keys(doc, idkey):
+            self.entries.add(entry)
+
+    def remove(self, doc: Dict[str, Any], idkey: Tuple) -> None:
+        for entry in self.entry_keys(doc, idkey):
+            self.entries.discard(entry)
+
+    def remove_ids(self, idkeys: set) -> None:
+        self.entries = SortedList(e for e in self.entries if e[-1] not in idkeys)
+
+    def conflicts(self, doc: Dict[str, Any], idkey: Tuple) -> bool:
+        if not self.unique:
+            return False
+        for entry in self.entry_keys(doc, idkey):
+            prefix = entry[:-1]
+            for other in self.entries.islice(self.entries.bisect_left(prefix)):
+                if other[:-1] != prefix:
+                    break
+                if other[-1] != idkey:
+                    return True
+        return False
+
+
+def _index_name(keys: Sequence[Tuple[str, int]]) -> str:
+    return "_".join(f"{f}_{d}" for f, d in keys)
+
+
+def _normalize_keys(keys: Any) -> List[Tuple[str, int]]:
+    if isinstance(keys, str):
+        return [(keys, 1)]
+    return [(f, int(d)) for f, d in keys]
+
+
+def _or_lower_bounds(branches: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Fields every branch bounds from below (equality, $gt or $gte), with the
+    smallest such bound; values of different types give no bound.
+    """
+    common: Optional[Dict[str, List[Any]]] = None
+    for branch in branches:
+        lows: Dict[str, Any] = {}
+        for field, cond in branch.items():
+            if field.startswith("$"):
+                continue
+            if not is_operator_dict(cond):
+                if not isinstance(cond, (dict, list)):
+                    lows[field] = cond
+            else:
+                for op in ("$eq", "$gte", "$gt"):
+                    if op in cond and not isinstance(cond[op], (dict, list)):
+                        lows[field] = cond[op]
+                        break
+        if common is None:
+            common = {f: [v] for f, v in lows.items()}
+        else:
+            common = {f: vs + [lows[f]] for f, vs in common.items() if f in lows}
+    out = {}
+    for field, values in (common or {}).items():
+        keys = [sort_key(v) for v in values]
+        if len({k[0] for k in keys}) == 1:
+            out[field] = values[keys.index(min(keys))]
+    return out
+
+
+class _Plan:
+    def __init__(self, index: _Index, lo: Tuple, hi: Tuple, reverse: bool, ordered: bool):
+        self.index = index
+        self.lo = lo
+        self.hi = hi
+        self.reverse = reverse
+        self.ordered = ordered
+
+
+class EmbeddedCollection:
+    def __init__(self, db: "EmbeddedDatabase", name: str):
+        self.database = db
+        self.name = name
+        self.exists = False
+        self.options: Dict[str, Any] = {}
+        self._docs: Dict[Tuple, Dict[str, Any]] = {}
+        self._indexes: Dict[str, _Index] = {}
+
+    # ---- read path ----
+
+    def find(self, filter: Optional[Dict[str, Any]] = None, projection: Any = None, **kwargs) -> "EmbeddedCursor":
+        return EmbeddedCursor(self, filter or {}, projection, **kwargs)
+
+    async def find_one(self, filter: Optional[Dict[str, Any]] = None, projection: Any = None, **kwargs):
+        for doc in self.find(filter, projection, **kwargs).limit(1)._results():
+            return doc
+        return None
+
+    async def count_documents(self, filter: Dict[str, Any], **kwargs) -> int:
+        return sum(1 for _ in self._scan(filter, [], None))
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> "EmbeddedCursor":
+        stages = list(pipeline)
+        q = stages.pop(0)["$match"] if stages and "$match" in stages[0] else {}
+        cursor = EmbeddedCursor(self, q, None)
+        cursor._pipeline = stages
+        return cursor
+
+    def _plan(self, q: Dict[str, Any], sort: List[Tuple[str, int]], hint: Any) -> Optional[_Plan]:
+        eq: Dict[str, Any] = {}
+        ranges: Dict[str, Dict[str, Any]] = {}
+        for part in [q, *q.get("$and", [])]:
+            for field, cond in part.items():
+                if field.startswith("$"):
+                    continue
+                if not is_operator_dict(cond):
+                    if not isinstance(cond, (dict, list)):
+                        eq[field] = cond
+                elif "$eq" in cond and not isinstance(cond["$eq"], (dict, list)):
+                    eq[field] = cond["$eq"]
+                elif "$in" in cond and len(cond["$in"]) == 1 and not isinstance(cond["$in"][0], (dict, list)):
+                    eq[field] = cond["$in"][0]
+                else:
+                    bounds = {op: v for op, v in cond.items() if op in ("$gt", "$gte", "$lt", "$lte")}
+                    if bounds:
+                        ranges[field] = bounds
+            if "$or" in part:
+                # Keyset paging: $or of "ts > t" and "ts == t, _id > i" still bounds ts >= t.
+                for field, low in _or_lower_bounds(part["$or"]).items():
+                    ranges.setdefault(field, {"$gte": low})
+
+        candidates = list(self._indexes.values())
+        if hint is not None:
+            hinted = _normalize_keys(hint) if not isinstance(hint, str) else None
+            candidates = [
+                ix for ix in candidates if (hinted and ix.keys == hinted) or ix.name == hint
+            ] or candidates
+        best, best_score = None, (0, 0, 0)
+        for ix in candidates:
+            n_eq = 0
+            while n_eq < len(ix.fields) and ix.fields[n_eq] in eq:
+                n_eq += 1
+            rest = ix.fields[n_eq:]
+            has_range = bool(rest) and rest[0] in ranges
+            wanted = [(f, d) for f, d in sort if f not in eq]
+            ordered = not wanted or (
+                [f for f, _ in wanted] == rest[: len(wanted)] and len({d for _, d in wanted}) == 1
+            )
+            score = (n_eq, int(has_range), int(ordered and bool(wanted)))
+            if score > best_score:
+                best, best_score = (ix, n_eq, has_range, ordered, wanted), score
+        if best is None:
+            return None
+        ix, n_eq, has_range, ordered, wanted = best
+        prefix = tuple(sort_key(eq[f]) for f in ix.fields[:n_eq])
+        lo, hi = prefix, (*prefix, MAX_KEY)
+        if has_range:
+            bounds = ranges[ix.fields[n_eq]]
+            low = next((b for b in ("$gt", "$gte") if b in bounds), None)
+            high = next((b for b in ("$lt", "$lte") if b in bounds), None)
+            if low:
+                k = sort_key(bounds[low])
+                lo = (*prefix, k) if low == "$gte" else (*prefix, k, MAX_KEY)
+                # Range operators only match within the bound's type bracket.
+                hi = (*prefix, (k[0] + 1,))
+            if high:
+                k = sort_key(bounds[high])
+                hi = (*prefix, k, MAX_KEY) if high == "$lte" else (*prefix, k)
+                if not low:
+                    lo = (*prefix, (k[0],))
+        reverse = bool(wanted) and ordered and wanted[0][1] < 0
+        return _Plan(ix, lo, hi, reverse, ordered)
+
+    def _index_scan(self, plan: _Plan) -> Iterator[Dict[str, Any]]:
+        # Re-seek by the last entry seen after every chunk, so writes made while
+        # a cursor is suspended neither break nor repeat the scan.
+        seen = set() if plan.index.multikey else None
+        last: Optional[Tuple] = None
+        while True:
+            entries = plan.index.entries
+            if not plan.reverse:
+                start = entries.bisect_left(plan.lo) if last is None else entries.bisect_right(last)
+                stop = min(start + SCAN_CHUNK, entries.bisect_left(plan.hi))
+                chunk = entries[start:stop]
+            else:
+                stop = entries.bisect_left(plan.hi) if last is None else entries.bisect_left(last)
+                start = max(stop - SCAN_CHUNK, entries.bisect_left(plan.lo))
+                chunk = entries[start:stop][::-1]
+            if not chunk:
+                return
+            for entry in chunk:
+                idkey = entry[-1]
+                if seen is not None:
+                    if idkey in seen:
+                        continue
+                    seen.add(idkey)
+                doc = self._docs.get(idkey)
+                if doc is not None:
+                    yield doc
+            last = chunk[-1]
+
+    def _scan(self, q: Dict[str, Any], sort: List[Tuple[str, int]], hint: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Matching stored documents (not copies), in sort order when sort is given.
+        """
+        plan = self._plan(q, sort, hint)
+        if plan is None:
+            docs = [d for d in list(self._docs.values()) if matches(d, q)]
+            yield from sort_docs(docs, sort) if sort else docs
+            return
+        docs = (d for d in self._index_scan(plan) if matches(d, q))
+        if plan.ordered:
+            yield from docs
+        else:
+            yield from sort_docs(list(docs), sort)
+
+    # ---- write path ----
+
+    def _materialize(self) -> None:
+        if not self.exists:
+            self.exists = True
+            self.database._log({"c": self.name, "o": "col", "opts": self.options})
+
+    def _store(self, new: Dict[str, Any], old: Optional[Dict[str, Any]] = None) -> None:
+        idkey = sort_key(new["_id"])
+        if old is None and idkey in self._docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_", 11000)
+        for ix in self._indexes.values():
+            if ix.conflicts(new, idkey):
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} index: {ix.name}", 11000
+                )
+        # Encode before touching memory: an unencodable document changes nothing.
+        record = self.database._encode({"c": self.name, "o": "put", "d": new})
+        self._materialize()
+        for ix in self._indexes.values():
+            if old is None:
+                ix.add(new, idkey)
+            elif ix.entry_keys(old, idkey) != ix.entry_keys(new, idkey):
+                ix.remove(old, idkey)
+                ix.add(new, idkey)
+        self._docs[idkey] = new
+        self.database._append(record)
+
+    def _remove(self, docs: List[Dict[str, Any]]) -> None:
+        if not docs:
+            return
+        idkeys = [sort_key(d["_id"]) for d in docs]
+        if len(docs) == len(self._docs):
+            self._docs.clear()
+            for ix in self._indexes.values():
+                ix.entries = SortedList()
+            self.database._log({"c": self.name, "o": "clear"})
+            return
+        for ix in self._indexes.values():
+            if len(docs) > 64:
+                ix.remove_ids(set(idkeys))
+            else:
+                for d, idkey in zip(docs, idkeys):
+                    ix.remove(d, idkey)
+        for d, idkey in zip(docs, idkeys):
+            del self._docs[idkey]
+            self.database._log({"c": self.name, "o": "del", "id": d["_id"]})
+
+    def _insert(self, doc: Dict[str, Any]) -> Any:
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()  # like the driver, the caller's document gets the _id
+        self._store(clone(doc))
+        return doc["_id"]
+
+    def _upsert_doc(self, q: Dict[str, Any], update: Dict[str, Any], replacement: bool) -> Dict[str, Any]:
+        seed: Dict[str, Any] = {}
+        for path, value in equality_fields(q).items():
+            set_path(seed, path, clone(value))
+        new = apply_update(seed, update, inserting=True)
+        if replacement and "_id" in seed:
+            new["_id"] = seed["_id"]
+        new.setdefault("_id", ObjectId())
+        return new
+
+    def _update(
+        self, q: Dict[str, Any], update: Dict[str, Any], upsert: bool, multi: bool, sort: Any = None
+    ) -> Tuple[int, int, Any, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        (matched, modified, upserted_id, first old doc, first new doc).
+        """
+        replacement = not any(k.startswith("$") for k in update)
+        targets = list(itertools.islice(self._scan(q, normalize_sort(sort), None), None if multi else 1))
+        if not targets:
+            if not upsert:
+                return 0, 0, None, None, None
+            new = self._upsert_doc(q, update, replacement)
+            self._store(new)
+            return 0, 0, new["_id"], None, new
+        modified = 0
+        first_new = None
+        for old in targets:
+            new = apply_update(old, update)
+            if new.get("_id") != old["_id"]:
+                raise ValueError("the _id field cannot be changed")
+            if new != old:
+                self._store(new, old)
+                modified += 1
+            first_new = first_new or new
+        return len(targets), modified, None, targets[0], first_new
+
+    async def insert_one(self, document: Dict[str, Any], **kwargs) -> InsertOneResult:
+        inserted_id = self._insert(document)
+        await self.database._commit()
+        return InsertOneResult(inserted_id, True)
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True, **kwargs) -> InsertManyResult:
+        ids, errors = [], []
+        for i, doc in enumerate(documents):
+            try:
+                ids.append(self._insert(doc))
+            except DuplicateKeyError as exc:
+                errors.append({"index": i, "code": 11000, "errmsg": str(exc)})
+                if ordered:
+                    break
+        await self.database._commit()
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(ids), "upserted": []})
+        return InsertManyResult(ids, True)
+
+    async def update_one(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False, **kwargs) -> UpdateResult:
+        matched, modified, upserted, _, _ = self._update(filter, update, upsert, multi=False)
+        await self.database._commit()
+        return _update_result(matched, modified, upserted)
+
+    async def update_many(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False, **kwargs) -> UpdateResult:
+        matched, modified, upserted, _, _ = self._update(filter, update, upsert, multi=True)
+        await self.database._commit()
+        return _update_result(matched, modified, upserted)
+
+    async def replace_one(self, filter: Dict[str, Any], replacement: Dict[str, Any], upsert: bool = False, **kwargs) -> UpdateResult:
+        matched, modified, upserted, _, _ = self._update(filter, replacement, upsert, multi=False)
+        await self.database._commit()
+        return _update_result(matched, modified, upserted)
+
+    async def delete_one(self, filter: Dict[str, Any], **kwargs) -> DeleteResult:
+        docs = list(itertools.islice(self._scan(filter, [], None), 1))
+        self._remove(docs)
+        await self.database._commit()
+        return DeleteResult({"n": len(docs)}, True)
+
+    async def delete_many(self, filter: Dict[str, Any], **kwargs) -> DeleteResult:
+        docs = list(self._scan(filter, [], None))
+        self._remove(docs)
+        await self.database._commit()
+        return DeleteResult({"n": len(docs)}, True)
+
+    async def find_one_and_update(
+        self,
+        filter: Dict[str, Any],
+        update: Dict[str, Any],
+        projection: Any = None,
+        sort: Any = None,
+        upsert: bool = False,
+        return_document: bool = ReturnDocument.BEFORE,
+        **kwargs,
+    ) -> Optional[Dict[str, Any]]:
+        _, _, _, old, new = self._update(filter, update, upsert, multi=False, sort=sort)
+        await self.database._commit()
+        doc = new if return_document == ReturnDocument.AFTER else old
+        return None if doc is None else project(clone(doc), _projection(projection))
+
+    async def bulk_write(self, requests: Sequence[Any], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        counts = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0}
+        upserted: List[Dict[str, Any]] = []
+        errors: List[Dict[str, Any]] = []
+        for i, op in enumerate(requests):
+            try:
+                if isinstance(op, InsertOne):
+                    self._insert(op._doc)
+                    counts["nInserted"] += 1
+                elif isinstance(op, (UpdateOne, UpdateMany, ReplaceOne)):
+                    matched, modified, upserted_id, _, _ = self._update(
+                        op._filter, op._doc, op._upsert, multi=isinstance(op, UpdateMany)
+                    )
+                    counts["nMatched"] += matched
+                    counts["nModified"] += modified
+                    if upserted_id is not None:
+                        counts["nUpserted"] += 1
+                        upserted.append({"index": i, "_id": upserted_id})
+                elif isinstance(op, (DeleteOne, DeleteMany)):
+                    docs = list(
+                        itertools.islice(self._scan(op._filter, [], None), None if isinstance(op, DeleteMany) else 1)
+                    )
+                    self._remove(docs)
+                    counts["nRemoved"] += len(docs)
+                else:
+                    raise NotImplementedError(f"unsupported bulk operation {type(op).__name__}")
+            except DuplicateKeyError as exc:
+                errors.append({"index": i, "code": 11000, "errmsg": str(exc), "op": op})
+                if ordered:
+                    break
+        await self.database._commit()
+        result = {**counts, "upserted": upserted, "writeErrors": errors, "writeConcernErrors": []}
+        if errors:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    async def create_index(self, keys: Any, unique: bool = False, expireAfterSeconds: Optional[int] = None, name: Optional[str] = None, **kwargs) -> str:
+        spec = _normalize_keys(keys)
+        name = name or _index_name(spec)
+        if name not in self._indexes:
+            self._add_index(_Index(name, spec, unique, expireAfterSeconds))
+            self._materialize()
+            self.database._log({"c": self.name, "o": "idx", "spec": self._indexes[name].spec()})
+            await self.database._commit()
+        return name
+
+    async def drop(self, **kwargs) -> None:
+        if not self.exists:
+            return
+        self._docs.clear()
+        self._indexes.clear()
+        self.options = {}
+        self.exists = False
+        self.database._log({"c": self.name, "o": "drop"})
+        await self.database._commit()
+
+    def _add_index(self, ix: _Index) -> None:
+        self._build_index(ix)
+        self._indexes[ix.name] = ix
+
+    def _build_index(self, ix: _Index) -> None:
+        entries = []
+        seen: Dict[Tuple, Tuple] = {}
+        for idkey, doc in self._docs.items():
+            for entry in ix.entry_keys(doc, idkey):
+                if ix.unique and seen.setdefault(entry[:-1], idkey) != idkey:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {ix.name}", 11000)
+                entries.append(entry)
+        ix.entries = SortedList(entries)
+
+    def _ttl_fields(self) -> List[Tuple[str, int]]:
+        fields = [(ix.fields[0], ix.ttl_s) for ix in self._indexes.values() if ix.ttl_s is not None]
+        ts = self.options.get("timeseries")
+        if ts and self.options.get("expireAfterSeconds") is not None:
+            fields.append((ts["timeField"], int(self.options["expireAfterSeconds"])))
+        return fields
+
+    def _expire(self, now: datetime) -> int:
+        # As on the server, TTL only ever removes documents whose field is a date.
+        removed = 0
+        for field, ttl_s in self._ttl_fields():
+            docs = list(self._scan({field: {"$lt": now - timedelta(seconds=ttl_s)}}, [], None))
+            self._remove(docs)
+            removed += len(docs)
+        return removed
+
+
+def _projection(projection: Any) -> Optional[Dict[str, Any]]:
+    if projection is None or isinstance(projection, dict):
+        return projection
+    return {f: 1 for f in projection}
+
+
+def _update_result(matched: int, modified: int, upserted_id: Any) -> UpdateResult:
+    raw: Dict[str, Any] = {"n": matched + (1 if upserted_id is not None else 0), "nModified": modified}
+    if upserted_id is not None:
+        raw["upserted"] = upserted_id
+    return UpdateResult(raw, True)
+
+
+class EmbeddedCursor:
+    """
+    Lazy find()/aggregate() cursor; async iteration yields copies.
+    """
+
+    def __init__(
+        self,
+        collection: EmbeddedCollection,
+        q: Dict[str, Any],
+        projection: Any = None,
+        sort: Any = None,
+        limit: int = 0,
+        skip: int = 0,
+        **kwargs,
+    ):
+        self._collection = collection
+        self._q = q
+        self._projection = _projection(projection)
+        self._sort = normalize_sort(sort)
+        self._limit = limit
+        self._skip = skip
+        self._hint: Any = None
+        self._pipeline: Optional[List[Dict[str, Any]]] = None
+        self._it: Optional[Iterator[Dict[str, Any]]] = None
+        self._count = 0
+
+    def sort(self, key_or_list: Any, direction: Optional[int] = None) -> "EmbeddedCursor":
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def limit(self, limit: int) -> "EmbeddedCursor":
+        self._limit = limit
+        return self
+
+    def skip(self, skip: int) -> "EmbeddedCursor":
+        self._skip = skip
+        return self
+
+    def hint(self, index: Any) -> "EmbeddedCursor":
+        self._hint = index
+        return self
+
+    def batch_size(self, batch_size: int) -> "EmbeddedCursor":
+        return self
+
+    def _results(self) -> Iterator[Dict[str, Any]]:
+        docs = self._collection._scan(self._q, self._sort, self._hint)
+        if self._pipeline is not None:
+            yield from run_pipeline((clone(d) for d in docs), self._pipeline)
+            return
+        stop = self._skip + self._limit if self._limit else None
+        for doc in itertools.islice(docs, self._skip, stop):
+            yield project(clone(doc), self._projection)
+
+    def __aiter__(self) -> "EmbeddedCursor":
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        if self._it is None:
+            self._it = self._results()
+        self._count += 1
+        if self._count % YIELD_EVERY == 0:
+            await asyncio.sleep(0)
+        try:
+            return next(self._it)
+        except StopIteration:
+            raise StopAsyncIteration from None
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        out = []
+        async for doc in self:
+            out.append(doc)
+            if length and len(out) >= length:
+                break
+        return out
+
+
+class WriteAheadLog:
+    """
+    Append-only BSON record log with group commit. Appends only buffer; flush()
+    writes and fsyncs everything buffered so far in one call, and concurrent
+    callers share it.
+    """
+
+    def __init__(self, directory: str, seq: int):
+        self.directory = directory
+        self.seq = seq
+        self._fh = open(self.path(seq), "ab")
+        self.size = self._fh.tell()
+        self._pending: List[bytes] = []
+        self._lock = asyncio.Lock()
+        # A cancelled flush leaves its thread running; file writes still go one at a time.
+        self._write_lock = threading.Lock()
+
+    def path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"wal-{seq:08d}.log")
+
+    def append(self, record: bytes) -> None:
+        self._pending.append(record)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _write(self, data: bytes) -> None:
+        with self._write_lock:
+            self._fh.write(data)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self.size += len(data)
+
+    async def flush(self) -> None:
+        async with self._lock:
+            await self._flush_locked()
+
+    async def _flush_locked(self) -> None:
+        if self._pending:
+            data, self._pending = b"".join(self._pending), []
+            await asyncio.to_thread(self._write, data)
+
+    def rotate(self) -> int:
+        """
+        Start the next segment; returns the sequence number of the closed one.
+        Call with the lock held and nothing pending.
+        """
+        closed = self.seq
+        with self._write_lock:
+            self._fh.close()
+        self.seq += 1
+        self._fh = open(self.path(self.seq), "ab")
+        self.size = 0
+        return closed
+
+    def close(self) -> None:
+        if self._pending:
+            self._write(b"".join(self._pending))
+            self._pending = []
+        with self._write_lock:
+            self._fh.close()
+
+
+def _read_records(path: str) -> Iterator[Tuple[Dict[str, Any], int]]:
+    """
+    (record, end offset) for each complete record; stops at a torn tail.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos + 4 <= len(data):
+        (size,) = struct.unpack_from("<i", data, pos)
+        if size < 5 or pos + size > len(data):
+            return
+        try:
+            record = bson.decode(data[pos : pos + size], codec_options=CODEC)
+        except bson.errors.InvalidBSON:
+            return
+        pos += size
+        yield record, pos
+
+
+def _seq_of(path: str) -> int:
+    return int(os.path.basename(path).split("-")[1].split(".")[0])
+
+
+class EmbeddedDatabase:
+    def __init__(self, client: "EmbeddedClient", name: str):
+        self.client = client
+        self.name = name
+        self.directory = os.path.join(client.directory, name)
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_fh = open(os.path.join(self.directory, "LOCK"), "a+")
+        try:
+            fcntl.flock(self._lock_fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_fh.close()
+            raise RuntimeError(
+                f"embedded storage {self.directory} is open in another process; "
+                "run a single backend worker with ROPT_STORAGE=embedded"
+            ) from None
+        self._collections: Dict[str, EmbeddedCollection] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.recovered_records = 0
+        self._wal = WriteAheadLog(self.directory, self._recover())
+
+    def __getitem__(self, name: str) -> EmbeddedCollection:
+        col = self._collections.get(name)
+        if col is None:
+            col = self._collections[name] = EmbeddedCollection(self, name)
+        return col
+
+    async def list_collection_names(self, filter: Optional[Dict[str, Any]] = None, **kwargs) -> List[str]:
+        names = sorted(n for n, c in self._collections.items() if c.exists)
+        if filter and "name" in filter:
+            names = [n for n in names if n == filter["name"]]
+        return names
+
+    async def create_collection(self, name: str, **options) -> EmbeddedCollection:
+        col = self[name]
+        if col.exists:
+            raise CollectionInvalid(f"collection {name} already exists")
+        col.options = dict(options)
+        col._materialize()
+        ts = options.get("timeseries")
+        if ts:
+            # The server keeps time-series buckets ordered by time; this serves the TTL sweep.
+            await col.create_index([(ts["timeField"], 1)])
+        await self._commit()
+        return col
+
+    async def command(self, command: Any, **kwargs) -> Dict[str, Any]:
+        if command == "ping" or (isinstance(command, dict) and "ping" in command):
+            return {"ok": 1.0}
+        raise NotImplementedError(f"unsupported command {command}")
+
+    # ---- durability ----
+
+    def _encode(self, record: Dict[str, Any]) -> bytes:
+        return bson.encode(record, codec_options=CODEC)
+
+    def _append(self, record: bytes) -> None:
+        self._wal.append(record)
+        self._ensure_flusher()
+
+    def _log(self, record: Dict[str, Any]) -> None:
+        self._append(self._encode(record))
+
+    async def _commit(self) -> None:
+        if self.client.flush_ms <= 0:
+            await self._wal.flush()
+
+    def _ensure_flusher(self) -> None:
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._run())
+            except RuntimeError:
+                pass  # no loop (offline scripts): close() flushes
+
+    async def _run(self) -> None:
+        # With flush_ms 0 writers commit themselves; this loop then only compacts and expires.
+        interval = (self.client.flush_ms or 50) / 1000.0
+        next_sweep = time.monotonic() + TTL_SWEEP_S
+        while not self._closed:
+            await asyncio.sleep(interval)
+            try:
+                await self._wal.flush()
+                if self._wal.size >= self.client.compact_bytes:
+                    await self.compact()
+                if time.monotonic() >= next_sweep:
+                    next_sweep = time.monotonic() + TTL_SWEEP_S
+                    now = datetime.now(timezone.utc)
+                    for col in list(self._collections.values()):
+                        col._expire(now)
+            except Exception as exc:
+                logger.warning("embedded storage flush failed: %s", exc)
+
+    async def compact(self) -> None:
+        """
+        Rotate the log and snapshot every collection, then drop the covered
+        segments. Stored documents are never mutated in place, so the snapshot
+        is encoded off the loop from references taken at the rotation point.
+        """
+        async with self._wal._lock:
+            await self._wal._flush_locked()
+            covered = self._wal.rotate()
+            state = [
+                (c.name, dict(c.options), [ix.spec() for ix in c._indexes.values()], list(c._docs.values()))
+                for c in self._collections.values()
+                if c.exists
+            ]
+        await asyncio.to_thread(self._write_snapshot, covered, state)
+
+    def _write_snapshot(self, covered: int, state: List[Tuple[str, Dict[str, Any], List[Dict[str, Any]], List[Dict[str, Any]]]]) -> None:
+        path = os.path.join(self.directory, f"snapshot-{covered:08d}.bson")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            for name, options, indexes, docs in state:
+                f.write(self._encode({"c": name, "o": "col", "opts": options}))
+                for spec in indexes:
+                    f.write(self._encode({"c": name, "o": "idx", "spec": spec}))
+                for doc in docs:
+                    f.write(self._encode({"c": name, "o": "put", "d": doc}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        for old in glob.glob(os.path.join(self.directory, "snapshot-*.bson")):
+            if _seq_of(old) < covered:
+                os.remove(old)
+        for old in glob.glob(os.path.join(self.directory, "wal-*.log")):
+            if _seq_of(old) <= covered:
+                os.remove(old)
+
+    def _recover(self) -> int:
+        """
+        Load the newest snapshot and replay later log segments; returns the
+        segment to append to.
+        """
+        # Indexes are built once at the end instead of entry by entry.
+        snapshots = sorted(glob.glob(os.path.join(self.directory, "snapshot-*.bson")), key=_seq_of)
+        covered = -1
+        if snapshots:
+            covered = _seq_of(snapshots[-1])
+            for record, _ in _read_records(snapshots[-1]):
+                self._replay(record)
+        segments = sorted(
+            (p for p in glob.glob(os.path.join(self.directory, "wal-*.log")) if _seq_of(p) > covered),
+            key=_seq_of,
+        )
+        for path in segments:
+            end = 0
+            for record, end in _read_records(path):
+                self._replay(record)
+                self.recovered_records += 1
+            if end < os.path.getsize(path):
+                logger.warning("embedded storage: dropping torn log tail in %s at %d", path, end)
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+        for col in self._collections.values():
+            for ix in col._indexes.values():
+                col._build_index(ix)
+        return _seq_of(segments[-1]) if segments else covered + 1
+
+    def _replay(self, record: Dict[str, Any]) -> None:
+        # Only during _recover(): indexes are rebuilt afterwards.
+        col = self[record["c"]]
+        col.exists = True
+        op = record["o"]
+        if op == "put":
+            doc = record["d"]
+            col._docs[sort_key(doc["_id"])] = doc
+        elif op == "del":
+            col._docs.pop(sort_key(record["id"]), None)
+        elif op == "clear":
+            col._docs.clear()
+        elif op == "drop":
+            col._docs.clear()
+            col._indexes.clear()
+            col.options = {}
+            col.exists = False
+        elif op == "col":
+            col.options = dict(record.get("opts") or {})
+        elif op == "idx":
+            spec = record["spec"]
+            col._indexes.setdefault(
+                spec["name"], _Index(spec["name"], _normalize_keys(spec["keys"]), spec["unique"], spec.get("ttl"))
+            )
+
+    async def aclose(self) -> None:
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self.close()
+
+    def close(self) -> None:
+        self._closed = True
+        self._wal.close()
+        self._lock_fh.close()
+
+
+class EmbeddedClient:
+    def __init__(self, directory: str, flush_ms: int = 50, compact_mb: int = 64):
+        self.directory = directory
+        self.flush_ms = flush_ms
+        self.compact_bytes = max(1, compact_mb) * 1024 * 1024
+        self._dbs: Dict[str, EmbeddedDatabase] = {}
+
+    def __getitem__(self, name: str) -> EmbeddedDatabase:
+        db = self._dbs.get(name)
+        if db is None:
+            db = self._dbs[name] = EmbeddedDatabase(self, name)
+        return db
+
+    get_database = __getitem__
+
+    async def aclose(self) -> None:
+        for db in self._dbs.values():
+            await db.aclose()
+        self._dbs.clear()
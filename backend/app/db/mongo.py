@@ -2,7 +2,8 @@
 @author: Shelton Bumhe
 db/mongo.py
 What this file does:
-- Creates the async MongoDB client (Motor).
+- Creates the async MongoDB client (Motor), or the embedded file-backed store
+  (db/embedded.py) when ROPT_STORAGE=embedded; repos use either unchanged.
 - Defines collections.
 - Builds indexes at startup (so queries are fast and real).
 """
@@ -11,26 +12,46 @@ from __future__ import annotations
 
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from pymongo import ASCENDING, DESCENDING
-from typing import Optional
+from pymongo.errors import CollectionInvalid
+from typing import Optional, Union
 
 from ..config import settings
+from .embedded import EmbeddedClient, EmbeddedDatabase
 
-_client: Optional[AsyncIOMotorClient] = None
-_db: Optional[AsyncIOMotorDatabase] = None
+_client: Optional[Union[AsyncIOMotorClient, EmbeddedClient]] = None
+_db: Optional[Union[AsyncIOMotorDatabase, EmbeddedDatabase]] = None
 
 
-def get_client() -> AsyncIOMotorClient:
+def get_client() -> Union[AsyncIOMotorClient, EmbeddedClient]:
     global _client
     if _client is None:
-        _client = AsyncIOMotorClient(
-            settings.mongo_uri,
-            minPoolSize=settings.mongo_min_pool_size,
-            maxPoolSize=settings.mongo_max_pool_size,
-        )
+        if settings.storage == "embedded":
+            _client = EmbeddedClient(
+                settings.storage_dir,
+                flush_ms=settings.storage_flush_ms,
+                compact_mb=settings.storage_compact_mb,
+            )
+        elif settings.storage == "mongo":
+            _client = AsyncIOMotorClient(
+                settings.mongo_uri,
+                minPoolSize=settings.mongo_min_pool_size,
+                maxPoolSize=settings.mongo_max_pool_size,
+            )
+        else:
+            raise ValueError(f"unknown ROPT_STORAGE {settings.storage!r} (use mongo or embedded)")
     return _client
 
 
-def get_db() -> AsyncIOMotorDatabase:
+async def close_client() -> None:
+    # Motor needs nothing; the embedded store flushes its log and releases its lock.
+    global _client, _db
+    if isinstance(_client, EmbeddedClient):
+        await _client.aclose()
+        _client = None
+        _db = None
+
+
+def get_db() -> Union[AsyncIOMotorDatabase, EmbeddedDatabase]:
     global _db
     if _db is None:
         _db = get_client()[settings.mongo_db]
@@ -46,9 +67,19 @@ def col_events():
 
 
 def col_metrics():
+    # Time-series collection (timeField "ts", metaField "meta" = {run_id, source}).
+    return get_db()["metrics_ts"]
+
+
+def col_metrics_legacy():
+    # Pre-time-series metrics; copied into metrics_ts once at startup, then unused.
     return get_db()["metrics"]
 
 
+def col_migrations():
+    return get_db()["migrations"]
+
+
 def col_runs():
     return get_db()["runs"]
 
@@ -61,6 +92,10 @@ def col_actors():
     return get_db()["actors_state"]
 
 
+def col_checkpoints():
+    return get_db()["replay_checkpoints"]
+
+
 async def ensure_indexes() -> None:
     # Zones: unique zone_id
     await col_zones().create_index([("zone_id", ASCENDING)], unique=True)
@@ -68,13 +103,20 @@ async def ensure_indexes() -> None:
     # Runs: latest first
     await col_runs().create_index([("started_at_ms", DESCENDING)])
 
-    # Events: query by run and time, also by zone/time
-    await col_events().create_index([("run_id", ASCENDING), ("ts_ms", ASCENDING)])
+    # Events: query by run and time, also by zone/time.
+    # _id is the keyset tiebreak for pagination and streaming replay/export.
+    await col_events().create_index(
+        [("run_id", ASCENDING), ("ts_ms", ASCENDING), ("_id", ASCENDING)]
+    )
+    await col_events().create_index([("ts_ms", ASCENDING), ("_id", ASCENDING)])
     await col_events().create_index([("zone_id", ASCENDING), ("ts_ms", ASCENDING)])
     await col_events().create_index([("actor_id", ASCENDING), ("ts_ms", ASCENDING)])
 
-    # Metrics: query by run and time
-    await col_metrics().create_index([("run_id", ASCENDING), ("ts_ms", ASCENDING)])
+    # Metrics: time-series collection bucketed by run/source; index for ts_ms paging
+    await _ensure_metrics_timeseries()
+    await col_metrics().create_index(
+        [("meta.run_id", ASCENDING), ("ts_ms", ASCENDING), ("_id", ASCENDING)]
+    )
 
     # TTL cleanup (seconds); 0 disables TTL
     if settings.events_ttl_days > 0:
@@ -82,15 +124,36 @@ async def ensure_indexes() -> None:
             [("ts_ms", ASCENDING)],
             expireAfterSeconds=int(settings.events_ttl_days * 86400),
         )
-    if settings.metrics_ttl_days > 0:
-        await col_metrics().create_index(
-            [("ts_ms", ASCENDING)],
-            expireAfterSeconds=int(settings.metrics_ttl_days * 86400),
-        )
 
     # Graph: nodes and edges lookup
     await col_graph().create_index([("type", ASCENDING)])
     await col_graph().create_index([("id", ASCENDING)])
+    # Incremental graph edits address edges by endpoints.
+    await col_graph().create_index([("from", ASCENDING), ("to", ASCENDING)])
 
     # Actors: fast lookup by actor_id
     await col_actors().create_index([("actor_id", ASCENDING)], unique=True)
+    # Startup restore: only actors currently inside a zone (multikey).
+    await col_actors().create_index([("inside", ASCENDING)])
+    await col_actors().create_index([("last_seen_ms", ASCENDING)])
+
+    # Replay checkpoints: nearest checkpoint at or before a timestamp
+    await col_checkpoints().create_index([("run_id", ASCENDING), ("ts_ms", ASCENDING)])
+
+
+async def _ensure_metrics_timeseries() -> None:
+    db = get_db()
+    name = col_metrics().name
+    if await db.list_collection_names(filter={"name": name}):
+        return
+    opts = {
+        "timeseries": {"timeField": "ts", "metaField": "meta", "granularity": "seconds"},
+    }
+    # Time-series TTL is a collection option, not a ts_ms index.
+    if settings.metrics_ttl_days > 0:
+        opts["expireAfterSeconds"] = int(settings.metrics_ttl_days * 86400)
+    try:
+        await db.create_collection(name, **opts)
+    except CollectionInvalid:
+        # Another worker created it first.
+        pass
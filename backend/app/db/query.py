@@ -0,0 +1,487 @@
+"""
+db/query.py
+What this file does:
+- Evaluates the MongoDB query language subset the repos use, over plain dicts:
+  filters, update operators, projections, sorts and the aggregation stages
+  behind the latency/metric summaries.
+- Orders values the way MongoDB does across types (null < numbers < strings <
+  objects < arrays < binary < ObjectId < bool < dates), so sorts and index
+  ranges in the embedded backend agree with the server.
+Used by db/embedded.py; anything outside the subset raises
+NotImplementedError instead of silently matching differently.
+"""
+
+from __future__ import annotations
+
+import math
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from bson import ObjectId
+
+# Sentinels that sort below/above every sort_key() value.
+MIN_KEY: Tuple = (-1,)
+MAX_KEY: Tuple = (100,)
+# An empty array sorts (and is indexed) below null and missing fields.
+EMPTY_ARRAY_KEY: Tuple = (0,)
+
+_MISSING = object()
+
+
+def _rank(v: Any) -> int:
+    if v is None:
+        return 1
+    if isinstance(v, bool):
+        return 8
+    if isinstance(v, (int, float)):
+        return 2
+    if isinstance(v, str):
+        return 3
+    if isinstance(v, dict):
+        return 4
+    if isinstance(v, (list, tuple)):
+        return 5
+    if isinstance(v, (bytes, bytearray)):
+        return 6
+    if isinstance(v, ObjectId):
+        return 7
+    if isinstance(v, datetime):
+        return 9
+    raise NotImplementedError(f"unsupported value type {type(v).__name__}")
+
+
+def sort_key(v: Any) -> Tuple:
+    """
+    Totally ordered, hashable key for any stored value.
+    """
+    rank = _rank(v)
+    if rank == 1:
+        return (1,)
+    if rank == 2:
+        return (2, 0.0 if v != v else v)  # NaN sorts with zero rather than breaking order
+    if rank == 3 or rank == 6:
+        return (rank, bytes(v) if rank == 6 else v)
+    if rank == 4:
+        return (4, tuple((k, sort_key(x)) for k, x in v.items()))
+    if rank == 5:
+        return (5, tuple(sort_key(x) for x in v))
+    if rank == 7:
+        return (7, v.binary)
+    if rank == 8:
+        return (8, int(v))
+    return (9, _utc(v).timestamp())
+
+
+def _utc(d: datetime) -> datetime:
+    # Documents read back from disk are tz-aware; callers may pass naive UTC.
+    return d if d.tzinfo is not None else d.replace(tzinfo=timezone.utc)
+
+
+def clone(v: Any) -> Any:
+    if isinstance(v, dict):
+        return {k: clone(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [clone(x) for x in v]
+    return v
+
+
+# ---- paths ----
+
+
+def get_path(doc: Any, path: str, default: Any = None) -> Any:
+    """
+    Plain dotted lookup without array traversal (expressions, sorts).
+    """
+    cur = doc
+    for part in path.split("."):
+        if isinstance(cur, dict):
+            cur = cur.get(part, _MISSING)
+        elif isinstance(cur, list) and part.isdigit() and int(part) < len(cur):
+            cur = cur[int(part)]
+        else:
+            return default
+        if cur is _MISSING:
+            return default
+    return cur
+
+
+def path_values(doc: Any, path: str) -> List[Any]:
+    """
+    Every value a query on path can see: arrays along the way are traversed,
+    and a final array contributes itself and its elements. [] means missing.
+    """
+    cur = [doc]
+    for part in path.split("."):
+        nxt = []
+        for c in cur:
+            if isinstance(c, dict):
+                if part in c:
+                    nxt.append(c[part])
+            elif isinstance(c, list):
+                if part.isdigit() and int(part) < len(c):
+                    nxt.append(c[int(part)])
+                else:
+                    nxt.extend(x[part] for x in c if isinstance(x, dict) and part in x)
+        cur = nxt
+    out = []
+    for v in cur:
+        out.append(v)
+        if isinstance(v, list):
+            out.extend(v)
+    return out
+
+
+def set_path(doc: Dict[str, Any], path: str, value: Any) -> None:
+    parts = path.split(".")
+    cur = doc
+    for part in parts[:-1]:
+        nxt = cur.get(part)
+        if not isinstance(nxt, dict):
+            nxt = cur[part] = {}
+        cur = nxt
+    cur[parts[-1]] = value
+
+
+def unset_path(doc: Dict[str, Any], path: str) -> None:
+    parts = path.split(".")
+    cur = doc
+    for part in parts[:-1]:
+        cur = cur.get(part)
+        if not isinstance(cur, dict):
+            return
+    cur.pop(parts[-1], None)
+
+
+# ---- filters ----
+
+
+def _eq(a: Any, b: Any) -> bool:
+    if isinstance(a, bool) != isinstance(b, bool):
+        return False
+    if isinstance(a, datetime) and isinstance(b, datetime):
+        return _utc(a) == _utc(b)
+    return a == b
+
+
+def _eq_any(values: List[Any], target: Any) -> bool:
+    if target is None and not values:
+        return True  # {field: null} also matches a missing field
+    return any(_eq(v, target) for v in values)
+
+
+def _cmp_any(values: List[Any], target: Any, op: str) -> bool:
+    tk = sort_key(target)
+    for v in values:
+        # Comparisons only match within a type bracket, as on the server.
+        if _rank(v) != tk[0]:
+            continue
+        vk = sort_key(v)
+        if (
+            (op == "$gt" and vk > tk)
+            or (op == "$gte" and vk >= tk)
+            or (op == "$lt" and vk < tk)
+            or (op == "$lte" and vk <= tk)
+        ):
+            return True
+    return False
+
+
+def is_operator_dict(v: Any) -> bool:
+    return isinstance(v, dict) and bool(v) and all(k.startswith("$") for k in v)
+
+
+def matches(doc: Dict[str, Any], q: Dict[str, Any]) -> bool:
+    for key, cond in q.items():
+        if key == "$and":
+            if not all(matches(doc, sub) for sub in cond):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, sub) for sub in cond):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, sub) for sub in cond):
+                return False
+        elif key.startswith("$"):
+            raise NotImplementedError(f"unsupported query operator {key}")
+        elif not _match_field(path_values(doc, key), cond):
+            return False
+    return True
+
+
+def _match_field(values: List[Any], cond: Any) -> bool:
+    if not is_operator_dict(cond):
+        return _eq_any(values, cond)
+    for op, arg in cond.items():
+        if op == "$eq":
+            ok = _eq_any(values, arg)
+        elif op == "$ne":
+            ok = not _eq_any(values, arg)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            ok = _cmp_any(values, arg, op)
+        elif op == "$in":
+            ok = any(_eq_any(values, x) for x in arg)
+        elif op == "$nin":
+            ok = not any(_eq_any(values, x) for x in arg)
+        elif op == "$exists":
+            ok = bool(values) == bool(arg)
+        elif op == "$not":
+            ok = not _match_field(values, arg)
+        else:
+            raise NotImplementedError(f"unsupported query operator {op}")
+        if not ok:
+            return False
+    return True
+
+
+def equality_fields(q: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fields fixed by the filter (plain values, $eq, and inside $and); seeds upserts.
+    """
+    out: Dict[str, Any] = {}
+    for key, cond in q.items():
+        if key == "$and":
+            for sub in cond:
+                out.update(equality_fields(sub))
+        elif key.startswith("$"):
+            continue
+        elif not is_operator_dict(cond):
+            out[key] = cond
+        elif "$eq" in cond:
+            out[key] = cond["$eq"]
+    return out
+
+
+# ---- updates ----
+
+
+def apply_update(doc: Dict[str, Any], update: Dict[str, Any], inserting: bool = False) -> Dict[str, Any]:
+    """
+    New document with update applied; doc itself is left untouched.
+    """
+    if not any(k.startswith("$") for k in update):
+        out = clone(update)
+        if "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    out = clone(doc)
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and inserting):
+            for path, value in fields.items():
+                set_path(out, path, clone(value))
+        elif op == "$setOnInsert":
+            continue
+        elif op == "$unset":
+            for path in fields:
+                unset_path(out, path)
+        elif op == "$inc":
+            for path, value in fields.items():
+                current = get_path(out, path, 0)
+                if not isinstance(current, (int, float)) or isinstance(current, bool):
+                    raise ValueError(f"cannot $inc non-numeric field {path}")
+                set_path(out, path, current + value)
+        else:
+            raise NotImplementedError(f"unsupported update operator {op}")
+    return out
+
+
+# ---- projections and sorts ----
+
+
+def project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return doc
+    include_id = bool(projection.get("_id", 1))
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and any(fields.values()):
+        out: Dict[str, Any] = {}
+        if include_id and "_id" in doc:
+            out["_id"] = doc["_id"]
+        for path in fields:
+            value = get_path(doc, path, _MISSING)
+            if value is not _MISSING:
+                set_path(out, path, value)
+        return out
+    for path in fields:
+        unset_path(doc, path)
+    if not include_id:
+        doc.pop("_id", None)
+    return doc
+
+
+def normalize_sort(sort: Any, direction: Optional[int] = None) -> List[Tuple[str, int]]:
+    if sort is None:
+        return []
+    if isinstance(sort, str):
+        return [(sort, direction or 1)]
+    if isinstance(sort, dict):
+        return [(k, int(v)) for k, v in sort.items()]
+    return [(k, int(v)) for k, v in sort]
+
+
+def _sort_value(doc: Dict[str, Any], path: str, direction: int) -> Tuple:
+    value = get_path(doc, path)
+    if isinstance(value, list):
+        if not value:
+            return EMPTY_ARRAY_KEY
+        # Arrays sort by their smallest (ascending) or largest (descending) element.
+        keys = [sort_key(x) for x in value]
+        return min(keys) if direction > 0 else max(keys)
+    return sort_key(value)
+
+
+def sort_docs(docs: List[Dict[str, Any]], spec: Sequence[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    for path, direction in reversed(spec):
+        docs.sort(key=lambda d: _sort_value(d, path, direction), reverse=direction < 0)
+    return docs
+
+
+# ---- aggregation ----
+
+
+def _number(v: Any) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def evaluate(expr: Any, doc: Dict[str, Any]) -> Any:
+    if isinstance(expr, str) and expr.startswith("$"):
+        return get_path(doc, expr[1:])
+    if isinstance(expr, list):
+        return [evaluate(x, doc) for x in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if not is_operator_dict(expr):
+        return {k: evaluate(v, doc) for k, v in expr.items()}
+    (op, arg), = expr.items()
+    if op == "$literal":
+        return arg
+    if op == "$cond":
+        if isinstance(arg, dict):
+            arg = [arg["if"], arg["then"], arg["else"]]
+        return evaluate(arg[1] if _truthy(evaluate(arg[0], doc)) else arg[2], doc)
+    if op == "$ifNull":
+        for x in arg[:-1]:
+            value = evaluate(x, doc)
+            if value is not None:
+                return value
+        return evaluate(arg[-1], doc)
+    args = evaluate(arg, doc) if isinstance(arg, list) else [evaluate(arg, doc)]
+    if op == "$isNumber":
+        return _number(args[0])
+    if any(a is None for a in args):
+        return None
+    if op == "$subtract":
+        a, b = args
+        if isinstance(a, datetime) and isinstance(b, datetime):
+            return int((_utc(a) - _utc(b)).total_seconds() * 1000)
+        return a - b
+    if op == "$add":
+        return sum(args)
+    if op == "$multiply":
+        return math.prod(args)
+    if op == "$divide":
+        return args[0] / args[1]
+    if op == "$mod":
+        a, b = args
+        # Truncated remainder (sign of the dividend), like the server.
+        r = math.fmod(a, b)
+        return int(r) if isinstance(a, int) and isinstance(b, int) else r
+    raise NotImplementedError(f"unsupported expression operator {op}")
+
+
+def _truthy(v: Any) -> bool:
+    return v is not None and v is not False and v != 0
+
+
+def _accumulate(op: str, arg: Any, docs: List[Dict[str, Any]]) -> Any:
+    if op == "$sum":
+        values = [evaluate(arg, d) for d in docs]
+        return sum(v for v in values if _number(v))
+    if op == "$avg":
+        values = [v for v in (evaluate(arg, d) for d in docs) if _number(v)]
+        return sum(values) / len(values) if values else None
+    if op in ("$min", "$max"):
+        values = [v for v in (evaluate(arg, d) for d in docs) if v is not None]
+        if not values:
+            return None
+        pick = min if op == "$min" else max
+        return pick(values, key=sort_key)
+    if op == "$first":
+        return evaluate(arg, docs[0]) if docs else None
+    if op == "$last":
+        return evaluate(arg, docs[-1]) if docs else None
+    if op == "$push":
+        return [evaluate(arg, d) for d in docs]
+    if op == "$percentile":
+        # Exact (the server's "discrete" method); "approximate" permits it.
+        values = sorted(v for v in (evaluate(arg["input"], d) for d in docs) if _number(v))
+        if not values:
+            return [None] * len(arg["p"])
+        n = len(values)
+        return [values[min(max(math.ceil(p * n) - 1, 0), n - 1)] for p in arg["p"]]
+    raise NotImplementedError(f"unsupported accumulator {op}")
+
+
+def _project_stage(docs: Iterable[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    out = []
+    id_spec = spec.get("_id", 1)
+    for d in docs:
+        row: Dict[str, Any] = {}
+        if id_spec is True or id_spec == 1:
+            if "_id" in d:
+                row["_id"] = d["_id"]
+        elif id_spec is not False and id_spec != 0:
+            row["_id"] = evaluate(id_spec, d)
+        for name, expr in spec.items():
+            if name == "_id":
+                continue
+            if expr is True or expr == 1:
+                value = get_path(d, name, _MISSING)
+                if value is not _MISSING:
+                    set_path(row, name, value)
+            elif expr is False or expr == 0:
+                continue
+            else:
+                row[name] = evaluate(expr, d)
+        out.append(row)
+    return out
+
+
+def _group_stage(docs: Iterable[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    groups: Dict[Tuple, Tuple[Any, List[Dict[str, Any]]]] = {}
+    for d in docs:
+        key = evaluate(spec["_id"], d)
+        groups.setdefault(sort_key(key), (key, []))[1].append(d)
+    out = []
+    for key, members in groups.values():
+        row: Dict[str, Any] = {"_id": key}
+        for name, acc in spec.items():
+            if name == "_id":
+                continue
+            (op, arg), = acc.items()
+            row[name] = _accumulate(op, arg, members)
+        out.append(row)
+    return out
+
+
+def run_pipeline(docs: Iterable[Dict[str, Any]], pipeline: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    $match/$project/$group/$sort/$skip/$limit over already-cloned documents.
+    """
+    rows: Iterable[Dict[str, Any]] = docs
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            rows = [d for d in rows if matches(d, spec)]
+        elif name == "$project":
+            rows = _project_stage(rows, spec)
+        elif name == "$group":
+            rows = _group_stage(rows, spec)
+        elif name == "$sort":
+            rows = sort_docs(list(rows), normalize_sort(spec))
+        elif name == "$skip":
+            rows = list(rows)[spec:]
+        elif name == "$limit":
+            rows = list(rows)[:spec]
+        else:
+            raise NotImplementedError(f"unsupported aggregation stage {name}")
+    return list(rows)
@@ -9,8 +9,10 @@ from fastapi import Request, Header, HTTPException
 
 from .runtime_state import RuntimeState
 from .config import settings
-from .planning import GraphManager, SpatialManager
+from .planning import GraphManager, PlanningReplicator, SpatialManager
 from .schemas import SafetyEventIn
+from .metrics_buffer import MetricBuffer
+from .event_stream import RedisEventStream
 import asyncio
 
 
@@ -22,6 +24,10 @@ def get_queue(request: Request) -> "asyncio.Queue[SafetyEventIn]":
     return request.app.state.event_queue
 
 
+def get_event_stream(request: Request) -> RedisEventStream | None:
+    return request.app.state.event_stream
+
+
 def get_graph_manager(request: Request) -> GraphManager:
     return request.app.state.graph_manager
 
@@ -30,6 +36,14 @@ def get_spatial_manager(request: Request) -> SpatialManager:
     return request.app.state.spatial_manager
 
 
+def get_planning_replicator(request: Request) -> PlanningReplicator:
+    return request.app.state.planning_replicator
+
+
+def get_metric_buffer(request: Request) -> MetricBuffer:
+    return request.app.state.metric_buffer
+
+
 def require_edge_key(x_api_key: str | None = Header(default=None)) -> None:
     if settings.edge_api_key and x_api_key != settings.edge_api_key:
         raise HTTPException(status_code=401, detail="invalid edge api key")
@@ -0,0 +1,265 @@
+"""
+event_stream.py
+Durable cross-worker ingestion queue on Redis Streams (ROPT_EVENT_STREAM=true).
+
+POST /events appends to one of N partition streams, chosen by a stable hash
+of actor_id, so every event of an actor lands in the same stream. Each stream
+has one consumer group; a partition is owned by exactly one consumer at a time
+through a lease key, which keeps per-actor order across workers and hosts.
+
+Consumers heartbeat into a sorted set and take their fair share of partitions
+(ceil(partitions / live consumers)), releasing extras when others join. Entries
+are acked and deleted only after the processor has handled them, so delivery is
+at-least-once: when a worker dies its leases expire, the next owner reclaims
+the dead consumer's pending entries (XAUTOCLAIM) and processes them before any
+new ones.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import os
+import socket
+import time
+import uuid
+import zlib
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .schemas import SafetyEventIn
+from . import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# KEYS: partition stream. ARGV: max length, event JSON.
+# Refuses instead of trimming, so a full partition never drops unprocessed events.
+_PUT_LUA = """
+if redis.call('XLEN', KEYS[1]) >= tonumber(ARGV[1]) then
+  return false
+end
+return redis.call('XADD', KEYS[1], '*', 'e', ARGV[2])
+"""
+
+# KEYS: lease key. ARGV: consumer, lease ms. Renew only if still ours.
+_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS: lease key. ARGV: consumer. Release only if still ours.
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def partition_for(actor_id: str, partitions: int) -> int:
+    # crc32, not hash(): must agree across processes.
+    return zlib.crc32(actor_id.encode("utf-8")) % partitions
+
+
+class RedisEventStream:
+    def __init__(
+        self,
+        client,
+        partitions: int = 8,
+        max_len: int = 20000,
+        lease_ms: int = 10000,
+        batch_size: int = 100,
+        block_ms: int = 1000,
+        prefix: str = "ropt:stream:events",
+        group: str = "processors",
+    ):
+        self.client = client
+        self.partitions = max(1, partitions)
+        self.max_len = max(1, max_len)
+        self.lease_ms = max(1000, lease_ms)
+        self.batch_size = max(1, batch_size)
+        self.block_ms = max(1, block_ms)
+        self.prefix = prefix
+        self.group = group
+        self.consumer = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._put = client.register_script(_PUT_LUA)
+        self._renew = client.register_script(_RENEW_LUA)
+        self._release = client.register_script(_RELEASE_LUA)
+        self._owned: Set[int] = set()
+        self._groups_ready = False
+        self.processed = 0
+        self.reclaimed = 0
+        self.failed = 0
+
+    def stream_key(self, partition: int) -> str:
+        return f"{self.prefix}:{partition}"
+
+    def _lease_key(self, partition: int) -> str:
+        return f"{self.prefix}:lease:{partition}"
+
+    @property
+    def _consumers_key(self) -> str:
+        return f"{self.prefix}:consumers"
+
+    async def put(self, e: SafetyEventIn) -> bool:
+        """
+        Append to the actor's partition. False when that partition is full.
+        """
+        key = self.stream_key(partition_for(e.actor_id, self.partitions))
+        return bool(await self._put(keys=[key], args=[self.max_len, e.model_dump_json()]))
+
+    async def ensure_groups(self) -> None:
+        if self._groups_ready:
+            return
+        for p in range(self.partitions):
+            try:
+                await self.client.xgroup_create(self.stream_key(p), self.group, id="0", mkstream=True)
+            except Exception as exc:
+                if "BUSYGROUP" not in str(exc):
+                    raise
+        self._groups_ready = True
+
+    async def run(self, handler: Callable[[SafetyEventIn], Awaitable[None]]) -> None:
+        """
+        Consume owned partitions forever, calling handler once per event in stream order.
+        """
+        await self.ensure_groups()
+        rebalance_s = self.lease_ms / 3000.0
+        next_rebalance = 0.0
+        while True:
+            try:
+                now = time.monotonic()
+                if now >= next_rebalance:
+                    for p in await self._rebalance():
+                        await self._reclaim(p, handler)
+                    next_rebalance = now + rebalance_s
+                if not self._owned:
+                    await asyncio.sleep(rebalance_s)
+                    continue
+                resp = await self.client.xreadgroup(
+                    self.group,
+                    self.consumer,
+                    {self.stream_key(p): ">" for p in sorted(self._owned)},
+                    count=self.batch_size,
+                    block=self.block_ms,
+                )
+                for key, entries in resp or []:
+                    await self._handle(key, entries, handler)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("event stream consumer error: %s", exc)
+                await asyncio.sleep(1.0)
+
+    async def close(self) -> None:
+        """
+        Release leases so other workers take over without waiting for expiry.
+        """
+        for p in list(self._owned):
+            await self._release(keys=[self._lease_key(p)], args=[self.consumer])
+        self._owned.clear()
+        instrumentation.EVENT_STREAM_PARTITIONS.set(0)
+        await self.client.zrem(self._consumers_key, self.consumer)
+
+    async def _rebalance(self) -> List[int]:
+        """
+        Heartbeat, renew leases, then grow or shrink to the fair share.
+        Returns partitions acquired in this pass.
+        """
+        now_ms = int(time.time() * 1000)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.zadd(self._consumers_key, {self.consumer: now_ms})
+            pipe.zremrangebyscore(self._consumers_key, "-inf", now_ms - self.lease_ms)
+            pipe.zcard(self._consumers_key)
+            _, _, live = await pipe.execute()
+        share = math.ceil(self.partitions / max(1, live))
+
+        for p in list(self._owned):
+            if not await self._renew(keys=[self._lease_key(p)], args=[self.consumer, self.lease_ms]):
+                logger.warning("lost lease on event partition %s", p)
+                self._owned.discard(p)
+
+        while len(self._owned) > share:
+            p = max(self._owned)
+            await self._release(keys=[self._lease_key(p)], args=[self.consumer])
+            self._owned.discard(p)
+
+        acquired: List[int] = []
+        if len(self._owned) < share:
+            # Start at a consumer-specific offset so workers don't all race for partition 0.
+            start = zlib.crc32(self.consumer.encode("utf-8")) % self.partitions
+            for i in range(self.partitions):
+                if len(self._owned) >= share:
+                    break
+                p = (start + i) % self.partitions
+                if p in self._owned:
+                    continue
+                if await self.client.set(self._lease_key(p), self.consumer, nx=True, px=self.lease_ms):
+                    self._owned.add(p)
+                    acquired.append(p)
+        instrumentation.EVENT_STREAM_PARTITIONS.set(len(self._owned))
+        return acquired
+
+    async def _reclaim(self, partition: int, handler: Callable[[SafetyEventIn], Awaitable[None]]) -> None:
+        # Entries delivered to a previous owner but never acked. The lease makes
+        # us the only consumer of this partition, so there is no idle threshold.
+        key = self.stream_key(partition)
+        start = "0-0"
+        while True:
+            resp = await self.client.xautoclaim(
+                key, self.group, self.consumer, min_idle_time=0, start_id=start, count=self.batch_size
+            )
+            start, entries = resp[0], resp[1]
+            entries = [(eid, fields) for eid, fields in entries if fields]
+            if entries:
+                self.reclaimed += len(entries)
+                instrumentation.EVENT_STREAM_RECLAIMED.inc(len(entries))
+                await self._handle(key, entries, handler)
+            if start in ("0-0", b"0-0"):
+                return
+
+    async def _handle(
+        self,
+        key: str,
+        entries: List[Tuple[str, Dict[str, str]]],
+        handler: Callable[[SafetyEventIn], Awaitable[None]],
+    ) -> None:
+        done: List[str] = []
+        for entry_id, fields in entries:
+            try:
+                e = SafetyEventIn.model_validate_json(fields["e"])
+                accept_ms = e.trace.get("accept_ms")
+                if accept_ms is not None:
+                    instrumentation.EVENT_PROCESSOR_LAG.observe(
+                        max(0.0, time.time() * 1000.0 - accept_ms) / 1000.0
+                    )
+                await handler(e)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                # Acked anyway: redelivering a poison entry would stall the partition.
+                self.failed += 1
+                logger.error("event stream entry %s failed: %s", entry_id, exc)
+            done.append(entry_id)
+        if done:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.xack(key, self.group, *done)
+                pipe.xdel(key, *done)
+                await pipe.execute()
+
+    async def stats(self) -> dict:
+        async with self.client.pipeline(transaction=False) as pipe:
+            for p in range(self.partitions):
+                pipe.xlen(self.stream_key(p))
+            lengths = await pipe.execute()
+        return {
+            "consumer": self.consumer,
+            "owned_partitions": sorted(self._owned),
+            "backlog": {str(p): n for p, n in enumerate(lengths)},
+            "processed": self.processed,
+            "reclaimed": self.reclaimed,
+            "failed": self.failed,
+        }
@@ -0,0 +1,111 @@
+"""
+instrumentation.py
+Prometheus counters, gauges and latency histograms for the backend's own hot paths.
+
+Served as text exposition at /internal/metrics so it never collides with the
+/metrics business API. Under gunicorn, set PROMETHEUS_MULTIPROC_DIR (the Docker
+image does); every worker then writes to its own mmap'd files and a scrape of
+any worker returns the sum across all of them.
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# 0.5 ms .. 2.5 s: covers queue hops through cuOpt timeouts.
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+EVENTS_INGESTED = Counter(
+    "ropt_events_ingested_total", "Events received on POST /events", ["result"]
+)
+EVENT_QUEUE_DEPTH = Gauge(
+    "ropt_event_queue_depth", "Events waiting for the processor", multiprocess_mode="livesum"
+)
+EVENT_PROCESSOR_LAG = Histogram(
+    "ropt_event_processor_lag_seconds",
+    "Time from HTTP accept to processor dequeue",
+    buckets=LATENCY_BUCKETS,
+)
+EVENT_STREAM_PARTITIONS = Gauge(
+    "ropt_event_stream_partitions",
+    "Event stream partitions leased by this worker",
+    multiprocess_mode="livesum",
+)
+EVENT_STREAM_RECLAIMED = Counter(
+    "ropt_event_stream_reclaimed_total",
+    "Pending stream entries reclaimed from a dead consumer",
+)
+EVENT_STAGE_SECONDS = Histogram(
+    "ropt_event_stage_seconds",
+    "Per-stage time inside the event processor",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+EVENT_SEGMENT_SECONDS = Histogram(
+    "ropt_event_segment_seconds",
+    "Per-event latency between trace stamps (see tracing.SEGMENTS)",
+    ["segment"],
+    buckets=LATENCY_BUCKETS,
+)
+MONGO_WRITE_SECONDS = Histogram(
+    "ropt_mongo_write_seconds", "MongoDB write latency", ["op"], buckets=LATENCY_BUCKETS
+)
+MONGO_WRITE_ERRORS = Counter("ropt_mongo_write_errors_total", "Failed MongoDB writes", ["op"])
+ACTOR_WRITE_PENDING = Gauge(
+    "ropt_actor_write_pending",
+    "Actors with state waiting for the write-behind flush",
+    multiprocess_mode="livesum",
+)
+ACTORS_EXPIRED = Counter(
+    "ropt_actors_expired_total", "Actors dropped after ROPT_ACTOR_TTL_S without events"
+)
+SNAPSHOT_BUILD_SECONDS = Histogram(
+    "ropt_snapshot_build_seconds", "Time to build a state snapshot", buckets=LATENCY_BUCKETS
+)
+WS_FANOUT_SECONDS = Histogram(
+    "ropt_ws_fanout_seconds",
+    "Time to serialize and hand a broadcast to every client queue (or Redis)",
+    buckets=LATENCY_BUCKETS,
+)
+WS_CONNECTIONS = Gauge(
+    "ropt_ws_connections", "Open /ws connections", multiprocess_mode="livesum"
+)
+WS_DROPPED = Counter("ropt_ws_dropped_total", "WebSocket messages dropped for slow clients")
+CUOPT_SOLVE_SECONDS = Histogram(
+    "ropt_cuopt_solve_seconds", "Solver call latency including fallback", buckets=LATENCY_BUCKETS
+)
+CUOPT_SOLVES = Counter(
+    "ropt_cuopt_solves_total",
+    "Solver calls by outcome (cuopt, fallback, or short_circuit while the breaker is open)",
+    ["outcome"],
+)
+CUOPT_BREAKER_OPEN = Gauge("ropt_cuopt_breaker_open", "1 while the solver circuit breaker is open")
+
+
+def stage(name: str):
+    """
+    Timer context for one _event_processor stage: `with stage("persist"): ...`
+    """
+    return EVENT_STAGE_SECONDS.labels(stage=name).time()
+
+
+def render() -> Tuple[bytes, str]:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -6,23 +6,40 @@ Unified backend entrypoint. Creates the FastAPI app and wires everything.
 from __future__ import annotations
 
 import asyncio
+import functools
 import logging
+import time
+from typing import Awaitable, Callable, Sequence
 import structlog
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 
 from .config import settings
+from . import instrumentation
 from .runtime_state import RuntimeState, RedisRuntimeState, now_ms
 from .schemas import SafetyEventIn
-from .db.mongo import ensure_indexes, get_db
-from .repos import events_repo, runs_repo, zones_repo
+from .db.mongo import close_client, ensure_indexes, get_db
+from .repos import actors_repo, archive_repo, events_repo, metric_repo, runs_repo, zones_repo
 from .routers import health, zones, events, runs, metrics
 from .ws import ConnectionManager
-from .planning import GraphManager, SpatialManager, create_planning_router
+from .replay import ReplaySession, RunCheckpointer
+from .archiver import run_archiver
+from .metrics_buffer import MetricBuffer
+from .actor_writer import ActorStateWriter
+from .event_stream import RedisEventStream
+from .tracing import TraceWriter, stamp
+from .planning import (
+    FleetPlanner,
+    GraphManager,
+    PlanningReplicator,
+    SpatialManager,
+    create_planning_router,
+)
+from .planning.fleet import Robot, parse_fleet
 from .cuopt_client import client as cuopt_client
-from .db.mongo import col_actors
 import redis.asyncio as redis
+from bson import ObjectId
 
 
 def create_app() -> FastAPI:
@@ -47,9 +64,44 @@ def create_app() -> FastAPI:
     queue: "asyncio.Queue[SafetyEventIn]" = asyncio.Queue(
         maxsize=settings.event_queue_max
     )
-    ws_manager = ConnectionManager(redis_client=redis_client)
-    graph_manager = GraphManager()
+    ws_manager = ConnectionManager(
+        redis_client=redis_client,
+        send_queue_max=settings.ws_send_queue_max,
+        slow_consumer_policy=settings.ws_slow_consumer_policy,
+        tick_interval_s=1.0 / settings.ws_tick_hz if settings.ws_tick_hz > 0 else 0.0,
+    )
+    graph_manager = GraphManager(
+        artifact_dir=settings.planning_artifact_dir,
+        cost_table_max_nodes=settings.planning_cost_table_max_nodes,
+    )
     spatial_manager = SpatialManager()
+    planning_replicator = PlanningReplicator(graph_manager, redis_client)
+    fleet_planner = FleetPlanner(graph_manager, workers=settings.planning_workers)
+    fleet = parse_fleet(settings.planning_fleet)
+    metric_buffer = MetricBuffer(
+        flush_ms=settings.metrics_flush_ms,
+        flush_max=settings.metrics_flush_max,
+        max_pending=settings.metrics_buffer_max,
+    )
+    trace_writer = TraceWriter(flush_ms=settings.trace_flush_ms)
+    actor_writer = ActorStateWriter(
+        flush_ms=settings.actor_flush_ms, flush_max=settings.actor_flush_max
+    )
+    checkpointer = RunCheckpointer(
+        every_events=settings.replay_checkpoint_events,
+        every_s=settings.replay_checkpoint_s,
+    )
+    event_stream: RedisEventStream | None = None
+    if settings.event_stream:
+        if redis_client is None:
+            raise RuntimeError("ROPT_EVENT_STREAM requires ROPT_REDIS_URL")
+        event_stream = RedisEventStream(
+            redis_client,
+            partitions=settings.event_stream_partitions,
+            max_len=settings.event_queue_max,
+            lease_ms=settings.event_stream_lease_ms,
+            batch_size=settings.event_stream_batch,
+        )
 
     # include routers
     app.include_router(health.router)
@@ -57,180 +109,417 @@ def create_app() -> FastAPI:
     app.include_router(events.router)
     app.include_router(runs.router)
     app.include_router(metrics.router)
-    app.include_router(create_planning_router(graph_manager))
+    app.include_router(create_planning_router(graph_manager, planning_replicator, fleet_planner))
 
     # store shared singletons for DI
     app.state.runtime_state = state
     app.state.event_queue = queue
+    app.state.event_stream = event_stream
     app.state.graph_manager = graph_manager
     app.state.spatial_manager = spatial_manager
+    app.state.planning_replicator = planning_replicator
+    app.state.fleet_planner = fleet_planner
     app.state.redis = redis_client
+    app.state.ws_manager = ws_manager
+    app.state.metric_buffer = metric_buffer
 
     @app.on_event("startup")
     async def startup():
         await _wait_for_mongo()
         await ensure_indexes()
-        await graph_manager.load_base_graph()
+        # In the background: the copy is as large as the legacy collection.
+        asyncio.create_task(_migrate_legacy_metrics())
         try:
             current_zones = await zones_repo.get_zones()
-            graph_manager.refresh_zone_index(current_zones)
-            await spatial_manager.recompute_mappings()
-            graph_manager.zone_to_nodes = spatial_manager.zone_to_nodes
-            graph_manager._recompute_blocked_nodes()
         except Exception:
             # If zones are not available yet, keep empty mapping.
-            pass
+            current_zones = None
+        if current_zones is not None and await graph_manager.warm_start(current_zones):
+            spatial_manager.load_mappings(graph_manager.zone_to_nodes)
+        else:
+            await graph_manager.load_base_graph()
+            if current_zones is not None:
+                graph_manager.refresh_zone_index(current_zones)
+                await spatial_manager.recompute_mappings()
+                graph_manager.zone_to_nodes = spatial_manager.zone_to_nodes
+                graph_manager._recompute_blocked_nodes()
+                await graph_manager.save_artifact(current_zones)
         await _restore_blocked_state(graph_manager)
+        await planning_replicator.start()
+        await fleet_planner.start()
         if redis_client:
             asyncio.create_task(ws_manager.start_redis_listener())
-        asyncio.create_task(_event_processor(state, queue, ws_manager, graph_manager))
+            asyncio.create_task(planning_replicator.listen())
+        asyncio.create_task(cuopt_client.run_health_checker())
+        asyncio.create_task(metric_buffer.run())
+        asyncio.create_task(trace_writer.run())
+        asyncio.create_task(actor_writer.run())
+        if settings.archive_dir:
+            asyncio.create_task(
+                run_archiver(settings.archive_interval_s, settings.archive_after_s)
+            )
+        if ws_manager.ticking:
+            asyncio.create_task(
+                ws_manager.run_ticker(lambda: _snapshot_message(state, graph_manager))
+            )
+        process = functools.partial(
+            _process_event,
+            state=state,
+            ws_manager=ws_manager,
+            graph_manager=graph_manager,
+            replicator=planning_replicator,
+            checkpointer=checkpointer,
+            trace_writer=trace_writer,
+            actor_writer=actor_writer,
+            fleet_planner=fleet_planner,
+            fleet=fleet,
+        )
+        if settings.actor_ttl_s > 0:
+            asyncio.create_task(
+                _actor_expirer(
+                    state,
+                    functools.partial(_enqueue_event, queue=queue, event_stream=event_stream),
+                    actor_writer,
+                    settings.actor_ttl_s,
+                )
+            )
+        if event_stream is not None:
+            asyncio.create_task(event_stream.run(process))
+        else:
+            asyncio.create_task(_event_processor(queue, process))
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        if event_stream is not None:
+            await event_stream.close()
+        await metric_buffer.flush()
+        await trace_writer.flush()
+        await actor_writer.flush()
+        await checkpointer.close()
+        fleet_planner.close()
+        await close_client()
 
     @app.get("/state")
     async def get_state():
+        planning_version = await planning_replicator.ensure_current()
         snap = await state.snapshot()
         snap["blocked_zones"] = list(graph_manager.blocked_zones)
         snap["blocked_nodes"] = list(graph_manager.blocked_nodes)
+        snap["planning_version"] = planning_version
         return snap
 
     @app.websocket("/ws")
     async def websocket_endpoint(ws: WebSocket):
         await ws_manager.connect(ws)
         try:
-            snap = await state.snapshot()
-            snap["blocked_zones"] = list(graph_manager.blocked_zones)
-            snap["blocked_nodes"] = list(graph_manager.blocked_nodes)
-            await ws.send_json({"type": "snapshot", "data": snap})
+            ws_manager.send_json(ws, await _snapshot_message(state, graph_manager))
             while True:
-                await ws.receive_text()
+                ack = ws_manager.handle_client_message(ws, await ws.receive_text())
+                if ack is not None:
+                    ws_manager.send_json(ws, ack)
         except WebSocketDisconnect:
+            pass
+        finally:
             ws_manager.disconnect(ws)
 
+    @app.get("/internal/metrics", include_in_schema=False)
+    async def internal_metrics():
+        instrumentation.EVENT_QUEUE_DEPTH.set(queue.qsize())
+        body, content_type = instrumentation.render()
+        return Response(content=body, media_type=content_type)
+
+    @app.get("/internal/buffers")
+    async def buffer_stats():
+        return {
+            "actor_state": actor_writer.stats(),
+            "metrics": metric_buffer.stats(),
+            "event_traces": trace_writer.stats(),
+        }
+
+    @app.get("/ws/stats")
+    async def websocket_stats():
+        return ws_manager.stats()
+
     @app.websocket("/ws/replay/{run_id}")
     async def websocket_replay(ws: WebSocket, run_id: str):
         await ws.accept()
-        speed = float(ws.query_params.get("speed", "1.0"))
-        limit = int(ws.query_params.get("limit", "5000"))
-        limit = max(1, min(limit, 10000))
-        speed = max(0.1, min(speed, 10.0))
-        events = await events_repo.query_events(run_id=run_id, limit=limit)
-        if not events:
-            await ws.send_json({"type": "replay_done", "data": {"run_id": run_id}})
-            await ws.close()
-            return
-        prev_ts = events[0].get("ts_ms", 0)
-        for evt in events:
-            ts = evt.get("ts_ms", prev_ts)
-            delay_s = max(0.0, (ts - prev_ts) / 1000.0 / speed)
-            await asyncio.sleep(min(delay_s, 2.0))
-            await ws.send_json({"type": "replay_event", "data": evt})
-            prev_ts = ts
-        await ws.send_json({"type": "replay_done", "data": {"run_id": run_id}})
+        # Optional cap; the stream itself is unbounded and memory stays flat.
+        limit = int(ws.query_params.get("limit", "0")) or None
+        session = ReplaySession(
+            ws,
+            run_id,
+            speed=float(ws.query_params.get("speed", "1.0")),
+            limit=limit,
+            batch_size=settings.replay_batch_size,
+            prefetch_batches=settings.replay_prefetch_batches,
+        )
+        try:
+            await session.run()
+        except WebSocketDisconnect:
+            pass
 
     return app
 
 
 async def _event_processor(
-    state: RuntimeState,
     queue: "asyncio.Queue[SafetyEventIn]",
-    ws_manager: ConnectionManager,
-    graph_manager: GraphManager,
+    process: Callable[[SafetyEventIn], Awaitable[None]],
 ) -> None:
     while True:
         e = await queue.get()
+        instrumentation.EVENT_QUEUE_DEPTH.set(queue.qsize())
+        if e._accepted_at:
+            instrumentation.EVENT_PROCESSOR_LAG.observe(time.monotonic() - e._accepted_at)
         try:
-            run_id = e.run_id or await state.get_active_run_id()
-            if run_id is None:
-                run_id = await runs_repo.start_run("auto_run")
-                await state.set_active_run_id(run_id)
-
-            actor = await state.upsert_actor(e.actor_id, e.ts_ms)
-            prev = actor.zones.get(e.zone_id, False)
-            inside = True if "ENTER" in e.event_type else False if "EXIT" in e.event_type else prev
-            actor.zones[e.zone_id] = inside
-            await state.save_actor(e.actor_id, actor)
-
-            doc = e.model_dump()
-            doc["run_id"] = run_id
-            doc["received_ms"] = now_ms()
-            try:
-                _id = await events_repo.insert_event(doc)
-                doc["_id"] = _id
-            except Exception as exc:
-                logger.error(
-                    "mongo_write_failed",
-                    actor_id=e.actor_id,
-                    zone_id=e.zone_id,
-                    event_type=e.event_type,
-                    error=str(exc),
-                )
-
-            await state.push_event(doc)
-            snap = await state.snapshot()
-            snap["blocked_zones"] = list(graph_manager.blocked_zones)
-            snap["blocked_nodes"] = list(graph_manager.blocked_nodes)
-            await ws_manager.broadcast_json({"type": "snapshot", "data": snap})
-            if e.zone_id and ("ENTER" in e.event_type or "EXIT" in e.event_type):
-                graph_manager.update_zone_block(
-                    e.zone_id, blocked="ENTER" in e.event_type
-                )
-                matrix_data = graph_manager.get_cost_matrix()
-                constraints = _build_constraints_from_event(graph_manager, e, matrix_data)
-                result = cuopt_client.solve(matrix_data=matrix_data, constraints=constraints)
-                routes = result.get("routes", {})
-                first_robot = next(iter(routes.keys()), "robot_1")
-                await ws_manager.broadcast_json(
-                    {
-                        "type": "route_update",
-                        "data": {
-                            "robot_id": first_robot,
-                            "optimal_path": routes.get(first_robot, []),
-                            "candidates": [],
-                            "is_reroute": "ENTER" in e.event_type,
-                        },
-                    }
-                )
-            await _persist_actor_state(actor, e.actor_id)
+            await process(e)
         finally:
             queue.task_done()
 
 
+async def _migrate_legacy_metrics() -> None:
+    try:
+        migrated = await metric_repo.migrate_legacy_metrics()
+    except Exception as exc:
+        # The claim lapses after its lease; the next startup resumes the copy.
+        logger.warning("legacy_metrics_migration_failed", error=str(exc))
+        return
+    if migrated:
+        logger.info("legacy_metrics_migrated", count=migrated)
+
+
+async def _process_event(
+    e: SafetyEventIn,
+    *,
+    state: RuntimeState,
+    ws_manager: ConnectionManager,
+    graph_manager: GraphManager,
+    replicator: PlanningReplicator,
+    checkpointer: RunCheckpointer,
+    trace_writer: TraceWriter,
+    actor_writer: ActorStateWriter,
+    fleet_planner: FleetPlanner,
+    fleet: Sequence[Robot],
+) -> None:
+    stamp(e.trace, "dequeue_ms")
+    if e.run_id and archive_repo.is_archived(e.run_id):
+        # Accepted before the run was archived (queue backlog); the archive is final.
+        instrumentation.EVENTS_INGESTED.labels(result="archived_run").inc()
+        logger.warning("event_for_archived_run", run_id=e.run_id, actor_id=e.actor_id)
+        return
+    doc = e.model_dump()
+    doc["received_ms"] = now_ms()
+    # Assigned up front so the runtime-state copy carries the same id as Mongo.
+    oid = ObjectId()
+    doc["_id"] = str(oid)
+    implicit = e.payload.get("implicit")
+    # Implicit exits only apply while the actor is still as last seen when claimed.
+    if_last_seen_ms = e.payload.get("last_seen_ms") if implicit else None
+    with instrumentation.stage("state_update"):
+        # One call (one Redis round-trip): resolve run, zone transition, push event.
+        run_id, actor = await state.apply_event(doc, if_last_seen_ms)
+        if run_id is None:
+            doc["run_id"] = await runs_repo.start_run("auto_run")
+            await state.set_active_run_id(doc["run_id"])
+            run_id, actor = await state.apply_event(doc, if_last_seen_ms)
+    if actor is None:
+        # Seen again after the claim: its zones stay; remove_actor keeps it (and reschedules it).
+        if e.payload.get("drop"):
+            await state.remove_actor(e.actor_id, if_last_seen_ms)
+        return
+
+    with instrumentation.stage("persist_event"):
+        try:
+            with instrumentation.MONGO_WRITE_SECONDS.labels(op="insert_event").time():
+                await events_repo.insert_event({**doc, "_id": oid})
+            stamp(doc["trace"], "persisted_ms")
+        except Exception as exc:
+            # No _id marks the event as not persisted (its trace is not written).
+            doc.pop("_id", None)
+            instrumentation.MONGO_WRITE_ERRORS.labels(op="insert_event").inc()
+            logger.error(
+                "mongo_write_failed",
+                actor_id=e.actor_id,
+                zone_id=e.zone_id,
+                event_type=e.event_type,
+                error=str(exc),
+            )
+    with instrumentation.stage("checkpoint"):
+        checkpointer.observe(run_id, doc)
+
+    is_transition = bool(e.zone_id) and (
+        "ENTER" in e.event_type or "EXIT" in e.event_type
+    )
+    if is_transition:
+        await replicator.set_zone_block(e.zone_id, blocked="ENTER" in e.event_type)
+    topics = _event_topics(e)
+    with instrumentation.stage("snapshot_broadcast"):
+        # Emergency-zone entries skip the tick; everything else coalesces.
+        if ws_manager.ticking and not _is_emergency_entry(graph_manager, e):
+            ws_manager.mark_dirty(topics)
+        else:
+            await ws_manager.broadcast_snapshot(
+                await _snapshot_message(state, graph_manager), topics
+            )
+    stamp(doc["trace"], "broadcast_ms")
+    if is_transition:
+        with instrumentation.stage("solve"):
+            if fleet_planner.enabled:
+                node_map = {"node_map": graph_manager.node_index()}
+                constraints = _build_constraints_from_event(graph_manager, e, node_map, fleet)
+                result = await fleet_planner.plan(constraints)
+            else:
+                matrix_data = graph_manager.get_waypoint_graph()
+                constraints = _build_constraints_from_event(graph_manager, e, matrix_data, fleet)
+                result = cuopt_client.solve(matrix_data=matrix_data, constraints=constraints)
+        stamp(doc["trace"], "solve_done_ms")
+        routes = result.get("routes", {})
+        first_robot = next(iter(routes.keys()), "robot_1")
+        with instrumentation.stage("route_broadcast"):
+            # One fleet-wide message; robot_id/optimal_path keep the first robot for old clients.
+            await ws_manager.broadcast_json(
+                {
+                    "type": "route_update",
+                    "data": {
+                        "robot_id": first_robot,
+                        "optimal_path": routes.get(first_robot, []),
+                        "candidates": [],
+                        "routes": routes,
+                        "is_reroute": "ENTER" in e.event_type,
+                    },
+                },
+                topics=[*topics, *(f"robot:{r}" for r in routes or [first_robot])],
+            )
+    if e.payload.get("drop") and await state.remove_actor(e.actor_id, if_last_seen_ms):
+        actor_writer.forget(e.actor_id)
+        instrumentation.ACTORS_EXPIRED.inc()
+    else:
+        actor_writer.record(e.actor_id, actor)
+    if not implicit:
+        trace_writer.record(doc.get("_id"), doc["trace"], e.ts_ms)
+
+
+async def _enqueue_event(
+    e: SafetyEventIn,
+    *,
+    queue: "asyncio.Queue[SafetyEventIn]",
+    event_stream: RedisEventStream | None,
+) -> None:
+    # Waits for room instead of dropping: an implicit exit must not be lost.
+    if event_stream is None:
+        await queue.put(e)
+        return
+    while not await event_stream.put(e):
+        await asyncio.sleep(0.5)
+
+
+async def _actor_expirer(
+    state: RuntimeState,
+    enqueue: Callable[[SafetyEventIn], Awaitable[None]],
+    actor_writer: ActorStateWriter,
+    ttl_s: float,
+) -> None:
+    """
+    Expire actors idle for ttl_s: an implicit exit per zone they were inside
+    (unblocks the zone and replans like a real exit), then drop them. The exits
+    go through the event queue/stream so they stay ordered with real events;
+    the last one drops the actor.
+    """
+    ttl_ms = int(ttl_s * 1000)
+    while True:
+        await asyncio.sleep(min(max(1.0, ttl_s / 10.0), 30.0))
+        try:
+            cutoff_ms = now_ms() - ttl_ms
+            for actor_id, actor in await state.claim_expired_actors(cutoff_ms):
+                inside = [zone_id for zone_id, flag in actor.zones.items() if flag]
+                if not inside:
+                    if await state.remove_actor(actor_id, actor.last_seen_ms):
+                        actor_writer.forget(actor_id)
+                        instrumentation.ACTORS_EXPIRED.inc()
+                    continue
+                for i, zone_id in enumerate(inside):
+                    await enqueue(
+                        SafetyEventIn(
+                            event_type="IMPLICIT_EXIT",
+                            # Stamped at the last sighting so replay orders it correctly.
+                            ts_ms=actor.last_seen_ms,
+                            actor_id=actor_id,
+                            zone_id=zone_id,
+                            payload={
+                                "implicit": True,
+                                "reason": "inactive",
+                                "ttl_s": ttl_s,
+                                "last_seen_ms": actor.last_seen_ms,
+                                "drop": i == len(inside) - 1,
+                            },
+                        )
+                    )
+            await actors_repo.prune_actor_states(cutoff_ms)
+        except Exception as exc:
+            logger.warning("actor_expiry_failed", error=str(exc))
+
+
+async def _snapshot_message(state: RuntimeState, graph_manager: GraphManager) -> dict:
+    with instrumentation.SNAPSHOT_BUILD_SECONDS.time():
+        snap = await state.snapshot()
+        snap["blocked_zones"] = list(graph_manager.blocked_zones)
+        snap["blocked_nodes"] = list(graph_manager.blocked_nodes)
+    return {"type": "snapshot", "data": snap}
+
+
+def _event_topics(event: SafetyEventIn) -> list[str]:
+    topics = [f"actor:{event.actor_id}"]
+    if event.zone_id:
+        topics.append(f"zone:{event.zone_id}")
+    return topics
+
+
+def _is_emergency_entry(graph_manager: GraphManager, event: SafetyEventIn) -> bool:
+    return "ENTER" in event.event_type and event.zone_id in graph_manager.emergency_zones
+
+
 async def _restore_blocked_state(graph_manager: GraphManager) -> None:
-    # Reconstruct blocked zones from persisted actor states.
-    cur = col_actors().find({})
-    zone_counts: dict[str, int] = {}
-    async for actor in cur:
-        zones = actor.get("zones") or {}
-        for zone_id, inside in zones.items():
-            if inside:
-                zone_counts[zone_id] = zone_counts.get(zone_id, 0) + 1
-    for zone_id, count in zone_counts.items():
-        if count > 0:
-            graph_manager.update_zone_block(zone_id, blocked=True)
+    # Reconstruct blocked zones from actors persisted as inside a zone.
+    migrated = await actors_repo.backfill_inside()
+    if migrated:
+        logger.info("actor_state_backfilled", count=migrated)
+    since_ms = now_ms() - int(settings.actor_ttl_s * 1000) if settings.actor_ttl_s > 0 else None
+    zones: set[str] = set()
+    for actor in await actors_repo.live_actor_states(since_ms):
+        zones.update(actor.get("inside") or ())
+    for zone_id in zones:
+        graph_manager.update_zone_block(zone_id, blocked=True)
 
 
 def _build_constraints_from_event(
     graph_manager: GraphManager,
     event: SafetyEventIn,
     matrix_data: dict,
+    fleet: Sequence[Robot] = (),
 ) -> dict:
     """
     Minimal constraints builder that maps zone events to node indices.
+    Without a configured fleet a single robot_1 runs first node -> last node.
     """
     node_map = matrix_data.get("node_map", {})
     node_ids = list(node_map.keys())
     if not node_ids:
         return {}
-    start_idx = node_map[node_ids[0]]
-    end_idx = node_map[node_ids[-1]]
+    vehicles, vehicle_ids = [], []
+    for robot_id, start, end in fleet:
+        if start in node_map and end in node_map:
+            vehicles.append([node_map[start], node_map[end]])
+            vehicle_ids.append(robot_id)
+    if not vehicles:
+        vehicles, vehicle_ids = [[node_map[node_ids[0]], node_map[node_ids[-1]]]], ["robot_1"]
     tasks = []
     if event.zone_id and event.zone_id in graph_manager.zone_to_nodes:
-        for node_id in graph_manager.zone_to_nodes[event.zone_id][:3]:
+        for node_id in graph_manager.zone_to_nodes[event.zone_id][: 3 * len(vehicles)]:
             idx = node_map.get(node_id)
             if idx is not None:
                 tasks.append(idx)
     return {
-        "vehicles": [[start_idx, end_idx]],
-        "vehicle_ids": ["robot_1"],
+        "vehicles": vehicles,
+        "vehicle_ids": vehicle_ids,
         "tasks": tasks,
     }
 
@@ -248,17 +537,6 @@ async def _wait_for_mongo(max_attempts: int = 8) -> None:
     raise RuntimeError("MongoDB not reachable after retries")
 
 
-async def _persist_actor_state(actor: object, actor_id: str) -> None:
-    # Save only the actor that changed.
-    if actor is None:
-        return
-    await col_actors().update_one(
-        {"actor_id": actor_id},
-        {"$set": {"actor_id": actor_id, "last_seen_ms": actor.last_seen_ms, "zones": actor.zones}},
-        upsert=True,
-    )
-
-
 def _parse_cors_origins(raw: str) -> list[str]:
     if not raw:
         return ["*"]
@@ -0,0 +1,83 @@
+"""
+metrics_buffer.py
+Server-side write buffer for metric samples.
+
+POST /metrics and POST /metrics/batch append to the buffer and return at once;
+a background task flushes with one unordered insert_many every flush_ms or
+as soon as flush_max samples are pending. Samples still buffered when a worker
+is killed are lost, which is acceptable for performance telemetry.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List
+
+from .repos import metric_repo
+from . import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+class MetricBuffer:
+    def __init__(self, flush_ms: int = 250, flush_max: int = 500, max_pending: int = 50000):
+        self.flush_s = max(1, flush_ms) / 1000.0
+        self.flush_max = max(1, flush_max)
+        self.max_pending = max(self.flush_max, max_pending)
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self.flushed = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def add(self, docs: List[Dict[str, Any]]) -> None:
+        self._pending.extend(metric_repo.to_timeseries_doc(d) for d in docs)
+        if len(self._pending) >= self.max_pending:
+            # Backpressure: the writer is behind, make this request wait for it.
+            await self.flush()
+        elif len(self._pending) >= self.flush_max:
+            self._wake.set()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            started = time.perf_counter()
+            try:
+                with instrumentation.MONGO_WRITE_SECONDS.labels(op="metrics").time():
+                    self.flushed += await metric_repo.insert_metrics(batch)
+            except Exception as exc:
+                self.flush_errors += 1
+                instrumentation.MONGO_WRITE_ERRORS.labels(op="metrics").inc()
+                logger.warning("metric flush of %s samples failed: %s", len(batch), exc)
+                # Keep the samples for the next pass, within the pending cap.
+                room = self.max_pending - len(self._pending)
+                if room > 0:
+                    self._pending[:0] = batch[-room:]
+            finally:
+                self.last_flush_ms = (time.perf_counter() - started) * 1000.0
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "flushed": self.flushed,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+        }
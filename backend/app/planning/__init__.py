@@ -1,5 +1,13 @@
 from .graph_manager import GraphManager
-from .router import create_planning_router
 from .spatial_manager import SpatialManager
+from .replication import PlanningReplicator
+from .fleet import FleetPlanner
+from .router import create_planning_router
 
-__all__ = ["GraphManager", "SpatialManager", "create_planning_router"]
+__all__ = [
+    "GraphManager",
+    "SpatialManager",
+    "PlanningReplicator",
+    "FleetPlanner",
+    "create_planning_router",
+]
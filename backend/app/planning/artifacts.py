@@ -0,0 +1,253 @@
+"""
+planning/artifacts.py
+Versioned binary snapshot of planning state, memory-mapped on warm start.
+
+One file per (graph version in Mongo, zones fingerprint) holds:
+- the node index (ids in header, x/y as float64 arrays)
+- the adjacency in CSR form (offsets, target indices, weights)
+- zone -> node indices in CSR form, plus the emergency zone ids
+- the base cost table (n x n float64) when n <= the configured cap
+- the original node/edge JSON, parsed only if something needs the full dicts
+
+Layout: 8-byte magic, u64 header length, JSON header, then 8-byte aligned
+little-endian arrays. Files are written to a temp name and renamed, so a
+worker either maps a complete file or none; every worker on the host maps the
+same file read-only and shares its pages.
+"""
+
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"ROPTPA01"
+INF = 1_000_000.0
+
+
+def zones_fingerprint(zones: Iterable[Dict[str, Any]]) -> str:
+    canon = sorted(
+        (z.get("zone_id") or "", z.get("polygon") or [], z.get("severity") or "") for z in zones
+    )
+    return hashlib.sha1(json.dumps(canon, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def artifact_path(directory: str, graph_version: int, zones_fp: str) -> str:
+    return os.path.join(directory, f"planning-v{graph_version}-{zones_fp[:16]}.bin")
+
+
+def build_csr(
+    index: Dict[str, int], edges: Iterable[Dict[str, Any]]
+) -> Tuple[array, array, array]:
+    """
+    Adjacency by source as (offsets, targets, weights). Later duplicates of an
+    edge win and edges to unknown nodes are dropped, as in get_cost_matrix.
+    """
+    adj: List[Dict[int, float]] = [dict() for _ in range(len(index))]
+    for e in edges:
+        u, v = index.get(e.get("from")), index.get(e.get("to"))
+        if u is not None and v is not None:
+            adj[u][v] = float(e.get("weight", 1.0))
+    offsets, targets, weights = array("q", [0]), array("i"), array("d")
+    for row in adj:
+        for v, w in row.items():
+            targets.append(v)
+            weights.append(w)
+        offsets.append(len(targets))
+    return offsets, targets, weights
+
+
+def build_cost_rows(
+    n: int, offsets: array, targets: array, weights: array
+) -> array:
+    # Same values get_cost_matrix produces before blocked nodes are applied.
+    table = array("d", [INF]) * (n * n)
+    for i in range(n):
+        table[i * n + i] = 0.0
+        for k in range(offsets[i], offsets[i + 1]):
+            table[i * n + targets[k]] = weights[k]
+    return table
+
+
+def write_artifact(
+    path: str,
+    graph_version: int,
+    zones_fp: str,
+    nodes: List[Dict[str, Any]],
+    edges: List[Dict[str, Any]],
+    zone_to_nodes: Dict[str, List[str]],
+    emergency_zones: Iterable[str],
+    max_table_nodes: int,
+) -> None:
+    node_ids = [n["id"] for n in nodes if "id" in n]
+    index = {node_id: i for i, node_id in enumerate(node_ids)}
+    n = len(node_ids)
+    nan = float("nan")
+    xs = array("d", (float(nd["x"]) if nd.get("x") is not None else nan for nd in nodes if "id" in nd))
+    ys = array("d", (float(nd["y"]) if nd.get("y") is not None else nan for nd in nodes if "id" in nd))
+
+    offsets, targets, weights = build_csr(index, edges)
+
+    zone_ids = sorted(zone_to_nodes)
+    zone_offsets, zone_nodes = array("q", [0]), array("i")
+    for zone_id in zone_ids:
+        zone_nodes.extend(index[nid] for nid in zone_to_nodes[zone_id] if nid in index)
+        zone_offsets.append(len(zone_nodes))
+
+    sections: Dict[str, Any] = {
+        "x": xs,
+        "y": ys,
+        "adj_offsets": offsets,
+        "adj_targets": targets,
+        "adj_weights": weights,
+        "zone_offsets": zone_offsets,
+        "zone_nodes": zone_nodes,
+        "nodes_json": json.dumps(nodes, separators=(",", ":"), default=str).encode("utf-8"),
+        "edges_json": json.dumps(edges, separators=(",", ":"), default=str).encode("utf-8"),
+    }
+    if 0 < n <= max_table_nodes:
+        sections["cost"] = build_cost_rows(n, offsets, targets, weights)
+
+    blobs: List[bytes] = []
+    layout: Dict[str, List[Any]] = {}
+    offset = 0
+    for name, data in sections.items():
+        if isinstance(data, array):
+            if sys.byteorder != "little":
+                data = array(data.typecode, data)
+                data.byteswap()
+            raw, typecode = data.tobytes(), data.typecode
+        else:
+            raw, typecode = data, "B"
+        layout[name] = [offset, len(raw), typecode]
+        pad = -len(raw) % 8
+        blobs.append(raw + b"\0" * pad)
+        offset += len(raw) + pad
+
+    header = json.dumps(
+        {
+            "graph_version": graph_version,
+            "zones_fp": zones_fp,
+            "node_ids": node_ids,
+            "zone_ids": zone_ids,
+            "emergency_zones": sorted(emergency_zones),
+            "sections": layout,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % 8)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def prune_artifacts(directory: str, keep: str) -> None:
+    # Unlinking is safe for workers still mapping an old file.
+    for old in glob.glob(os.path.join(directory, "planning-v*.bin")):
+        if os.path.abspath(old) != os.path.abspath(keep):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+class PlanningArtifact:
+    """
+    Read-only view over a mapped artifact. Arrays are zero-copy memoryviews.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[: len(MAGIC)] != MAGIC:
+            self._mm.close()
+            raise ValueError(f"not a planning artifact: {path}")
+        (header_len,) = struct.unpack_from("<Q", self._mm, len(MAGIC))
+        start = len(MAGIC) + 8
+        self.header = json.loads(bytes(self._mm[start : start + header_len]))
+        self._data_start = start + header_len
+        self.graph_version: int = self.header["graph_version"]
+        self.zones_fp: str = self.header["zones_fp"]
+        self.node_ids: List[str] = self.header["node_ids"]
+        self._node_index: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def open_matching(
+        cls, directory: str, graph_version: int, zones_fp: str
+    ) -> Optional["PlanningArtifact"]:
+        path = artifact_path(directory, graph_version, zones_fp)
+        if not os.path.exists(path):
+            return None
+        try:
+            art = cls(path)
+        except (OSError, ValueError, KeyError) as exc:
+            logger.warning("ignoring unreadable planning artifact %s: %s", path, exc)
+            return None
+        if art.graph_version != graph_version or art.zones_fp != zones_fp:
+            return None
+        return art
+
+    def has(self, name: str) -> bool:
+        return name in self.header["sections"]
+
+    def array(self, name: str) -> memoryview:
+        offset, nbytes, typecode = self.header["sections"][name]
+        view = memoryview(self._mm)[self._data_start + offset : self._data_start + offset + nbytes]
+        return view if typecode == "B" else view.cast(typecode)
+
+    @property
+    def node_index(self) -> Dict[str, int]:
+        if self._node_index is None:
+            self._node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        return self._node_index
+
+    def zone_to_nodes(self) -> Dict[str, List[str]]:
+        offsets, members = self.array("zone_offsets"), self.array("zone_nodes")
+        ids = self.node_ids
+        return {
+            zone_id: [ids[k] for k in members[offsets[i] : offsets[i + 1]]]
+            for i, zone_id in enumerate(self.header["zone_ids"])
+        }
+
+    def emergency_zones(self) -> List[str]:
+        return list(self.header["emergency_zones"])
+
+    def nodes(self) -> List[Dict[str, Any]]:
+        return json.loads(bytes(self.array("nodes_json")))
+
+    def edges(self) -> List[Dict[str, Any]]:
+        return json.loads(bytes(self.array("edges_json")))
+
+    def cost_rows(self, blocked: Iterable[int] = ()) -> List[List[float]]:
+        """
+        Base cost table as row lists, with blocked nodes' rows/columns set to INF.
+        """
+        n = len(self.node_ids)
+        table = self.array("cost")
+        rows = [table[i * n : (i + 1) * n].tolist() for i in range(n)]
+        for b in blocked:
+            rows[b] = [INF] * n
+            for row in rows:
+                row[b] = INF
+        for b in blocked:
+            rows[b][b] = 0.0
+        return rows
@@ -0,0 +1,279 @@
+"""
+planning/fleet.py
+Multi-robot local planning on a process pool (ROPT_PLANNING_WORKERS > 0).
+
+Tasks are split between robots in this process (nearest robot by position,
+capped at an even share), then every robot's task order and path are planned
+in parallel: nearest-next-task Dijkstra legs over the snapshot's CSR
+adjacency, start -> tasks -> end. Blocked nodes are crossable at INF cost,
+the same penalty the solver gets through get_waypoint_graph.
+
+Pool processes never receive the graph: each call carries the snapshot path
+(see GraphManager.snapshot), which the process maps once and keeps, plus
+the blocked node indices and one robot's start/end/tasks.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .artifacts import INF, PlanningArtifact
+from .graph_manager import GraphManager
+
+logger = logging.getLogger(__name__)
+
+# (robot_id, start node id, end node id)
+Robot = Tuple[str, str, str]
+
+# Snapshots mapped by this pool process, by path. A new graph means a new path.
+_MAPPED: Dict[str, PlanningArtifact] = {}
+
+
+def parse_fleet(spec: str) -> List[Robot]:
+    """
+    "robot_1:n0,robot_2:n9:n0" -> [(robot_1, n0, n0), (robot_2, n9, n0)].
+    Without an end node a robot returns to its start.
+    """
+    fleet: List[Robot] = []
+    for item in (spec or "").split(","):
+        parts = [p.strip() for p in item.split(":")]
+        if len(parts) < 2 or not parts[0] or not parts[1]:
+            continue
+        fleet.append((parts[0], parts[1], parts[2] if len(parts) > 2 and parts[2] else parts[1]))
+    return fleet
+
+
+def _is_index(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _check_constraints(vehicles: Any, tasks: Any) -> None:
+    """
+    Raises ValueError unless vehicles are lists of node indices and tasks are
+    node indices. Indices outside the graph are dropped later, not refused.
+    """
+    if not isinstance(vehicles, list) or not all(
+        isinstance(v, list) and all(_is_index(i) for i in v) for v in vehicles
+    ):
+        raise ValueError("vehicles must be a list of [start, end] node indices")
+    if not isinstance(tasks, list) or not all(_is_index(t) for t in tasks):
+        raise ValueError("tasks must be a list of node indices")
+
+
+def _mapped(path: str) -> PlanningArtifact:
+    artifact = _MAPPED.get(path)
+    if artifact is None:
+        _MAPPED.clear()
+        artifact = _MAPPED[path] = PlanningArtifact(path)
+    return artifact
+
+
+def _nearest(
+    offsets: Sequence[int],
+    targets: Sequence[int],
+    weights: Sequence[float],
+    blocked: frozenset,
+    source: int,
+    goals: set,
+) -> Tuple[Optional[int], float, Dict[int, int]]:
+    """
+    Dijkstra from source until the first goal is settled.
+    Returns (goal, cost, predecessor map); goal is None if none is reachable.
+    """
+    dist = {source: 0.0}
+    prev: Dict[int, int] = {}
+    heap = [(0.0, source)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist.get(u, math.inf):
+            continue
+        if u in goals:
+            return u, d, prev
+        penalized = u in blocked
+        for k in range(offsets[u], offsets[u + 1]):
+            v = targets[k]
+            nd = d + (INF if penalized or v in blocked else weights[k])
+            if nd < dist.get(v, math.inf):
+                dist[v] = nd
+                prev[v] = u
+                heapq.heappush(heap, (nd, v))
+    return None, math.inf, prev
+
+
+def _walk(prev: Dict[int, int], source: int, goal: int) -> List[int]:
+    path = [goal]
+    while path[-1] != source:
+        path.append(prev[path[-1]])
+    path.reverse()
+    return path
+
+
+def _warm(snapshot: str) -> int:
+    return len(_mapped(snapshot).node_ids)
+
+
+def plan_robot(
+    snapshot: str,
+    blocked: Sequence[int],
+    robot_id: str,
+    start: int,
+    end: Optional[int],
+    tasks: Sequence[int],
+) -> Dict[str, Any]:
+    """
+    Pool entry point: order one robot's tasks and build its node path.
+    """
+    artifact = _mapped(snapshot)
+    offsets = artifact.array("adj_offsets")
+    targets = artifact.array("adj_targets")
+    weights = artifact.array("adj_weights")
+    ids = artifact.node_ids
+    blocked_set = frozenset(blocked)
+
+    path, order, cost = [start], [], 0.0
+    remaining = set(tasks)
+    remaining.discard(start)
+    cur = start
+    while remaining:
+        goal, leg, prev = _nearest(offsets, targets, weights, blocked_set, cur, remaining)
+        if goal is None:
+            break
+        path.extend(_walk(prev, cur, goal)[1:])
+        order.append(goal)
+        remaining.discard(goal)
+        cost += leg
+        cur = goal
+    if end is not None and end != cur:
+        goal, leg, prev = _nearest(offsets, targets, weights, blocked_set, cur, {end})
+        if goal is None:
+            remaining.add(end)
+        else:
+            path.extend(_walk(prev, cur, goal)[1:])
+            cost += leg
+    return {
+        "robot_id": robot_id,
+        "path": [ids[i] for i in path],
+        "tasks": [ids[i] for i in order],
+        "unreachable": sorted(ids[i] for i in remaining),
+        "cost": cost,
+    }
+
+
+def assign_tasks(
+    xs: Sequence[float],
+    ys: Sequence[float],
+    starts: Sequence[int],
+    tasks: Sequence[int],
+) -> List[List[int]]:
+    """
+    Nearest robot (straight-line from its start) per task, at most an even share each.
+    """
+    buckets: List[List[int]] = [[] for _ in starts]
+    if not starts:
+        return buckets
+    share = math.ceil(len(tasks) / len(starts))
+
+    def dist2(a: int, b: int) -> float:
+        d = (xs[a] - xs[b]) ** 2 + (ys[a] - ys[b]) ** 2
+        # Nodes without coordinates (NaN) rank last.
+        return math.inf if math.isnan(d) else d
+
+    for t in dict.fromkeys(tasks):
+        for r in sorted(range(len(starts)), key=lambda r: dist2(t, starts[r])):
+            if len(buckets[r]) < share:
+                buckets[r].append(t)
+                break
+    return buckets
+
+
+class FleetPlanner:
+    def __init__(self, graph_manager: GraphManager, workers: int = 0):
+        self.graph_manager = graph_manager
+        self.workers = max(0, workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.plans = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: the event loop's threads and sockets must not be forked.
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def start(self) -> None:
+        """
+        Spawn the pool and map the snapshot up front so the first replan
+        does not pay interpreter start-up.
+        """
+        if not self.enabled:
+            return
+        artifact = await self.graph_manager.snapshot()
+        loop = asyncio.get_running_loop()
+        pool = self._executor()
+        await asyncio.gather(
+            *(loop.run_in_executor(pool, _warm, artifact.path) for _ in range(self.workers))
+        )
+
+    async def plan(self, constraints: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Same constraints shape as the solver (vehicles as [start, end] indices,
+        vehicle_ids, tasks); returns {"ok", "routes", "source"} like it, plus
+        per-robot task order, unreachable nodes and cost. Raises ValueError
+        for malformed vehicles or tasks.
+        """
+        _check_constraints(constraints.get("vehicles", []), constraints.get("tasks", []))
+        gm = self.graph_manager
+        artifact = await gm.snapshot()
+        n = len(artifact.node_ids)
+        vehicles = list(constraints.get("vehicles", []))
+        robot_ids = list(constraints.get("vehicle_ids") or [])
+        robot_ids += [f"robot_{i + 1}" for i in range(len(robot_ids), len(vehicles))]
+        fleet = [(rid, v) for rid, v in zip(robot_ids, vehicles) if v and 0 <= v[0] < n]
+        robot_ids, vehicles = [rid for rid, _ in fleet], [v for _, v in fleet]
+        tasks = [t for t in constraints.get("tasks", []) if 0 <= t < n]
+        index = artifact.node_index
+        blocked = [index[b] for b in gm.blocked_nodes if b in index]
+
+        starts = [v[0] for v in vehicles]
+        buckets = assign_tasks(artifact.array("x"), artifact.array("y"), starts, tasks)
+        loop = asyncio.get_running_loop()
+        pool = self._executor()
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    pool,
+                    plan_robot,
+                    artifact.path,
+                    blocked,
+                    robot_ids[r],
+                    v[0],
+                    v[1] if len(v) > 1 and 0 <= v[1] < n else None,
+                    buckets[r],
+                )
+                for r, v in enumerate(vehicles)
+            )
+        )
+        self.plans += 1
+        return {
+            "ok": bool(results) and not any(r["unreachable"] for r in results),
+            "routes": {r["robot_id"]: r["path"] for r in results},
+            "plans": {r["robot_id"]: r for r in results},
+            "source": "local",
+        }
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self.graph_manager.remove_private_snapshots()
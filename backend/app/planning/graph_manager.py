@@ -1,51 +1,315 @@
 """
 graph_manager.py
 In-memory graph + zone mapping for local planning updates.
+
+The graph itself lives in col_graph (one doc per node/edge); map_graph "base"
+only carries its version. With ROPT_PLANNING_ARTIFACT_DIR set, the planning
+state derived from a graph version + zone set is also kept as a memory-mapped
+snapshot (see artifacts.py) so restarts skip the Mongo scan and zone mapping.
 """
 
 from __future__ import annotations
 
-from typing import Dict, List, Any, Set
+import asyncio
+import logging
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Any, Optional, Set
 
+from pymongo import DeleteMany, ReturnDocument, UpdateMany
+from pymongo.errors import DuplicateKeyError
 from shapely.geometry import Point, Polygon
 
 from ..db.mongo import get_db, col_graph
+from .artifacts import (
+    INF,
+    PlanningArtifact,
+    artifact_path,
+    build_csr,
+    prune_artifacts,
+    write_artifact,
+    zones_fingerprint,
+)
+
+logger = logging.getLogger(__name__)
+
+# A patch lock older than this is from a crashed writer and may be taken over.
+PATCH_LOCK_MS = 30_000
+
+
+class GraphVersionConflict(Exception):
+    def __init__(self, current: int):
+        super().__init__(f"graph is at version {current}")
+        self.current = current
 
 
 class GraphManager:
-    def __init__(self):
-        self.nodes: Dict[str, Dict[str, Any]] = {}
-        self.edges: List[Dict[str, Any]] = []
+    def __init__(self, artifact_dir: Optional[str] = None, cost_table_max_nodes: int = 2000):
+        self._nodes: Optional[Dict[str, Dict[str, Any]]] = {}
+        self._edges: Optional[List[Dict[str, Any]]] = []
         self.zone_to_nodes: Dict[str, List[str]] = {}
         self.blocked_zones: Set[str] = set()
         self.blocked_nodes: Set[str] = set()
+        self.emergency_zones: Set[str] = set()
+        # map_graph "base" version the in-memory graph came from.
+        self.graph_version = 0
+        self.artifact_dir = artifact_dir
+        self.cost_table_max_nodes = cost_table_max_nodes
+        self._artifact: Optional[PlanningArtifact] = None
+        self._private_dir: Optional[str] = None
+        self._private_seq = 0
+        # Sparse solver payload for the current graph; blocked patch cached by blocked set.
+        self._waypoint: Optional[Dict[str, Any]] = None
+
+    @property
+    def nodes(self) -> Dict[str, Dict[str, Any]]:
+        # After a warm start node/edge dicts are parsed only when first needed.
+        if self._nodes is None:
+            self._nodes = {n["id"]: n for n in self._artifact.nodes() if "id" in n}
+        return self._nodes
+
+    @nodes.setter
+    def nodes(self, value: Dict[str, Dict[str, Any]]) -> None:
+        self._nodes = value
+
+    @property
+    def edges(self) -> List[Dict[str, Any]]:
+        if self._edges is None:
+            self._edges = self._artifact.edges()
+        return self._edges
+
+    @edges.setter
+    def edges(self, value: List[Dict[str, Any]]) -> None:
+        self._edges = value
 
     async def load_base_graph(self) -> None:
         doc = await get_db()["map_graph"].find_one({"_id": "base"})
-        if doc:
-            self.set_base_graph(doc.get("graph", {}))
+        if doc and doc.get("graph"):
+            # Legacy layout: whole graph embedded in one document.
+            self.set_base_graph(doc["graph"])
+            self.graph_version = int(doc.get("version", 0))
             return
-        # Fallback: rebuild graph from col_graph if present.
-        nodes = await col_graph().find({"type": "node"}).to_list(length=None)
-        edges = await col_graph().find({"type": "edge"}).to_list(length=None)
+        nodes = await col_graph().find({"type": "node"}, {"_id": 0, "type": 0}).to_list(length=None)
+        edges = await col_graph().find({"type": "edge"}, {"_id": 0, "type": 0}).to_list(length=None)
         if nodes or edges:
             self.set_base_graph({"nodes": nodes, "edges": edges})
+        self.graph_version = int((doc or {}).get("version", 0))
 
     async def save_base_graph(self, graph: Dict[str, Any]) -> None:
-        await get_db()["map_graph"].update_one(
-            {"_id": "base"}, {"$set": {"graph": graph}}, upsert=True
-        )
-        # Persist nodes/edges for spatial mapping
-        await col_graph().delete_many({})
+        """
+        Replace the stored graph. Raises GraphVersionConflict while a patch
+        holds the graph lock.
+        """
         nodes = graph.get("nodes", [])
         edges = graph.get("edges", [])
-        if nodes:
-            await col_graph().insert_many([{**n, "type": "node"} for n in nodes])
-        if edges:
-            await col_graph().insert_many([{**e, "type": "edge"} for e in edges])
+        await self._lock_graph({}, upsert=True)
+        try:
+            # Persist nodes/edges first; the version bump below publishes them.
+            await col_graph().delete_many({})
+            if nodes:
+                await col_graph().insert_many([{**n, "type": "node"} for n in nodes])
+            if edges:
+                await col_graph().insert_many([{**e, "type": "edge"} for e in edges])
+            # Only metadata here, so large sites never hit the 16 MB document limit.
+            doc = await get_db()["map_graph"].find_one_and_update(
+                {"_id": "base"},
+                {
+                    "$inc": {"version": 1},
+                    "$set": {
+                        "node_count": len(nodes),
+                        "edge_count": len(edges),
+                        "updated_ms": int(time.time() * 1000),
+                    },
+                    "$unset": {"graph": "", "patch_lock": ""},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except BaseException:
+            await self._abort_graph_write(written=True)
+            raise
         self.set_base_graph(graph)
+        self.graph_version = int(doc.get("version", 0))
+
+    async def patch_base_graph(
+        self, patch: Dict[str, Any], zones: List[Dict[str, Any]]
+    ) -> Dict[str, List[str]]:
+        """
+        Apply an incremental edit if the stored graph is still at
+        patch["graph_version"]; raises GraphVersionConflict otherwise.
+        Only the touched node/edge documents are written. Returns the zones
+        whose node lists changed.
+        """
+        _validate_patch(patch)
+        base = int(patch.get("graph_version", 0))
+        meta = get_db()["map_graph"]
+        # Without a match the base 0 claim upserts the first graph document.
+        await self._lock_graph({"version": base if base else {"$in": [0, None]}}, upsert=base == 0)
+
+        ops = _patch_ops(patch)
+        written = False
+        try:
+            if self.graph_version != base:
+                # Behind the stored graph (no Redis, or another worker's publish not yet
+                # applied): the patch is against what Mongo holds at base.
+                await self.load_base_graph()
+                self.refresh_zone_index(zones)
+            if ops:
+                written = True
+                await col_graph().bulk_write(ops, ordered=True)
+            changed = self.apply_patch(patch, zones=zones)
+            doc = await meta.find_one_and_update(
+                {"_id": "base"},
+                {
+                    "$inc": {"version": 1},
+                    "$set": {
+                        "node_count": len(self.nodes),
+                        "edge_count": len(self.edges),
+                        "updated_ms": int(time.time() * 1000),
+                    },
+                    "$unset": {"patch_lock": "", "graph": ""},
+                },
+                return_document=ReturnDocument.AFTER,
+            )
+        except BaseException:
+            await self._abort_graph_write(written)
+            self.refresh_zone_index(zones)
+            raise
+        self.graph_version = int(doc.get("version", 0))
+        return changed
+
+    async def _lock_graph(self, match: Dict[str, Any], upsert: bool) -> None:
+        """
+        Take patch_lock on the graph metadata document, which serializes PUT
+        and PATCH across workers. Raises GraphVersionConflict if it is held
+        (and not stale) or match does not hold.
+        """
+        now = int(time.time() * 1000)
+        meta = get_db()["map_graph"]
+        try:
+            claimed = await meta.find_one_and_update(
+                {
+                    "_id": "base",
+                    **match,
+                    "$or": [
+                        {"patch_lock": {"$exists": False}},
+                        {"patch_lock": {"$lt": now - PATCH_LOCK_MS}},
+                    ],
+                },
+                {"$set": {"patch_lock": now}},
+                upsert=upsert,
+            )
+        except DuplicateKeyError:
+            # The document exists but is locked (or does not match): the upsert collided.
+            conflict = True
+        else:
+            conflict = claimed is None and not upsert
+        if conflict:
+            doc = await meta.find_one({"_id": "base"}, {"version": 1})
+            raise GraphVersionConflict(int((doc or {}).get("version") or 0))
+
+    async def _abort_graph_write(self, written: bool) -> None:
+        """
+        After a failed PUT/PATCH: release the lock (or every write gets 409
+        until PATCH_LOCK_MS passes) and reload memory from Mongo. If graph
+        documents may have been written, the version moves as well, so no
+        worker keeps its old graph under the number of the changed one.
+        """
+        update: Dict[str, Any] = {"$unset": {"patch_lock": ""}}
+        if written:
+            update["$inc"] = {"version": 1}
+            update["$set"] = {"updated_ms": int(time.time() * 1000)}
+        await get_db()["map_graph"].update_one({"_id": "base"}, update)
+        await self.load_base_graph()
+
+    def apply_patch(
+        self,
+        patch: Dict[str, Any],
+        zones: Optional[List[Dict[str, Any]]] = None,
+        zone_updates: Optional[Dict[str, List[str]]] = None,
+    ) -> Dict[str, List[str]]:
+        """
+        Apply an edit to the in-memory graph. Zone lists are re-tested only
+        for touched nodes (against zones), or taken as given (zone_updates,
+        from the worker that computed them). Returns the changed zone lists.
+        """
+        nodes, edges = self.nodes, self.edges
+        removed = set(patch.get("remove_nodes") or ())
+        upserts = {n["id"]: n for n in patch.get("upsert_nodes") or ()}
+        drop = {(e["from"], e["to"]) for e in patch.get("remove_edges") or ()}
+        updates = {(e["from"], e["to"]): e for e in patch.get("upsert_edges") or ()}
+        same_shape = not removed and not drop and all(nid in nodes for nid in upserts)
+        # Updated edges after merging, so fields a patch omits keep their old values.
+        merged: Dict[tuple, Dict[str, Any]] = {}
+
+        for node_id in removed:
+            nodes.pop(node_id, None)
+        for node_id, node in upserts.items():
+            nodes[node_id] = {**nodes.get(node_id, {}), **node}
+
+        if removed or drop or updates:
+            kept: List[Dict[str, Any]] = []
+            seen: Set[tuple] = set()
+            for e in edges:
+                key = (e.get("from"), e.get("to"))
+                if key in drop or key[0] in removed or key[1] in removed:
+                    continue
+                if key in updates:
+                    e = merged[key] = {**e, **updates[key]}
+                    seen.add(key)
+                kept.append(e)
+            new_edges = [e for key, e in updates.items() if key not in seen]
+            same_shape = same_shape and not new_edges
+            kept.extend(new_edges)
+            self._edges = kept
+
+        self._artifact = None
+        if same_shape and self._waypoint is not None:
+            # Only weights moved: patch the cached solver payload in place.
+            wp = self._waypoint
+            offsets, targets, node_map = wp["offsets"], wp["edges"], wp["node_map"]
+            for (src, dst), e in merged.items():
+                u, v = node_map.get(src), node_map.get(dst)
+                if u is None or v is None:
+                    continue
+                for k in range(offsets[u], offsets[u + 1]):
+                    if targets[k] == v:
+                        wp["base_weights"][k] = float(e.get("weight", 1.0))
+            wp["blocked"] = None
+        else:
+            self._waypoint = None
+
+        changed: Dict[str, List[str]] = {}
+        if zone_updates is not None:
+            for zone_id, node_ids in zone_updates.items():
+                self.zone_to_nodes[zone_id] = list(node_ids)
+            changed = dict(zone_updates)
+        elif zones is not None and (removed or upserts):
+            touched = removed | set(upserts)
+            for zone_id, members in self.zone_to_nodes.items():
+                if touched.intersection(members):
+                    changed[zone_id] = [n for n in members if n not in touched]
+            for z in zones:
+                zone_id, poly = z.get("zone_id"), z.get("polygon") or []
+                if not zone_id or len(poly) < 3:
+                    continue
+                polygon = Polygon(poly)
+                for node_id in upserts:
+                    node = nodes[node_id]
+                    x, y = node.get("x"), node.get("y")
+                    if x is None or y is None or not polygon.contains(Point(x, y)):
+                        continue
+                    if zone_id not in changed:
+                        changed[zone_id] = list(self.zone_to_nodes.get(zone_id, []))
+                    changed[zone_id].append(node_id)
+            self.zone_to_nodes.update(changed)
+        self._recompute_blocked_nodes()
+        return changed
 
     def set_base_graph(self, graph: Dict[str, Any]) -> None:
+        self._artifact = None
+        self._waypoint = None
         nodes = graph.get("nodes", [])
         self.nodes = {n["id"]: n for n in nodes if "id" in n}
         self.edges = graph.get("edges", [])
@@ -53,11 +317,113 @@ class GraphManager:
         if self.zone_to_nodes:
             self._recompute_blocked_nodes()
 
+    async def warm_start(self, zones: List[Dict[str, Any]]) -> bool:
+        """
+        Map the snapshot for the current Mongo graph version and zone set.
+        False (nothing changed) when there is none; the caller then loads
+        from Mongo and calls save_artifact().
+        """
+        if not self.artifact_dir:
+            return False
+        doc = await get_db()["map_graph"].find_one({"_id": "base"}, {"version": 1})
+        version = int((doc or {}).get("version", 0))
+        artifact = PlanningArtifact.open_matching(
+            self.artifact_dir, version, zones_fingerprint(zones)
+        )
+        if artifact is None:
+            return False
+        self._artifact = artifact
+        self._nodes = None
+        self._edges = None
+        self._waypoint = None
+        self.graph_version = artifact.graph_version
+        self.zone_to_nodes = artifact.zone_to_nodes()
+        self.emergency_zones = set(artifact.emergency_zones())
+        self._recompute_blocked_nodes()
+        return True
+
+    async def save_artifact(self, zones: List[Dict[str, Any]]) -> None:
+        """
+        Snapshot the current graph + zone mapping for the next warm start.
+        """
+        if not self.artifact_dir:
+            return
+        fp = zones_fingerprint(zones)
+        path = artifact_path(self.artifact_dir, self.graph_version, fp)
+        try:
+            await asyncio.to_thread(
+                write_artifact,
+                path,
+                self.graph_version,
+                fp,
+                list(self.nodes.values()),
+                self.edges,
+                self.zone_to_nodes,
+                self.emergency_zones,
+                self.cost_table_max_nodes,
+            )
+            prune_artifacts(self.artifact_dir, keep=path)
+            self._artifact = PlanningArtifact(path)
+        except Exception as exc:
+            logger.warning("planning artifact write failed: %s", exc)
+
+    async def snapshot(self) -> PlanningArtifact:
+        """
+        Mapped snapshot matching the in-memory graph, for readers in other
+        processes (by its path). Writes a process-private one when none is mapped.
+        """
+        if self._artifact is None:
+            if self._private_dir is None:
+                self._private_dir = tempfile.mkdtemp(prefix="ropt-planning-")
+            self._private_seq += 1
+            path = artifact_path(self._private_dir, self.graph_version, f"{self._private_seq:016x}")
+            edges = self.edges
+            await asyncio.to_thread(
+                write_artifact,
+                path,
+                self.graph_version,
+                "",
+                list(self.nodes.values()),
+                edges,
+                self.zone_to_nodes,
+                self.emergency_zones,
+                self.cost_table_max_nodes,
+            )
+            artifact = PlanningArtifact(path)
+            if self._edges is not edges:
+                # Graph replaced while writing; the file is already stale.
+                return await self.snapshot()
+            prune_artifacts(self._private_dir, keep=path)
+            self._artifact = artifact
+        return self._artifact
+
+    def remove_private_snapshots(self) -> None:
+        """
+        Delete the temp directory snapshot() writes to (at shutdown).
+        """
+        if self._private_dir is None:
+            return
+        if self._artifact is not None and self._artifact.path.startswith(self._private_dir):
+            self._artifact = None
+        shutil.rmtree(self._private_dir, ignore_errors=True)
+        self._private_dir = None
+
+    def node_index(self) -> Dict[str, int]:
+        """
+        Node id -> index, in the order get_cost_matrix and snapshots use.
+        """
+        if self._artifact is not None:
+            return self._artifact.node_index
+        return {node_id: i for i, node_id in enumerate(self.nodes)}
+
     def refresh_zone_index(self, zones: List[Dict[str, Any]]) -> None:
         zone_to_nodes: Dict[str, List[str]] = {}
+        emergency_zones: Set[str] = set()
         for z in zones:
             zone_id = z.get("zone_id")
             polygon = z.get("polygon") or []
+            if zone_id and z.get("severity") == "emergency":
+                emergency_zones.add(zone_id)
             if not zone_id or not polygon:
                 continue
             nodes_in_zone = []
@@ -71,6 +437,7 @@ class GraphManager:
                     nodes_in_zone.append(node_id)
             zone_to_nodes[zone_id] = nodes_in_zone
         self.zone_to_nodes = zone_to_nodes
+        self.emergency_zones = emergency_zones
         self._recompute_blocked_nodes()
 
     def update_zone_block(self, zone_id: str, blocked: bool) -> None:
@@ -101,14 +468,74 @@ class GraphManager:
             "blocked_nodes": list(self.blocked_nodes),
         }
 
+    def get_waypoint_graph(self) -> Dict[str, Any]:
+        """
+        Sparse graph for the solver (CSR offsets/edges/weights) with edges
+        into or out of blocked nodes weighted INF. The structure is built once
+        per graph; per call only the blocked edges' weights are patched.
+        """
+        wp = self._waypoint
+        if wp is None:
+            if self._artifact is not None:
+                node_map = self._artifact.node_index
+                arrays = [self._artifact.array(k) for k in ("adj_offsets", "adj_targets", "adj_weights")]
+            else:
+                node_map = self.node_index()
+                arrays = build_csr(node_map, self.edges)
+            offsets, targets, weights = (a.tolist() for a in arrays)
+            incoming: Dict[int, List[int]] = {}
+            for k, v in enumerate(targets):
+                incoming.setdefault(v, []).append(k)
+            wp = self._waypoint = {
+                "offsets": offsets,
+                "edges": targets,
+                "base_weights": weights,
+                "incoming": incoming,
+                "node_map": node_map,
+                "blocked": None,
+                "weights": weights,
+            }
+        blocked = frozenset(self.blocked_nodes)
+        if wp["blocked"] != blocked:
+            weights = list(wp["base_weights"])
+            offsets, node_map = wp["offsets"], wp["node_map"]
+            for node_id in blocked:
+                u = node_map.get(node_id)
+                if u is None:
+                    continue
+                for k in range(offsets[u], offsets[u + 1]):
+                    weights[k] = INF
+                for k in wp["incoming"].get(u, ()):
+                    weights[k] = INF
+            wp["blocked"], wp["weights"] = blocked, weights
+        return {
+            "offsets": wp["offsets"],
+            "edges": wp["edges"],
+            "weights": wp["weights"],
+            "node_map": wp["node_map"],
+            # What the weights depend on; the cuOpt client caches its request body by it.
+            "graph_version": self.graph_version,
+            "blocked": blocked,
+        }
+
     def get_cost_matrix(self) -> Dict[str, Any]:
         """
         Build a cost matrix for the VRP solver with blocked nodes penalized.
         """
+        artifact = self._artifact
+        if artifact is not None and artifact.has("cost"):
+            # Copy rows of the precomputed table; only blocked nodes are patched.
+            node_id_to_idx = artifact.node_index
+            blocked = [node_id_to_idx[n] for n in self.blocked_nodes if n in node_id_to_idx]
+            return {
+                "matrix": artifact.cost_rows(blocked),
+                "node_map": node_id_to_idx,
+                "nodes": list(self.nodes.values()),
+            }
         nodes = list(self.nodes.values())
         node_id_to_idx = {n["id"]: i for i, n in enumerate(nodes) if "id" in n}
         n_count = len(nodes)
-        inf = 1_000_000.0
+        inf = INF
         matrix = [[inf] * n_count for _ in range(n_count)]
         for i in range(n_count):
             matrix[i][i] = 0.0
@@ -129,3 +556,35 @@ class GraphManager:
             "node_map": node_id_to_idx,
             "nodes": nodes,
         }
+
+
+def _validate_patch(patch: Dict[str, Any]) -> None:
+    for n in patch.get("upsert_nodes") or ():
+        if not n.get("id"):
+            raise ValueError("upsert_nodes entries need an id")
+    for field in ("upsert_edges", "remove_edges"):
+        for e in patch.get(field) or ():
+            if not e.get("from") or not e.get("to"):
+                raise ValueError(f"{field} entries need from and to")
+
+
+def _patch_ops(patch: Dict[str, Any]) -> list:
+    """
+    Bulk ops for the graph collection, in the order apply_patch uses.
+    """
+    ops: list = []
+    removed = list(patch.get("remove_nodes") or ())
+    if removed:
+        ops.append(DeleteMany({"type": "node", "id": {"$in": removed}}))
+        ops.append(
+            DeleteMany({"type": "edge", "$or": [{"from": {"$in": removed}}, {"to": {"$in": removed}}]})
+        )
+    for n in patch.get("upsert_nodes") or ():
+        ops.append(UpdateMany({"type": "node", "id": n["id"]}, {"$set": n}, upsert=True))
+    for e in patch.get("remove_edges") or ():
+        ops.append(DeleteMany({"type": "edge", "from": e["from"], "to": e["to"]}))
+    for e in patch.get("upsert_edges") or ():
+        ops.append(
+            UpdateMany({"type": "edge", "from": e["from"], "to": e["to"]}, {"$set": e}, upsert=True)
+        )
+    return ops
@@ -0,0 +1,286 @@
+"""
+planning/replication.py
+Keeps GraphManager planning state identical across workers.
+
+Every change (zone blocked/unblocked, zone map rebuilt, base graph replaced
+or patched)
+goes through one Lua script that bumps ropt:planning:version, updates the
+authoritative copy in Redis, appends the versioned delta to a short log and
+publishes it. Each worker applies deltas in version order from pub/sub; a gap
+is filled from the log, or by a full resync if the log no longer covers it.
+
+Reads that must be consistent (/state, /planning/*) call ensure_current(),
+one pipelined GET+LRANGE, so a worker that missed messages catches up
+without touching Mongo. A graph delta carries only a graph version: the graph
+itself stays in Mongo and is reloaded when that version changes. Graph versions
+are the Mongo map_graph version (GraphManager.graph_version), so a worker that
+booted from Mongo or a planning artifact at the current version never reloads.
+A patch delta carries the edit and the zone lists it changed, so workers apply
+it in place instead of reloading.
+
+Without Redis every method applies locally, like ConnectionManager.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional
+
+from .graph_manager import GraphManager
+
+logger = logging.getLogger(__name__)
+
+# Deltas kept for catch-up; a worker further behind does a full resync.
+LOG_MAX = 256
+
+# KEYS: version, blocked zones set, zone map doc, graph version, delta log
+# ARGV: op, zone_id | zone map JSON | patch JSON, blocked zones JSON (seed) |
+#       zone map JSON (patch), channel, log max, Mongo graph version
+# Returns {delta version, graph version it carries}. The stored graph version
+# only moves forward, even if publishes race.
+_PUBLISH_LUA = """
+local op = ARGV[1]
+local gv = tonumber(ARGV[6])
+if op == 'seed' or op == 'graph' or op == 'patch' then
+  if gv > tonumber(redis.call('GET', KEYS[4]) or -1) then
+    redis.call('SET', KEYS[4], gv)
+  end
+end
+if op == 'seed' and redis.call('EXISTS', KEYS[1]) == 1 then
+  return {tonumber(redis.call('GET', KEYS[1])), gv}
+end
+local v = redis.call('INCR', KEYS[1])
+local data = '{}'
+if op == 'block' then
+  redis.call('SADD', KEYS[2], ARGV[2])
+  data = cjson.encode({zone_id = ARGV[2]})
+elseif op == 'unblock' then
+  redis.call('SREM', KEYS[2], ARGV[2])
+  data = cjson.encode({zone_id = ARGV[2]})
+elseif op == 'zones' then
+  redis.call('SET', KEYS[3], ARGV[2])
+  data = ARGV[2]
+elseif op == 'seed' then
+  redis.call('SET', KEYS[3], ARGV[2])
+  redis.call('DEL', KEYS[2])
+  for _, zone_id in ipairs(cjson.decode(ARGV[3])) do
+    redis.call('SADD', KEYS[2], zone_id)
+  end
+  data = '{"zones":' .. ARGV[2] .. ',"blocked_zones":' .. ARGV[3] .. '}'
+elseif op == 'graph' then
+  data = '{"graph_version":' .. gv .. '}'
+elseif op == 'patch' then
+  redis.call('SET', KEYS[3], ARGV[3])
+  data = '{"graph_version":' .. gv .. ',"patch":' .. ARGV[2] .. '}'
+end
+local msg = '{"version":' .. v .. ',"op":"' .. op .. '","data":' .. data .. '}'
+redis.call('LPUSH', KEYS[5], msg)
+redis.call('LTRIM', KEYS[5], 0, tonumber(ARGV[5]) - 1)
+redis.call('PUBLISH', ARGV[4], msg)
+return {v, gv}
+"""
+
+
+class PlanningReplicator:
+    def __init__(
+        self,
+        graph_manager: GraphManager,
+        redis_client: Optional[object] = None,
+        prefix: str = "ropt:planning",
+    ):
+        self.graph_manager = graph_manager
+        self._redis = redis_client
+        self._channel = f"{prefix}:deltas"
+        self._keys = [
+            f"{prefix}:version",
+            f"{prefix}:blocked_zones",
+            f"{prefix}:zones",
+            # Was an independent counter under :graph_version; now the Mongo version.
+            f"{prefix}:mongo_graph_version",
+            f"{prefix}:log",
+        ]
+        self._publish = redis_client.register_script(_PUBLISH_LUA) if redis_client else None
+        self._lock = asyncio.Lock()
+        # Last delta applied locally; 0 until the first sync.
+        self.version = 0
+        # Mongo graph version the local graph matches; start() takes it from gm.
+        self.graph_version = 0
+        self.resyncs = 0
+
+    async def start(self) -> None:
+        """
+        Join the cluster state: seed Redis from this worker's Mongo-derived state
+        if nobody has yet, otherwise adopt what is there.
+        """
+        gm = self.graph_manager
+        self.graph_version = gm.graph_version
+        if self._redis is None:
+            return
+        await self._publish(
+            keys=self._keys,
+            args=[
+                "seed",
+                json.dumps(_zones_doc(gm)),
+                json.dumps(sorted(gm.blocked_zones)),
+                self._channel,
+                LOG_MAX,
+                gm.graph_version,
+            ],
+        )
+        await self.resync()
+
+    async def set_zone_block(self, zone_id: str, blocked: bool) -> None:
+        self.graph_manager.update_zone_block(zone_id, blocked)
+        await self._emit("block" if blocked else "unblock", zone_id)
+
+    async def publish_zones(self) -> None:
+        """
+        Call after rebuilding zone_to_nodes / emergency_zones locally.
+        """
+        await self._emit("zones", json.dumps(_zones_doc(self.graph_manager)))
+
+    async def publish_graph(self) -> None:
+        """
+        Call after saving a new base graph to Mongo; other workers reload it.
+        """
+        await self._emit("graph", "")
+
+    async def publish_patch(self, patch: Dict[str, Any], zones_changed: Dict[str, Any]) -> None:
+        """
+        Call after GraphManager.patch_base_graph; other workers apply the same edit.
+        """
+        body = {"changes": patch, "zones": zones_changed}
+        await self._emit("patch", json.dumps(body), json.dumps(_zones_doc(self.graph_manager)))
+
+    async def _emit(self, op: str, arg: str, extra: str = "[]") -> None:
+        if self._redis is None:
+            self.version += 1
+            return
+        gm = self.graph_manager
+        # Held across the publish so listen() cannot apply our own delta first.
+        async with self._lock:
+            v, graph_version = await self._publish(
+                keys=self._keys, args=[op, arg, extra, self._channel, LOG_MAX, gm.graph_version]
+            )
+            if op in ("graph", "patch"):
+                # Our own save already happened; record the version it published.
+                self.graph_version = int(graph_version)
+            if v == self.version + 1:
+                # Nothing else landed in between: local state is already state v.
+                self.version = v
+                return
+        await self.ensure_current()
+
+    async def ensure_current(self) -> int:
+        """
+        Version check on read: apply any deltas this worker has not seen yet.
+        """
+        if self._redis is None:
+            return self.version
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.get(self._keys[0])
+            pipe.lrange(self._keys[4], 0, LOG_MAX - 1)
+            remote, log = await pipe.execute()
+        remote = int(remote or 0)
+        if remote <= self.version:
+            return self.version
+        async with self._lock:
+            deltas = [json.loads(m) for m in reversed(log)]
+            deltas = [d for d in deltas if d["version"] > self.version]
+            if not deltas or deltas[0]["version"] != self.version + 1:
+                await self._resync_locked()
+            else:
+                for d in deltas:
+                    await self._apply(d)
+        return self.version
+
+    async def resync(self) -> None:
+        async with self._lock:
+            await self._resync_locked()
+
+    async def _resync_locked(self) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.get(self._keys[0])
+            pipe.smembers(self._keys[1])
+            pipe.get(self._keys[2])
+            pipe.get(self._keys[3])
+            version, blocked, zones, graph_version = await pipe.execute()
+        gm = self.graph_manager
+        # No key: nothing published since Redis was seeded without one; keep ours.
+        if graph_version is not None and int(graph_version) != self.graph_version:
+            await gm.load_base_graph()
+            self.graph_version = int(graph_version)
+        if zones:
+            _apply_zones_doc(gm, json.loads(zones))
+        gm.blocked_zones = set(blocked or ())
+        gm._recompute_blocked_nodes()
+        self.version = int(version or 0)
+        self.resyncs += 1
+
+    async def _apply(self, delta: Dict[str, Any]) -> None:
+        gm = self.graph_manager
+        op, data = delta.get("op"), delta.get("data") or {}
+        if op in ("block", "unblock"):
+            gm.update_zone_block(data["zone_id"], blocked=op == "block")
+        elif op == "zones":
+            _apply_zones_doc(gm, data)
+            gm._recompute_blocked_nodes()
+        elif op == "seed":
+            _apply_zones_doc(gm, data.get("zones") or {})
+            gm.blocked_zones = set(data.get("blocked_zones") or ())
+            gm._recompute_blocked_nodes()
+        elif op == "graph" and data.get("graph_version", 0) > self.graph_version:
+            await gm.load_base_graph()
+            self.graph_version = data["graph_version"]
+        elif op == "patch" and data.get("graph_version", 0) > self.graph_version:
+            body = data.get("patch") or {}
+            if data["graph_version"] == self.graph_version + 1:
+                gm.apply_patch(body.get("changes") or {}, zone_updates=body.get("zones") or {})
+                gm.graph_version = data["graph_version"]
+            else:
+                await gm.load_base_graph()
+            self.graph_version = data["graph_version"]
+        self.version = delta["version"]
+
+    async def listen(self) -> None:
+        if self._redis is None:
+            return
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self._channel)
+        async for msg in pubsub.listen():
+            if msg.get("type") != "message":
+                continue
+            try:
+                delta = json.loads(msg["data"])
+            except (TypeError, ValueError):
+                continue
+            try:
+                async with self._lock:
+                    if delta["version"] <= self.version:
+                        continue
+                    if delta["version"] == self.version + 1:
+                        await self._apply(delta)
+                        continue
+                # Missed something: catch up from the log (or resync).
+                await self.ensure_current()
+            except Exception as exc:
+                logger.warning("planning delta apply failed: %s", exc)
+
+    def stats(self) -> dict:
+        return {
+            "replicated": self._redis is not None,
+            "version": self.version,
+            "graph_version": self.graph_version,
+            "resyncs": self.resyncs,
+        }
+
+
+def _zones_doc(gm: GraphManager) -> Dict[str, Any]:
+    return {"zone_to_nodes": gm.zone_to_nodes, "emergency_zones": sorted(gm.emergency_zones)}
+
+
+def _apply_zones_doc(gm: GraphManager, doc: Dict[str, Any]) -> None:
+    gm.zone_to_nodes = {z: list(nodes) for z, nodes in (doc.get("zone_to_nodes") or {}).items()}
+    gm.emergency_zones = set(doc.get("emergency_zones") or ())
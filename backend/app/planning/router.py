@@ -7,29 +7,86 @@ from __future__ import annotations
 
 from typing import Dict, Any
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 
-from .graph_manager import GraphManager
+from .graph_manager import GraphManager, GraphVersionConflict
+from .replication import PlanningReplicator
+from .fleet import FleetPlanner
 from ..cuopt_client import client as cuopt_client
 from ..deps import require_dashboard_key
+from ..repos import zones_repo
+from ..schemas import GraphPatchIn
 
 
-def create_planning_router(graph_manager: GraphManager) -> APIRouter:
+def create_planning_router(
+    graph_manager: GraphManager,
+    replicator: PlanningReplicator,
+    fleet_planner: FleetPlanner | None = None,
+) -> APIRouter:
     router = APIRouter(prefix="/planning", tags=["planning"])
 
     @router.get("/graph")
     async def get_graph():
-        return {"graph": graph_manager.build_weighted_graph()}
+        version = await replicator.ensure_current()
+        return {
+            "graph": graph_manager.build_weighted_graph(),
+            "version": version,
+            "graph_version": graph_manager.graph_version,
+        }
 
     @router.put("/graph")
     async def put_graph(graph: Dict[str, Any], _auth: None = Depends(require_dashboard_key)):
-        await graph_manager.save_base_graph(graph)
-        return {"ok": True}
+        try:
+            await graph_manager.save_base_graph(graph)
+        except GraphVersionConflict as exc:
+            raise HTTPException(
+                status_code=409,
+                detail={"error": "graph_version_conflict", "graph_version": exc.current},
+            )
+        except Exception:
+            # A failed write may still have moved the stored graph; others reload it.
+            await replicator.publish_graph()
+            raise
+        await replicator.publish_graph()
+        return {"ok": True, "graph_version": graph_manager.graph_version}
+
+    @router.patch("/graph")
+    async def patch_graph(patch: GraphPatchIn, _auth: None = Depends(require_dashboard_key)):
+        await replicator.ensure_current()
+        body = patch.model_dump()
+        zones = await zones_repo.get_zones()
+        try:
+            changed = await graph_manager.patch_base_graph(body, zones)
+        except GraphVersionConflict as exc:
+            raise HTTPException(
+                status_code=409,
+                detail={"error": "graph_version_conflict", "graph_version": exc.current},
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        except Exception:
+            await replicator.publish_graph()
+            raise
+        await replicator.publish_patch(body, changed)
+        await graph_manager.save_artifact(zones)
+        return {
+            "ok": True,
+            "graph_version": graph_manager.graph_version,
+            "zones_changed": sorted(changed),
+        }
 
     @router.post("/route")
     async def plan_route(constraints: Dict[str, Any] | None = None):
-        matrix_data = graph_manager.get_cost_matrix()
-        out = cuopt_client.solve(matrix_data=matrix_data, constraints=constraints or {})
+        await replicator.ensure_current()
+        constraints = constraints or {}
+        if fleet_planner is not None and fleet_planner.enabled and constraints.get("vehicles"):
+            # Robots are planned in parallel rather than in one blocking solver call.
+            try:
+                return await fleet_planner.plan(constraints)
+            except ValueError as exc:
+                raise HTTPException(status_code=400, detail=str(exc))
+        matrix_data = graph_manager.get_waypoint_graph()
+        out = cuopt_client.solve(matrix_data=matrix_data, constraints=constraints)
         return out
 
     return router
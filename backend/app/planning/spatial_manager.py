@@ -41,3 +41,14 @@ class SpatialManager:
 
         self.node_zone_map = node_zone_map
         self.zone_to_nodes = zone_to_nodes
+
+    def load_mappings(self, zone_to_nodes: Dict[str, List[str]]) -> None:
+        """
+        Adopt mappings computed elsewhere (e.g. a mapped planning artifact).
+        """
+        node_zone_map: Dict[str, List[str]] = {}
+        for zone_id, node_ids in zone_to_nodes.items():
+            for node_id in node_ids:
+                node_zone_map.setdefault(node_id, []).append(zone_id)
+        self.node_zone_map = node_zone_map
+        self.zone_to_nodes = {z: list(nodes) for z, nodes in zone_to_nodes.items()}
@@ -0,0 +1,370 @@
+"""
+replay.py
+Streams a recorded run over a WebSocket at (scaled) wall-clock pace.
+
+Events come off a Mongo cursor in batches; a prefetch task keeps a bounded
+number of batches ready ahead of the sender, so pacing stays smooth and the
+memory held per viewer is capped no matter how long the run is.
+
+While a run is live, RunCheckpointer stores a checkpoint every N events or S
+seconds: the previous checkpoint plus the persisted events after it, folded in
+(ts_ms, _id) order into actor zones and blocked zones. Built from Mongo rather
+than from what one worker happened to process, so any number of workers can
+checkpoint, and it runs as a background task (one per run at a time) so the
+event processor only counts. A replay viewer can send seek/pause/resume/speed control messages;
+a seek restores the nearest checkpoint and folds only the events after it.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+from .repos import checkpoints_repo, events_repo
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+MAX_GAP_S = 2.0
+MIN_SPEED = 0.1
+MAX_SPEED = 10.0
+
+
+class RunStateFolder:
+    """
+    Reconstructs actor zones and blocked zones by applying events in order.
+    Mirrors the transitions the live processor applies.
+    """
+
+    def __init__(
+        self,
+        actors: Optional[Dict[str, Dict[str, bool]]] = None,
+        blocked_zones: Optional[Set[str]] = None,
+        ts_ms: Optional[int] = None,
+        event_count: int = 0,
+        last_id: Optional[str] = None,
+    ):
+        self.actors: Dict[str, Dict[str, bool]] = actors or {}
+        self.blocked_zones: Set[str] = blocked_zones or set()
+        self.ts_ms = ts_ms
+        self.event_count = event_count
+        # _id of the last event applied; with ts_ms, the keyset position to resume after.
+        self.last_id = last_id
+
+    @classmethod
+    def from_checkpoint(cls, cp: dict) -> "RunStateFolder":
+        return cls(
+            actors={aid: dict(zones) for aid, zones in (cp.get("actors") or {}).items()},
+            blocked_zones=set(cp.get("blocked_zones") or []),
+            ts_ms=cp.get("ts_ms"),
+            event_count=cp.get("event_count", 0),
+            last_id=cp.get("last_id"),
+        )
+
+    def resume_after(self) -> Tuple[Optional[int], Optional[Tuple[int, str]]]:
+        """
+        (since_ms, after) for iter_event_batches: the events not folded in yet.
+        """
+        if self.ts_ms is None:
+            return None, None
+        if self.last_id is None:
+            # Checkpoint from before last_id was stored.
+            return self.ts_ms + 1, None
+        return None, (self.ts_ms, self.last_id)
+
+    def apply(self, evt: dict) -> None:
+        event_type = evt.get("event_type") or ""
+        zone_id = evt.get("zone_id")
+        actor_id = evt.get("actor_id")
+        if actor_id is not None and zone_id:
+            zones = self.actors.setdefault(actor_id, {})
+            prev = zones.get(zone_id, False)
+            zones[zone_id] = True if "ENTER" in event_type else False if "EXIT" in event_type else prev
+        if zone_id and "ENTER" in event_type:
+            self.blocked_zones.add(zone_id)
+        elif zone_id and "EXIT" in event_type:
+            self.blocked_zones.discard(zone_id)
+        ts = evt.get("ts_ms")
+        if ts is not None and (self.ts_ms is None or ts >= self.ts_ms):
+            self.ts_ms = ts
+            if evt.get("_id") is not None:
+                self.last_id = str(evt["_id"])
+        self.event_count += 1
+
+    def to_doc(self, run_id: str) -> dict:
+        return {
+            "run_id": run_id,
+            "ts_ms": self.ts_ms,
+            "event_count": self.event_count,
+            "last_id": self.last_id,
+            "actors": self.actors,
+            "blocked_zones": sorted(self.blocked_zones),
+        }
+
+
+async def state_at(run_id: str, ts_ms: Optional[int] = None) -> RunStateFolder:
+    """
+    Reconstructed state of run_id at ts_ms: nearest checkpoint plus the events after it.
+    """
+    cp = await checkpoints_repo.nearest_checkpoint(run_id, ts_ms)
+    folder = RunStateFolder.from_checkpoint(cp) if cp else RunStateFolder()
+    since_ms, after = folder.resume_after()
+    async for batch in events_repo.iter_event_batches(
+        run_id, since_ms=since_ms, until_ms=ts_ms, after=after
+    ):
+        for evt in batch:
+            folder.apply(evt)
+    if ts_ms is not None:
+        folder.ts_ms = ts_ms
+    return folder
+
+
+class RunCheckpointer:
+    """
+    Counts live events per run and, every N events or S seconds of event time,
+    stores a checkpoint folded from the persisted events after the previous one.
+    Events newer than settle_ms before the triggering event are left for the
+    next checkpoint, so ones still in flight on other workers are not skipped.
+    observe() only counts; a due checkpoint runs as a background task, at most
+    one per run (a checkpoint that comes due meanwhile is folded into the next).
+    """
+
+    def __init__(
+        self,
+        every_events: int = 500,
+        every_s: float = 30.0,
+        max_runs: int = 8,
+        settle_ms: int = 5000,
+    ):
+        self.every_events = max(1, every_events)
+        self.every_ms = max(0.0, every_s) * 1000.0
+        self.max_runs = max(1, max_runs)
+        self.settle_ms = max(0, settle_ms)
+        # run_id -> [events seen since the last checkpoint, event ts_ms at the last one]
+        self._marks: "OrderedDict[str, list]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def observe(self, run_id: str, doc: dict) -> None:
+        mark = self._marks.get(run_id)
+        if mark is None:
+            mark = self._marks[run_id] = [0, doc.get("ts_ms")]
+        self._marks.move_to_end(run_id)
+        while len(self._marks) > self.max_runs:
+            self._marks.popitem(last=False)
+
+        mark[0] += 1
+        ts = doc.get("ts_ms")
+        due = mark[0] >= self.every_events
+        if not due and self.every_ms and mark[1] is not None and ts is not None:
+            due = ts - mark[1] >= self.every_ms
+        if due and ts is not None and run_id not in self._tasks:
+            mark[0], mark[1] = 0, ts
+            task = asyncio.create_task(self._checkpoint_in_background(run_id, ts - self.settle_ms))
+            self._tasks[run_id] = task
+            task.add_done_callback(lambda _t: self._tasks.pop(run_id, None))
+
+    async def _checkpoint_in_background(self, run_id: str, until_ms: int) -> None:
+        try:
+            await self.checkpoint(run_id, until_ms)
+        except Exception as exc:
+            logger.warning("checkpoint of run %s failed: %s", run_id, exc)
+
+    async def close(self) -> None:
+        # Checkpoints are rebuilt from stored events, so an interrupted one is simply skipped.
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def checkpoint(self, run_id: str, until_ms: int) -> Optional[RunStateFolder]:
+        """
+        Fold the persisted events after the latest checkpoint up to until_ms and
+        store the result. None (nothing stored) when there were none.
+        """
+        cp = await checkpoints_repo.nearest_checkpoint(run_id)
+        folder = RunStateFolder.from_checkpoint(cp) if cp else RunStateFolder()
+        since_ms, after = folder.resume_after()
+        start = folder.event_count
+        async for batch in events_repo.iter_event_batches(
+            run_id, since_ms=since_ms, until_ms=until_ms, after=after
+        ):
+            for evt in batch:
+                folder.apply(evt)
+        if folder.event_count == start:
+            return None
+        await checkpoints_repo.insert_checkpoint(folder.to_doc(run_id))
+        return folder
+
+
+class ReplaySession:
+    """
+    One viewer's replay. Accepts control messages while streaming:
+    {"action": "seek", "ts_ms": ...}, {"action": "pause"}, {"action": "resume"},
+    {"action": "speed", "speed": 2.0}.
+    """
+
+    def __init__(
+        self,
+        ws: WebSocket,
+        run_id: str,
+        speed: float = 1.0,
+        limit: Optional[int] = None,
+        batch_size: int = 500,
+        prefetch_batches: int = 2,
+    ):
+        self.ws = ws
+        self.run_id = run_id
+        self.speed = _clamp_speed(speed)
+        self.limit = limit
+        self.batch_size = batch_size
+        self.prefetch_batches = max(1, prefetch_batches)
+        self.sent = 0
+        self.paused = False
+        self._seek_ms: Optional[int] = None
+        self._closed = False
+        self._wake = asyncio.Event()
+
+    async def run(self) -> int:
+        """
+        Stream until the run ends, then stay open for seeks until the viewer leaves.
+        Returns events sent.
+        """
+        reader = asyncio.create_task(self._read_controls())
+        try:
+            since_ms: Optional[int] = None
+            while not self._closed:
+                finished = await self._stream(since_ms)
+                if finished:
+                    await self.ws.send_json(
+                        {"type": "replay_done", "data": {"run_id": self.run_id, "count": self.sent}}
+                    )
+                    while self._seek_ms is None and not self._closed:
+                        await self._wait_wake()
+                if self._closed:
+                    break
+                target, self._seek_ms = self._seek_ms, None
+                folder = await state_at(self.run_id, target)
+                await self.ws.send_json({"type": "replay_state", "data": folder.to_doc(self.run_id)})
+                since_ms = target + 1
+        finally:
+            reader.cancel()
+        return self.sent
+
+    async def _stream(self, since_ms: Optional[int]) -> bool:
+        """
+        Paced send from since_ms. True when the run (or limit) is exhausted,
+        False when interrupted by a seek or disconnect. The limit counts this
+        stream's events, so every seek gets up to limit more.
+        """
+        batches: "asyncio.Queue[object]" = asyncio.Queue(maxsize=self.prefetch_batches)
+        producer = asyncio.create_task(
+            _prefetch(
+                events_repo.iter_event_batches(
+                    self.run_id, since_ms=since_ms, batch_size=self.batch_size
+                ),
+                batches,
+            )
+        )
+        prev_ts: Optional[int] = None
+        streamed = 0
+        try:
+            while True:
+                if self.limit is not None and streamed >= self.limit:
+                    return True
+                batch = await batches.get()
+                if batch is _DONE:
+                    return True
+                if isinstance(batch, BaseException):
+                    raise batch
+                for evt in batch:
+                    ts = evt.get("ts_ms", prev_ts)
+                    gap_s = (ts - prev_ts) / 1000.0 if prev_ts is not None and ts is not None else 0.0
+                    if not await self._pace(max(0.0, gap_s)):
+                        return False
+                    await self.ws.send_json({"type": "replay_event", "data": evt})
+                    prev_ts = ts
+                    self.sent += 1
+                    streamed += 1
+                    if self.limit is not None and streamed >= self.limit:
+                        return True
+        finally:
+            producer.cancel()
+
+    async def _pace(self, gap_s: float) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(gap_s / self.speed, MAX_GAP_S)
+        while True:
+            if self._seek_ms is not None or self._closed:
+                return False
+            if self.paused:
+                await self._wait_wake()
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return True
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return True
+            self._wake.clear()
+
+    async def _wait_wake(self) -> None:
+        await self._wake.wait()
+        self._wake.clear()
+
+    async def _read_controls(self) -> None:
+        try:
+            while True:
+                text = await self.ws.receive_text()
+                try:
+                    msg = json.loads(text)
+                except (TypeError, ValueError):
+                    continue
+                if isinstance(msg, dict):
+                    await self._apply_control(msg)
+        except Exception:
+            # Disconnect (or a broken socket) ends the session.
+            self._closed = True
+            self._wake.set()
+
+    async def _apply_control(self, msg: dict) -> None:
+        action = msg.get("action")
+        if action == "seek" and isinstance(msg.get("ts_ms"), (int, float)):
+            self._seek_ms = int(msg["ts_ms"])
+        elif action == "pause":
+            self.paused = True
+        elif action == "resume":
+            self.paused = False
+        elif action == "speed" and isinstance(msg.get("speed"), (int, float)):
+            self.speed = _clamp_speed(float(msg["speed"]))
+        else:
+            return
+        self._wake.set()
+        await self.ws.send_json(
+            {
+                "type": "replay_status",
+                "data": {"run_id": self.run_id, "paused": self.paused, "speed": self.speed},
+            }
+        )
+
+
+def _clamp_speed(speed: float) -> float:
+    return max(MIN_SPEED, min(speed, MAX_SPEED))
+
+
+async def _prefetch(source: AsyncIterator[List[dict]], out: "asyncio.Queue[object]") -> None:
+    try:
+        async for batch in source:
+            await out.put(batch)
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:
+        await out.put(exc)
+        return
+    await out.put(_DONE)
@@ -1 +1 @@
-from . import zones_repo, events_repo, runs_repo, metric_repo
+from . import paging, archive_repo, zones_repo, events_repo, runs_repo, metric_repo, checkpoints_repo, actors_repo
@@ -0,0 +1,74 @@
+"""
+actors_repo.py
+What this file does:
+- Persists the latest zone membership per actor (actors_state).
+- Batched upserts for the write-behind ActorStateWriter.
+- Keeps an indexed `inside` list (zones the actor is in) so startup reads only
+  actors that occupy a zone instead of every tracker id ever seen.
+"""
+
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+from pymongo import UpdateOne
+from ..db.mongo import col_actors
+
+
+def inside_zones(zones: Dict[str, bool]) -> List[str]:
+    return sorted(z for z, inside in zones.items() if inside)
+
+
+async def upsert_actor_states(states: List[Dict[str, Any]]) -> int:
+    """
+    One unordered bulk_write of {"actor_id", "last_seen_ms", "zones"} upserts.
+    """
+    if not states:
+        return 0
+    ops = [
+        UpdateOne(
+            {"actor_id": s["actor_id"]},
+            {"$set": {**s, "inside": inside_zones(s.get("zones") or {})}},
+            upsert=True,
+        )
+        for s in states
+    ]
+    r = await col_actors().bulk_write(ops, ordered=False)
+    return r.upserted_count + r.modified_count
+
+
+async def prune_actor_states(before_ms: int) -> int:
+    """
+    Drop actors not seen since before_ms (expired ones and any a restart orphaned).
+    """
+    r = await col_actors().delete_many({"last_seen_ms": {"$lt": before_ms}})
+    return r.deleted_count
+
+
+async def live_actor_states(since_ms: Optional[int] = None) -> List[dict]:
+    """
+    Actors inside at least one zone (seen at or after since_ms), via the inside index.
+    """
+    # $gt "" on the multikey index skips empty lists and missing fields.
+    q: Dict[str, Any] = {"inside": {"$gt": ""}}
+    if since_ms is not None:
+        q["last_seen_ms"] = {"$gte": since_ms}
+    cur = col_actors().find(q, projection={"_id": 0, "actor_id": 1, "inside": 1, "last_seen_ms": 1})
+    return await cur.to_list(length=None)
+
+
+async def backfill_inside(batch_size: int = 1000) -> int:
+    """
+    Fill `inside` on documents written before it existed. Index-backed lookup
+    (missing field), so once done it costs one empty probe per boot.
+    """
+    done = 0
+    ops: List[UpdateOne] = []
+    async for d in col_actors().find({"inside": None}, projection={"_id": 1, "zones": 1}):
+        ops.append(UpdateOne({"_id": d["_id"]}, {"$set": {"inside": inside_zones(d.get("zones") or {})}}))
+        if len(ops) >= batch_size:
+            await col_actors().bulk_write(ops, ordered=False)
+            done += len(ops)
+            ops = []
+    if ops:
+        await col_actors().bulk_write(ops, ordered=False)
+        done += len(ops)
+    return done
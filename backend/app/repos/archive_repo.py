@@ -0,0 +1,185 @@
+"""
+archive_repo.py
+What this file does:
+- Compacts a completed run's events into a gzip file on local disk.
+- Reads archived runs back in bounded row groups so replay/query stay streaming.
+
+File layout (one JSON document per line, whole file gzip-compressed):
+- header:    {"v": 1, "run_id": ...}
+- row group: {"n": rows, "min_ts": .., "max_ts": .., "cols": {field: column}}
+- footer:    {"end": {"count": .., "min_ts": .., "max_ts": ..}}
+A column is a plain list, or {"dict": [...], "codes": [...]} for repetitive strings
+(actor/zone/event type/run ids compress to small integers before gzip sees them).
+"""
+
+from __future__ import annotations
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import re
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+
+from ..config import settings
+
+ARCHIVE_VERSION = 1
+_MISSING = "__ropt_missing__"
+
+
+def archive_path(run_id: str) -> Optional[str]:
+    if not settings.archive_dir:
+        return None
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", run_id)
+    if safe != run_id:
+        safe += "-" + hashlib.sha1(run_id.encode()).hexdigest()[:8]
+    return os.path.join(settings.archive_dir, f"{safe}.events.jsonl.gz")
+
+
+def is_archived(run_id: Optional[str]) -> bool:
+    if not run_id:
+        return False
+    path = archive_path(run_id)
+    return bool(path) and os.path.exists(path)
+
+
+class ArchiveWriter:
+    """
+    Streams row groups into <path>.tmp and atomically renames it on close().
+    """
+
+    def __init__(self, run_id: str):
+        path = archive_path(run_id)
+        if path is None:
+            raise RuntimeError("archive_dir is not configured")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.run_id = run_id
+        self.path = path
+        self._tmp = path + ".tmp"
+        self._raw = open(self._tmp, "wb")
+        self._fh = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+        self._write_line({"v": ARCHIVE_VERSION, "run_id": run_id})
+        self.count = 0
+        self.min_ts: Optional[int] = None
+        self.max_ts: Optional[int] = None
+
+    def write_rows(self, rows: List[dict]) -> None:
+        if not rows:
+            return
+        ts = [r.get("ts_ms") for r in rows if r.get("ts_ms") is not None]
+        group_min = min(ts) if ts else None
+        group_max = max(ts) if ts else None
+        self._write_line(
+            {"n": len(rows), "min_ts": group_min, "max_ts": group_max, "cols": _to_columns(rows)}
+        )
+        self.count += len(rows)
+        if group_min is not None:
+            self.min_ts = group_min if self.min_ts is None else min(self.min_ts, group_min)
+            self.max_ts = group_max if self.max_ts is None else max(self.max_ts, group_max)
+
+    def _write_line(self, doc: Dict[str, Any]) -> None:
+        self._fh.write(json.dumps(doc, default=str, separators=(",", ":")).encode() + b"\n")
+
+    def close(self) -> Dict[str, Any]:
+        summary = {"count": self.count, "min_ts": self.min_ts, "max_ts": self.max_ts}
+        self._write_line({"end": summary})
+        self._fh.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        os.replace(self._tmp, self.path)
+        return {**summary, "path": self.path}
+
+    def abort(self) -> None:
+        try:
+            self._fh.close()
+            self._raw.close()
+        finally:
+            if os.path.exists(self._tmp):
+                os.remove(self._tmp)
+
+
+async def iter_archived_batches(
+    run_id: str,
+    since_ms: Optional[int] = None,
+    until_ms: Optional[int] = None,
+    after: Optional[Tuple[Any, str]] = None,
+) -> AsyncIterator[List[dict]]:
+    """
+    Yield archived rows one row group at a time, filtered to [since_ms, until_ms]
+    and, for keyset paging, to rows strictly after (ts_ms, _id).
+    """
+    path = archive_path(run_id)
+    if not path:
+        return
+    fh = await asyncio.to_thread(gzip.open, path, "rt", encoding="utf-8")
+    try:
+        while True:
+            line = await asyncio.to_thread(fh.readline)
+            if not line:
+                break
+            group = json.loads(line)
+            if "cols" not in group:
+                continue
+            if until_ms is not None and group.get("min_ts") is not None and group["min_ts"] > until_ms:
+                # Row groups are written in ts order.
+                break
+            if since_ms is not None and group.get("max_ts") is not None and group["max_ts"] < since_ms:
+                continue
+            rows = [
+                r
+                for r in _from_columns(group["n"], group["cols"])
+                if _in_range(r, since_ms, until_ms, after)
+            ]
+            if rows:
+                yield rows
+    finally:
+        await asyncio.to_thread(fh.close)
+
+
+def _in_range(row: dict, since_ms, until_ms, after) -> bool:
+    ts = row.get("ts_ms")
+    if since_ms is not None and (ts is None or ts < since_ms):
+        return False
+    if until_ms is not None and (ts is None or ts > until_ms):
+        return False
+    if after is not None:
+        # ObjectId hex strings sort the same way the ObjectIds do.
+        return (ts, str(row.get("_id"))) > (after[0], after[1])
+    return True
+
+
+def _to_columns(rows: List[dict]) -> Dict[str, Any]:
+    fields: List[str] = []
+    seen = set()
+    for r in rows:
+        for k in r:
+            if k not in seen:
+                seen.add(k)
+                fields.append(k)
+    cols: Dict[str, Any] = {}
+    for f in fields:
+        values = [r.get(f, _MISSING) for r in rows]
+        if f == "_id":
+            values = [str(v) for v in values]
+        if all(isinstance(v, str) for v in values):
+            uniq: Dict[str, int] = {}
+            codes = [uniq.setdefault(v, len(uniq)) for v in values]
+            if len(uniq) * 2 <= len(values):
+                cols[f] = {"dict": list(uniq), "codes": codes}
+                continue
+        cols[f] = values
+    return cols
+
+
+def _from_columns(n: int, cols: Dict[str, Any]) -> List[dict]:
+    rows: List[dict] = [{} for _ in range(n)]
+    for f, col in cols.items():
+        if isinstance(col, dict):
+            values = [col["dict"][c] for c in col["codes"]]
+        else:
+            values = col
+        for row, v in zip(rows, values):
+            if v != _MISSING:
+                row[f] = v
+    return rows
@@ -0,0 +1,29 @@
+"""
+checkpoints_repo.py
+What this file does:
+- Stores periodic per-run state checkpoints (actor zones + blocked zones).
+- Lets replay/seek start from the nearest checkpoint instead of the first event.
+"""
+
+from __future__ import annotations
+from typing import Optional, Dict, Any
+from ..db.mongo import col_checkpoints
+
+
+async def insert_checkpoint(cp: Dict[str, Any]) -> str:
+    r = await col_checkpoints().insert_one(cp)
+    return str(r.inserted_id)
+
+
+async def nearest_checkpoint(run_id: str, ts_ms: Optional[int] = None) -> Optional[dict]:
+    """
+    Latest checkpoint at or before ts_ms (or the latest overall when ts_ms is None).
+    """
+    q: Dict[str, Any] = {"run_id": run_id}
+    if ts_ms is not None:
+        q["ts_ms"] = {"$lte": ts_ms}
+    # Workers may checkpoint the same ts_ms; the one that folded more is further along.
+    d = await col_checkpoints().find_one(q, sort=[("ts_ms", -1), ("event_count", -1)])
+    if d:
+        d["_id"] = str(d["_id"])
+    return d
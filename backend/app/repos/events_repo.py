@@ -3,11 +3,15 @@ events_repo.py
 @Shelton Bumhe
 - Writes safety events to MongoDB (durable log).
 - Supports queries for replay and dashboards.
+- Reads of archived (cold) runs are served from archive_repo transparently.
 """
 
 from __future__ import annotations
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
 from ..db.mongo import col_events
+from . import archive_repo, paging
 
 
 async def insert_event(evt: Dict[str, Any]) -> str:
@@ -20,15 +24,195 @@ async def query_events(
     since_ms: Optional[int] = None,
     limit: int = 200
 ) -> List[dict]:
+    if archive_repo.is_archived(run_id):
+        out: List[dict] = []
+        async for batch in archive_repo.iter_archived_batches(run_id, since_ms=since_ms):
+            out.extend(batch[: limit - len(out)])
+            if len(out) >= limit:
+                break
+        return out
+    q = _event_filter(run_id, since_ms)
+    cur = col_events().find(q, sort=[("ts_ms", 1)]).limit(limit)
+    out = []
+    async for d in cur:
+        d["_id"] = str(d["_id"])
+        out.append(d)
+    return out
+
+
+async def query_events_page(
+    run_id: Optional[str] = None,
+    since_ms: Optional[int] = None,
+    limit: int = 200,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Keyset page on (ts_ms, _id); pass the returned cursor back to continue.
+    """
+    if archive_repo.is_archived(run_id):
+        return await _archived_page(run_id, since_ms, limit, cursor, fields)
+    q = _event_filter(run_id, since_ms)
+    return await paging.fetch_page(col_events(), q, limit, cursor=cursor, fields=fields)
+
+
+async def _archived_page(
+    run_id: str,
+    since_ms: Optional[int],
+    limit: int,
+    cursor: Optional[str],
+    fields: Optional[str],
+) -> Tuple[List[dict], Optional[str]]:
+    after = None
+    if cursor:
+        ts, oid = paging.decode_cursor(cursor)
+        after = (ts, str(oid))
+    projection = paging.parse_fields(fields)
+    out: List[dict] = []
+    async for batch in archive_repo.iter_archived_batches(run_id, since_ms=since_ms, after=after):
+        out.extend(batch[: limit + 1 - len(out)])
+        if len(out) > limit:
+            break
+    next_cursor = paging.encode_cursor(out[limit - 1]) if len(out) > limit else None
+    out = out[:limit]
+    if projection:
+        out = [{k: v for k, v in d.items() if k in projection or k == "_id"} for d in out]
+    return out, next_cursor
+
+
+async def update_traces(items: List[Tuple[str, Dict[str, float]]]) -> int:
+    if not items:
+        return 0
+    ops = [UpdateOne({"_id": ObjectId(_id)}, {"$set": {"trace": trace}}) for _id, trace in items]
+    r = await col_events().bulk_write(ops, ordered=False)
+    return r.modified_count
+
+
+async def latency_breakdown(
+    run_id: str, segments: List[Tuple[str, str, str]]
+) -> Dict[str, Any]:
+    """
+    Per-segment min/mean/p50/p95/p99/max of trace stamp deltas for one run,
+    computed in Mongo ($percentile needs MongoDB 7.0+).
+    segments: (name, start stamp, end stamp), see tracing.SEGMENTS.
+    """
+    project: Dict[str, Any] = {
+        name: {"$subtract": [f"$trace.{end}", f"$trace.{start}"]} for name, start, end in segments
+    }
+    project["end_to_end"] = {
+        "$subtract": [
+            {"$ifNull": ["$trace.solve_done_ms", "$trace.broadcast_ms"]},
+            {"$ifNull": ["$trace.edge_enqueue_ms", "$ts_ms"]},
+        ]
+    }
+    group: Dict[str, Any] = {"_id": None, "count": {"$sum": 1}}
+    for name in project:
+        group[f"{name}__count"] = {"$sum": {"$cond": [{"$isNumber": f"${name}"}, 1, 0]}}
+        group[f"{name}__min"] = {"$min": f"${name}"}
+        group[f"{name}__mean"] = {"$avg": f"${name}"}
+        group[f"{name}__max"] = {"$max": f"${name}"}
+        group[f"{name}__pct"] = {
+            "$percentile": {"input": f"${name}", "p": [0.5, 0.95, 0.99], "method": "approximate"}
+        }
+    pipeline = [
+        {
+            "$match": {
+                "run_id": run_id,
+                "trace.dequeue_ms": {"$exists": True},
+                "payload.implicit": {"$ne": True},
+            }
+        },
+        {"$project": project},
+        {"$group": group},
+    ]
+    stats: Dict[str, Any] = {}
+    count = 0
+    async for d in col_events().aggregate(pipeline, allowDiskUse=True):
+        count = d["count"]
+        for name in project:
+            if not d.get(f"{name}__count"):
+                continue
+            pct = d.get(f"{name}__pct") or [None, None, None]
+            stats[name] = {
+                "count": d[f"{name}__count"],
+                "min": d.get(f"{name}__min"),
+                "mean": d.get(f"{name}__mean"),
+                "p50": pct[0],
+                "p95": pct[1],
+                "p99": pct[2],
+                "max": d.get(f"{name}__max"),
+            }
+    return {"count": count, "segments": stats}
+
+
+async def delete_events(ids: List[str]) -> int:
+    """
+    Delete exactly these events (string ids as returned by the readers above).
+    """
+    if not ids:
+        return 0
+    r = await col_events().delete_many({"_id": {"$in": [_oid(i) for i in ids]}})
+    return r.deleted_count
+
+
+def _oid(value: str) -> Any:
+    return ObjectId(value) if ObjectId.is_valid(value) else value
+
+
+def _event_filter(run_id: Optional[str], since_ms: Optional[int]) -> Dict[str, Any]:
     q: Dict[str, Any] = {}
     if run_id:
         q["run_id"] = run_id
     if since_ms is not None:
         q["ts_ms"] = {"$gte": since_ms}
+    return q
 
-    cur = col_events().find(q, sort=[("ts_ms", 1)]).limit(limit)
-    out = []
+
+async def iter_event_batches(
+    run_id: str,
+    since_ms: Optional[int] = None,
+    batch_size: int = 500,
+    until_ms: Optional[int] = None,
+    after: Optional[Tuple[int, str]] = None,
+    hot_only: bool = False,
+) -> AsyncIterator[List[dict]]:
+    """
+    Stream a run's events in (ts_ms, _id) order, batch_size documents at a time,
+    optionally only those strictly after the (ts_ms, _id) keyset position `after`.
+    Rides the (run_id, ts_ms, _id) index so nothing is sorted or buffered
+    server-side; archived runs stream from their row groups instead, unless
+    hot_only (the archiver reading what is still in Mongo).
+    """
+    if after is not None:
+        since_ms = after[0] if since_ms is None else max(since_ms, after[0])
+    if not hot_only and archive_repo.is_archived(run_id):
+        async for batch in archive_repo.iter_archived_batches(
+            run_id, since_ms=since_ms, until_ms=until_ms, after=after
+        ):
+            yield batch
+        return
+    q: Dict[str, Any] = {"run_id": run_id}
+    ts_range: Dict[str, int] = {}
+    if since_ms is not None:
+        ts_range["$gte"] = since_ms
+    if until_ms is not None:
+        ts_range["$lte"] = until_ms
+    if ts_range:
+        q["ts_ms"] = ts_range
+    if after is not None:
+        # ts_ms >= after[0] is already in the index bounds above.
+        q["$or"] = [{"ts_ms": {"$gt": after[0]}}, {"_id": {"$gt": ObjectId(after[1])}}]
+    cur = (
+        col_events()
+        .find(q, sort=[("ts_ms", ASCENDING), ("_id", ASCENDING)], batch_size=batch_size)
+        .hint([("run_id", ASCENDING), ("ts_ms", ASCENDING), ("_id", ASCENDING)])
+    )
+    batch: List[dict] = []
     async for d in cur:
         d["_id"] = str(d["_id"])
-        out.append(d)
-    return out
+        batch.append(d)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
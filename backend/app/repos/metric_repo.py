@@ -3,25 +3,205 @@
 metrics_repo.py
 What this file does:
 - Stores performance metrics for NVIDIA-style proof (FPS, latency, solve time).
+- Aggregates percentiles per run / time bucket inside Mongo (no raw rows shipped).
+- Samples live in a time-series collection: {"ts": date, "meta": {run_id, source}, ...}.
+  Reads flatten them back to the original MetricIn-shaped rows.
+- Copies rows from the pre-time-series "metrics" collection once, at startup.
 """
 
 from __future__ import annotations
-from typing import Optional, List, Dict, Any
-from ..db.mongo import col_metrics
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Tuple
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from ..db.mongo import col_metrics, col_metrics_legacy, col_migrations
+from ..runtime_state import now_ms
+from . import paging
+
+SUMMARY_FIELDS = ("pipeline_fps", "evt_to_backend_ms", "cuopt_solve_ms", "end_to_end_ms")
+PERCENTILES = (0.5, 0.95, 0.99)
+
+MIGRATION_BATCH = 1000
+# A migration claim older than this is from a crashed worker and may be taken over.
+MIGRATION_LEASE_MS = 60_000
+
+
+def to_timeseries_doc(m: Dict[str, Any]) -> Dict[str, Any]:
+    doc = dict(m)
+    doc.setdefault("_id", ObjectId())
+    doc["meta"] = {"run_id": doc.pop("run_id", None), "source": doc.pop("source", None)}
+    doc["ts"] = datetime.fromtimestamp(doc["ts_ms"] / 1000.0, tz=timezone.utc)
+    return doc
+
+
+def _flatten(d: Dict[str, Any]) -> Dict[str, Any]:
+    meta = d.pop("meta", None)
+    d.pop("ts", None)
+    d["_id"] = str(d["_id"])
+    if meta is not None:
+        d["run_id"] = meta.get("run_id")
+        if meta.get("source") is not None:
+            d["source"] = meta["source"]
+    return d
 
 
 async def insert_metric(m: Dict[str, Any]) -> str:
-    r = await col_metrics().insert_one(m)
+    r = await col_metrics().insert_one(to_timeseries_doc(m))
     return str(r.inserted_id)
 
 
+async def insert_metrics(ms: List[Dict[str, Any]]) -> int:
+    """
+    One unordered insert_many for a buffered batch; returns rows written.
+    """
+    if not ms:
+        return 0
+    docs = [m if "meta" in m else to_timeseries_doc(m) for m in ms]
+    r = await col_metrics().insert_many(docs, ordered=False)
+    return len(r.inserted_ids)
+
+
 async def query_metrics(run_id: Optional[str] = None, limit: int = 500) -> List[dict]:
     q: Dict[str, Any] = {}
     if run_id:
-        q["run_id"] = run_id
+        q["meta.run_id"] = run_id
     cur = col_metrics().find(q, sort=[("ts_ms", 1)]).limit(limit)
     out = []
     async for d in cur:
-        d["_id"] = str(d["_id"])
-        out.append(d)
+        out.append(_flatten(d))
+    return out
+
+
+async def query_metrics_page(
+    run_id: Optional[str] = None,
+    limit: int = 500,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    q: Dict[str, Any] = {}
+    if run_id:
+        q["meta.run_id"] = run_id
+    if fields:
+        # run_id/source live under meta in the time-series layout.
+        names = [f.strip() for f in fields.split(",")]
+        names = ["meta" if f in ("run_id", "source") else f for f in names]
+        fields = ",".join(names)
+    docs, next_cursor = await paging.fetch_page(
+        col_metrics(), q, limit, cursor=cursor, fields=fields
+    )
+    return [_flatten(d) for d in docs], next_cursor
+
+
+async def aggregate_metrics(
+    run_id: Optional[str] = None,
+    bucket_ms: Optional[int] = None,
+    since_ms: Optional[int] = None,
+    until_ms: Optional[int] = None,
+) -> List[dict]:
+    """
+    min/mean/p50/p95/p99 of SUMMARY_FIELDS per run, or per run and ts bucket.
+    Uses $percentile (MongoDB 7.0+), so only the summaries leave the server.
+    """
+    match: Dict[str, Any] = {}
+    if run_id:
+        match["meta.run_id"] = run_id
+    ts_range: Dict[str, int] = {}
+    if since_ms is not None:
+        ts_range["$gte"] = since_ms
+    if until_ms is not None:
+        ts_range["$lt"] = until_ms
+    if ts_range:
+        match["ts_ms"] = ts_range
+
+    group_id: Dict[str, Any] = {"run_id": "$meta.run_id"}
+    if bucket_ms:
+        group_id["bucket"] = {"$subtract": ["$ts_ms", {"$mod": ["$ts_ms", bucket_ms]}]}
+    group: Dict[str, Any] = {"_id": group_id, "count": {"$sum": 1}}
+    for f in SUMMARY_FIELDS:
+        group[f"{f}__min"] = {"$min": f"${f}"}
+        group[f"{f}__mean"] = {"$avg": f"${f}"}
+        group[f"{f}__pct"] = {
+            "$percentile": {"input": f"${f}", "p": list(PERCENTILES), "method": "approximate"}
+        }
+
+    pipeline: List[Dict[str, Any]] = []
+    if match:
+        pipeline.append({"$match": match})
+    pipeline.append({"$group": group})
+    pipeline.append({"$sort": {"_id.run_id": 1, "_id.bucket": 1}})
+
+    out = []
+    async for d in col_metrics().aggregate(pipeline, allowDiskUse=True):
+        stats = {}
+        for f in SUMMARY_FIELDS:
+            pct = d.get(f"{f}__pct") or [None] * len(PERCENTILES)
+            stats[f] = {
+                "min": d.get(f"{f}__min"),
+                "mean": d.get(f"{f}__mean"),
+                "p50": pct[0],
+                "p95": pct[1],
+                "p99": pct[2],
+            }
+        row = {"run_id": d["_id"].get("run_id"), "count": d["count"], "stats": stats}
+        if bucket_ms:
+            row["bucket_start_ms"] = d["_id"].get("bucket")
+        out.append(row)
     return out
+
+
+async def migrate_legacy_metrics() -> int:
+    """
+    Copy the pre-time-series "metrics" collection into metrics_ts, once, then
+    drop it (so later startups stop at the first find_one). One worker claims
+    it in "migrations" and records progress per batch, so a crash resumes
+    where it stopped. Returns rows copied by this call.
+    """
+    if not await col_metrics_legacy().find_one({}, {"_id": 1}):
+        return 0
+    try:
+        claim = await col_migrations().find_one_and_update(
+            {
+                "_id": "metrics_ts",
+                "done": {"$ne": True},
+                "$or": [
+                    {"lease_ms": {"$exists": False}},
+                    {"lease_ms": {"$lt": now_ms() - MIGRATION_LEASE_MS}},
+                ],
+            },
+            {"$set": {"lease_ms": now_ms()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Done already, or another worker holds the claim.
+        state = await col_migrations().find_one({"_id": "metrics_ts"}, {"done": 1})
+        if state and state.get("done"):
+            # Copied, but the process stopped before the drop below.
+            await col_metrics_legacy().drop()
+        return 0
+    last_id = claim.get("last_id")
+    copied = 0
+    while True:
+        q = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await col_metrics_legacy().find(q, sort=[("_id", 1)]).limit(MIGRATION_BATCH).to_list(
+            length=None
+        )
+        if not batch:
+            break
+        docs = [to_timeseries_doc(d) for d in batch if isinstance(d.get("ts_ms"), (int, float))]
+        if docs:
+            # A batch interrupted before its progress was saved is copied again;
+            # time-series collections have no unique _id, so clear it first.
+            await col_metrics().delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+            await col_metrics().insert_many(docs, ordered=False)
+            copied += len(docs)
+        last_id = batch[-1]["_id"]
+        await col_migrations().update_one(
+            {"_id": "metrics_ts"}, {"$set": {"last_id": last_id, "lease_ms": now_ms()}}
+        )
+    await col_migrations().update_one(
+        {"_id": "metrics_ts"}, {"$set": {"done": True, "copied_ms": now_ms()}, "$unset": {"lease_ms": ""}}
+    )
+    await col_metrics_legacy().drop()
+    return copied
@@ -0,0 +1,75 @@
+"""
+paging.py
+What this file does:
+- Keyset pagination on (ts_ms, _id) shared by the event and metric queries.
+- Cursors are opaque base64 tokens so duplicate timestamps never skip or repeat rows.
+"""
+
+from __future__ import annotations
+import base64
+import json
+from typing import Optional, List, Dict, Any, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    raw = json.dumps({"t": doc.get("ts_ms"), "i": str(doc["_id"])}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, ObjectId]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return data["t"], ObjectId(data["i"])
+    except (ValueError, KeyError, TypeError, InvalidId) as exc:
+        raise InvalidCursor("invalid cursor") from exc
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Dict[str, int]]:
+    """
+    "a,b" -> projection {a: 1, b: 1, ts_ms: 1}; _id is always returned for the cursor.
+    """
+    if not fields:
+        return None
+    names = [f.strip() for f in fields.split(",") if f.strip() and not f.strip().startswith("$")]
+    if not names:
+        return None
+    projection = {name: 1 for name in names}
+    projection["ts_ms"] = 1
+    return projection
+
+
+async def fetch_page(
+    collection,
+    q: Dict[str, Any],
+    limit: int,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    One page of q in (ts_ms, _id) order plus the cursor for the next page (None at the end).
+    """
+    if cursor:
+        ts, oid = decode_cursor(cursor)
+        after = {"$or": [{"ts_ms": {"$gt": ts}}, {"ts_ms": ts, "_id": {"$gt": oid}}]}
+        q = {"$and": [q, after]} if q else after
+    cur = collection.find(
+        q,
+        projection=parse_fields(fields),
+        sort=[("ts_ms", 1), ("_id", 1)],
+    ).limit(limit + 1)
+    out = []
+    async for d in cur:
+        out.append(d)
+    next_cursor = encode_cursor(out[limit - 1]) if len(out) > limit else None
+    out = out[:limit]
+    for d in out:
+        d["_id"] = str(d["_id"])
+    return out, next_cursor
@@ -36,3 +36,37 @@ async def list_runs(limit: int = 50):
         d["_id"] = str(d["_id"])
         out.append(d)
     return out
+
+
+async def claim_run_for_archive(ended_before_ms: int, stale_claim_ms: int) -> Optional[str]:
+    """
+    Atomically claim one ended, unarchived run so only one worker archives it.
+    Claims older than stale_claim_ms (a worker died mid-write) can be retaken.
+    """
+    now = now_ms()
+    d = await col_runs().find_one_and_update(
+        {
+            "ended_at_ms": {"$ne": None, "$lt": ended_before_ms},
+            "archived": {"$ne": True},
+            "$or": [
+                {"archive_claimed_ms": {"$exists": False}},
+                {"archive_claimed_ms": {"$lt": now - stale_claim_ms}},
+            ],
+        },
+        {"$set": {"archive_claimed_ms": now}},
+        sort=[("ended_at_ms", 1)],
+    )
+    return str(d["_id"]) if d else None
+
+
+async def mark_archived(run_id: str, summary: Dict[str, Any]) -> None:
+    from bson import ObjectId
+    await col_runs().update_one(
+        {"_id": ObjectId(run_id)},
+        {"$set": {"archived": True, "archive": summary}, "$unset": {"archive_claimed_ms": ""}},
+    )
+
+
+async def release_archive_claim(run_id: str) -> None:
+    from bson import ObjectId
+    await col_runs().update_one({"_id": ObjectId(run_id)}, {"$unset": {"archive_claimed_ms": ""}})
@@ -5,11 +5,15 @@ Writes events to MongoDB and updates live runtime state.
 """
 
 import asyncio
-from fastapi import APIRouter, Depends
+import time
+from fastapi import APIRouter, Depends, HTTPException, Query
 
 from ..schemas import SafetyEventIn
-from ..repos import events_repo
-from ..deps import get_queue, require_edge_key
+from ..repos import archive_repo, events_repo
+from ..repos.paging import InvalidCursor
+from ..deps import get_event_stream, get_queue, require_edge_key
+from ..event_stream import RedisEventStream
+from .. import instrumentation, tracing
 
 router = APIRouter()
 
@@ -18,15 +22,50 @@ router = APIRouter()
 async def ingest_event(
     e: SafetyEventIn,
     queue: "asyncio.Queue[SafetyEventIn]" = Depends(get_queue),
+    stream: RedisEventStream | None = Depends(get_event_stream),
     _auth: None = Depends(require_edge_key),
 ):
+    if e.run_id and archive_repo.is_archived(e.run_id):
+        # Its events are in the archive file now; a new row would be hidden behind it.
+        instrumentation.EVENTS_INGESTED.labels(result="archived_run").inc()
+        raise HTTPException(status_code=409, detail="run is archived")
+    e._accepted_at = time.monotonic()
+    tracing.stamp(e.trace, "accept_ms")
+    if stream is not None:
+        if not await stream.put(e):
+            instrumentation.EVENTS_INGESTED.labels(result="queue_full").inc()
+            return {"ok": False, "error": "event_queue_full"}
+        instrumentation.EVENTS_INGESTED.labels(result="queued").inc()
+        return {"ok": True}
     try:
         queue.put_nowait(e)
-        return {"ok": True}
     except asyncio.QueueFull:
+        instrumentation.EVENTS_INGESTED.labels(result="queue_full").inc()
         return {"ok": False, "error": "event_queue_full"}
+    instrumentation.EVENTS_INGESTED.labels(result="queued").inc()
+    instrumentation.EVENT_QUEUE_DEPTH.set(queue.qsize())
+    return {"ok": True}
+
+
+@router.get("/events/stream/stats")
+async def event_stream_stats(stream: RedisEventStream | None = Depends(get_event_stream)):
+    if stream is None:
+        return {"enabled": False}
+    return {"enabled": True, **await stream.stats()}
 
 
 @router.get("/events")
-async def get_events(run_id: str | None = None, since_ms: int | None = None, limit: int = 200):
-    return {"events": await events_repo.query_events(run_id=run_id, since_ms=since_ms, limit=limit)}
+async def get_events(
+    run_id: str | None = None,
+    since_ms: int | None = None,
+    limit: int = Query(200, ge=1, le=10000),
+    cursor: str | None = None,
+    fields: str | None = None,
+):
+    try:
+        events, next_cursor = await events_repo.query_events_page(
+            run_id=run_id, since_ms=since_ms, limit=limit, cursor=cursor, fields=fields
+        )
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return {"events": events, "next_cursor": next_cursor}
@@ -1,7 +1,8 @@
 """
 health.py
 Provides /health for edge readiness checks.
-Includes Mongo ping so persistence is validated.
+Includes Mongo ping so persistence is validated; solver status is the
+cached result of the background checker (no outbound call per request).
 """
 
 from fastapi import APIRouter
@@ -16,13 +17,13 @@ router = APIRouter()
 @router.get("/health")
 async def health():
     await get_db().command("ping")
-    cuopt = cuopt_client.health_check()
+    cuopt = cuopt_client.status()
     return {"ok": True, "ts_ms": now_ms(), "cuopt": cuopt}
 
 
 @router.get("/health/ready")
 async def ready():
     await get_db().command("ping")
-    cuopt = cuopt_client.health_check()
+    cuopt = cuopt_client.status()
     ok = bool(cuopt.get("ok"))
     return {"ok": ok, "ts_ms": now_ms(), "cuopt": cuopt}
@@ -3,23 +3,66 @@ metrics.py
 Stores and queries performance metrics in MongoDB.
 """
 
-from fastapi import APIRouter
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Query
 
-from ..schemas import MetricIn
+from ..schemas import MetricIn, MetricBatchIn
 from ..repos import metric_repo as metrics_repo
+from ..repos.paging import InvalidCursor
 from ..runtime_state import now_ms
+from ..metrics_buffer import MetricBuffer
+from ..deps import get_metric_buffer
 
 router = APIRouter()
 
 
 @router.post("/metrics")
-async def ingest_metric(m: MetricIn):
+async def ingest_metric(m: MetricIn, buffer: MetricBuffer = Depends(get_metric_buffer)):
     doc = m.model_dump()
     doc["received_ms"] = now_ms()
-    _id = await metrics_repo.insert_metric(doc)
-    return {"ok": True, "_id": _id}
+    # _id is assigned up front so callers still get it back from a buffered write.
+    doc["_id"] = ObjectId()
+    await buffer.add([doc])
+    return {"ok": True, "_id": str(doc["_id"])}
+
+
+@router.post("/metrics/batch")
+async def ingest_metrics_batch(body: MetricBatchIn, buffer: MetricBuffer = Depends(get_metric_buffer)):
+    received = now_ms()
+    docs = []
+    for m in body.metrics:
+        doc = m.model_dump()
+        doc["received_ms"] = received
+        docs.append(doc)
+    await buffer.add(docs)
+    return {"ok": True, "count": len(docs)}
 
 
 @router.get("/metrics")
-async def get_metrics(run_id: str | None = None, limit: int = 500):
-    return {"metrics": await metrics_repo.query_metrics(run_id=run_id, limit=limit)}
+async def get_metrics(
+    run_id: str | None = None,
+    limit: int = Query(500, ge=1, le=10000),
+    cursor: str | None = None,
+    fields: str | None = None,
+):
+    try:
+        metrics, next_cursor = await metrics_repo.query_metrics_page(
+            run_id=run_id, limit=limit, cursor=cursor, fields=fields
+        )
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return {"metrics": metrics, "next_cursor": next_cursor}
+
+
+@router.get("/metrics/summary")
+async def get_metrics_summary(
+    run_id: str | None = None,
+    bucket_ms: int | None = Query(None, ge=1000),
+    since_ms: int | None = None,
+    until_ms: int | None = None,
+):
+    return {
+        "summaries": await metrics_repo.aggregate_metrics(
+            run_id=run_id, bucket_ms=bucket_ms, since_ms=since_ms, until_ms=until_ms
+        )
+    }
@@ -3,12 +3,19 @@ runs.py
 Creates/stops runs so events/metrics can be tagged for replay.
 """
 
+import json
+import zlib
+
 from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 
 from ..schemas import RunStartIn, RunStopIn
-from ..repos import runs_repo
+from ..repos import events_repo, runs_repo
 from ..runtime_state import RuntimeState
 from ..deps import get_state
+from ..replay import state_at
+from ..repos import archive_repo
+from .. import tracing
 
 router = APIRouter()
 
@@ -32,3 +39,52 @@ async def stop_run(body: RunStopIn, state: RuntimeState = Depends(get_state)):
 @router.get("/runs")
 async def list_runs(limit: int = Query(50, ge=1, le=1000)):
     return {"runs": await runs_repo.list_runs(limit=limit)}
+
+
+@router.get("/runs/{run_id}/state")
+async def run_state(run_id: str, ts_ms: int | None = None):
+    # Reconstructed from the nearest checkpoint, not from the first event.
+    folder = await state_at(run_id, ts_ms)
+    return folder.to_doc(run_id)
+
+
+@router.get("/runs/{run_id}/latency")
+async def run_latency(run_id: str):
+    """
+    Per-stage latency breakdown (edge queue, network, backend queue, persist,
+    broadcast, solve, end_to_end) from the traces stored with each event.
+    """
+    if archive_repo.is_archived(run_id):
+        out = await tracing.breakdown_from_batches(events_repo.iter_event_batches(run_id))
+    else:
+        out = await events_repo.latency_breakdown(run_id, list(tracing.SEGMENTS))
+    return {"run_id": run_id, **out}
+
+
+@router.get("/runs/{run_id}/export")
+async def export_run(run_id: str, gzip: bool = False, batch_size: int = Query(1000, ge=1, le=10000)):
+    """
+    Stream a run's events as NDJSON straight off the Mongo cursor (optionally gzipped).
+    """
+    body = _ndjson_batches(run_id, batch_size)
+    headers = {"Content-Disposition": f'attachment; filename="{run_id}.ndjson{".gz" if gzip else ""}"'}
+    if gzip:
+        return StreamingResponse(
+            _gzip_stream(body), media_type="application/gzip", headers=headers
+        )
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
+
+
+async def _ndjson_batches(run_id: str, batch_size: int):
+    async for batch in events_repo.iter_event_batches(run_id, batch_size=batch_size):
+        yield "".join(json.dumps(d, default=str) + "\n" for d in batch).encode()
+
+
+async def _gzip_stream(chunks):
+    # wbits=31 -> gzip container
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        out = comp.compress(chunk)
+        if out:
+            yield out
+    yield comp.flush()
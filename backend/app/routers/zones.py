@@ -9,7 +9,13 @@ from ..schemas import ZonesPayload
 from ..repos import zones_repo
 from ..planning.graph_manager import GraphManager
 from ..planning.spatial_manager import SpatialManager
-from ..deps import get_graph_manager, get_spatial_manager, require_dashboard_key
+from ..planning.replication import PlanningReplicator
+from ..deps import (
+    get_graph_manager,
+    get_planning_replicator,
+    get_spatial_manager,
+    require_dashboard_key,
+)
 
 router = APIRouter()
 
@@ -24,12 +30,17 @@ async def put_zones(
     payload: ZonesPayload,
     graph_manager: GraphManager = Depends(get_graph_manager),
     spatial_manager: SpatialManager = Depends(get_spatial_manager),
+    replicator: PlanningReplicator = Depends(get_planning_replicator),
     _auth: None = Depends(require_dashboard_key),
 ):
     zones = [z.model_dump() for z in payload.zones]
     out = await zones_repo.upsert_zones(zones)
-    graph_manager.refresh_zone_index(zones)
+    # The upsert merges into the stored zones, so index all of them, not just this payload.
+    current_zones = await zones_repo.get_zones()
+    graph_manager.refresh_zone_index(current_zones)
     await spatial_manager.recompute_mappings()
     graph_manager.zone_to_nodes = spatial_manager.zone_to_nodes
     graph_manager._recompute_blocked_nodes()
+    await replicator.publish_zones()
+    await graph_manager.save_artifact(current_zones)
     return out
@@ -2,10 +2,22 @@
 runtime_state.py
 In-memory view of actors/zones and recent events so the API can respond quickly.
 MongoDB handles durable history; this keeps the live snapshot.
+
+apply_event() is the per-event write path: resolve the run, apply the zone
+transition to the actor and push the event. With Redis it runs as one Lua
+script, so it costs one round-trip and is atomic across replicas.
+
+Inactive actors are found through an expiry index ordered by last_seen_ms (a
+heap in memory, a sorted set in Redis), never by scanning: claim_expired_actors
+takes the due ones and the caller queues their implicit exits behind any real
+events. Those exits are applied with if_last_seen_ms, so they are skipped once
+the actor has been seen again, and remove_actor then drops the actor unless it
+was. last_seen_ms (and its expiry score) only ever moves forward.
 """
 
-from dataclasses import dataclass, asdict
-from typing import Dict, List
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import heapq
 import time
 import json
 
@@ -16,43 +28,187 @@ def now_ms() -> int:
     return int(time.time() * 1000)
 
 
-@dataclass
+@dataclass(slots=True)
 class ActorState:
     last_seen_ms: int
     zones: Dict[str, bool]
 
 
+def zone_inside(event_type: str, prev: bool) -> bool:
+    return True if "ENTER" in event_type else False if "EXIT" in event_type else prev
+
+
+class ZoneIndex:
+    """
+    Interns zone ids to bit positions. Append-only, so a (known, inside) bit
+    pair always decodes to the same zones dict, which is cached and shared.
+    """
+
+    __slots__ = ("ids", "_bits", "_decoded")
+
+    MAX_DECODED = 4096
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self._bits: Dict[str, int] = {}
+        self._decoded: Dict[Tuple[int, int], Dict[str, bool]] = {}
+
+    def bit(self, zone_id: str) -> int:
+        b = self._bits.get(zone_id)
+        if b is None:
+            b = 1 << len(self.ids)
+            self._bits[zone_id] = b
+            self.ids.append(zone_id)
+        return b
+
+    def decode(self, known: int, inside: int) -> Dict[str, bool]:
+        """
+        Read-only: the same dict object is handed to every caller.
+        """
+        key = (known, inside)
+        zones = self._decoded.get(key)
+        if zones is None:
+            zones = {}
+            i = 0
+            while known:
+                if known & 1:
+                    zones[self.ids[i]] = bool(inside & (1 << i))
+                known >>= 1
+                i += 1
+            if len(self._decoded) >= self.MAX_DECODED:
+                self._decoded.clear()
+            self._decoded[key] = zones
+        return zones
+
+
+class _Actor:
+    __slots__ = ("last_seen_ms", "known", "inside")
+
+    def __init__(self, last_seen_ms: int):
+        self.last_seen_ms = last_seen_ms
+        # Bit per interned zone: seen in it / currently inside it.
+        self.known = 0
+        self.inside = 0
+
+
 class RuntimeState:
     def __init__(self, max_events: int = 5000):
-        self.actors: Dict[str, ActorState] = {}
-        self.events: List[dict] = []
-        self.max_events = max_events
+        self.zone_index = ZoneIndex()
+        self.actors: Dict[str, _Actor] = {}
+        self.max_events = max(1, max_events)
+        # Fixed ring of recent events; _head is the next slot to write.
+        self._ring: List[Optional[dict]] = [None] * self.max_events
+        self._head = 0
+        self._count = 0
+        # (last_seen_ms, actor_id), at most one entry per actor; stale entries
+        # are rescheduled when they reach the top instead of updated per event.
+        self._expiry: List[Tuple[int, str]] = []
 
         # Active run for tagging events if edge doesn't provide run_id
         self.active_run_id: str | None = None
 
-    async def upsert_actor(self, actor_id: str, ts_ms: int) -> ActorState:
-        st = self.actors.get(actor_id)
-        if st is None:
-            st = ActorState(last_seen_ms=ts_ms, zones={})
-            self.actors[actor_id] = st
-        st.last_seen_ms = ts_ms
-        return st
+    def _record(self, actor_id: str, ts_ms: int) -> _Actor:
+        rec = self.actors.get(actor_id)
+        if rec is None:
+            rec = _Actor(ts_ms)
+            self.actors[actor_id] = rec
+            heapq.heappush(self._expiry, (ts_ms, actor_id))
+        elif ts_ms > rec.last_seen_ms:
+            rec.last_seen_ms = ts_ms
+        return rec
+
+    def _view(self, rec: _Actor) -> ActorState:
+        return ActorState(
+            last_seen_ms=rec.last_seen_ms, zones=dict(self.zone_index.decode(rec.known, rec.inside))
+        )
 
     async def push_event(self, evt: dict) -> None:
-        self.events.append(evt)
-        if len(self.events) > self.max_events:
-            del self.events[: len(self.events) - self.max_events]
+        self._ring[self._head] = evt
+        self._head = (self._head + 1) % self.max_events
+        if self._count < self.max_events:
+            self._count += 1
 
-    async def save_actor(self, actor_id: str, actor: ActorState) -> None:
-        self.actors[actor_id] = actor
+    def recent_events(self, n: int) -> List[dict]:
+        """
+        Up to n most recent events, oldest first.
+        """
+        n = min(n, self._count)
+        start = (self._head - n) % self.max_events
+        if start + n <= self.max_events:
+            return self._ring[start : start + n]
+        return self._ring[start:] + self._ring[: self._head]
+
+    @property
+    def events(self) -> List[dict]:
+        return self.recent_events(self._count)
+
+    async def apply_event(
+        self, evt: dict, if_last_seen_ms: Optional[int] = None
+    ) -> Tuple[Optional[str], Optional[ActorState]]:
+        """
+        Returns (run_id, actor). (None, None) and no changes when the event has
+        no run_id and no run is active. With if_last_seen_ms (implicit exits),
+        (run_id, None) and no changes unless the actor is still last seen then.
+        """
+        run_id = evt.get("run_id") or self.active_run_id
+        if run_id is None:
+            return None, None
+        if if_last_seen_ms is not None:
+            rec = self.actors.get(evt["actor_id"])
+            if rec is None or rec.last_seen_ms > if_last_seen_ms:
+                return run_id, None
+        evt["run_id"] = run_id
+        rec = self._record(evt["actor_id"], evt["ts_ms"])
+        b = self.zone_index.bit(evt["zone_id"])
+        rec.known |= b
+        if zone_inside(evt["event_type"], bool(rec.inside & b)):
+            rec.inside |= b
+        else:
+            rec.inside &= ~b
+        await self.push_event(evt)
+        return run_id, self._view(rec)
+
+    async def claim_expired_actors(
+        self, cutoff_ms: int, limit: int = 500
+    ) -> List[Tuple[str, ActorState]]:
+        """
+        Actors last seen at or before cutoff_ms, each handed out once.
+        """
+        out: List[Tuple[str, ActorState]] = []
+        while self._expiry and self._expiry[0][0] <= cutoff_ms and len(out) < limit:
+            _, actor_id = heapq.heappop(self._expiry)
+            rec = self.actors.get(actor_id)
+            if rec is None:
+                continue
+            if rec.last_seen_ms > cutoff_ms:
+                heapq.heappush(self._expiry, (rec.last_seen_ms, actor_id))
+                continue
+            out.append((actor_id, self._view(rec)))
+        return out
+
+    async def remove_actor(self, actor_id: str, last_seen_ms: int) -> bool:
+        """
+        Drop a claimed actor unless an event newer than last_seen_ms arrived.
+        """
+        rec = self.actors.get(actor_id)
+        if rec is None:
+            return False
+        if rec.last_seen_ms > last_seen_ms:
+            heapq.heappush(self._expiry, (rec.last_seen_ms, actor_id))
+            return False
+        del self.actors[actor_id]
+        return True
 
     async def snapshot(self) -> dict:
+        decode = self.zone_index.decode
         return {
             "ts_ms": now_ms(),
             "active_run_id": self.active_run_id,
-            "actors": {aid: asdict(st) for aid, st in self.actors.items()},
-            "recent_events": self.events[-100:],
+            "actors": {
+                aid: {"last_seen_ms": rec.last_seen_ms, "zones": decode(rec.known, rec.inside)}
+                for aid, rec in self.actors.items()
+            },
+            "recent_events": self.recent_events(100),
         }
 
     async def get_active_run_id(self) -> str | None:
@@ -62,6 +218,83 @@ class RuntimeState:
         self.active_run_id = run_id
 
 
+# KEYS: actors hash, events list, active run id, last-seen sorted set
+# ARGV: actor_id, zone_id, event_type, ts_ms, run_id ("" = active run),
+#       event JSON without run_id, max_events, if_last_seen_ms ("" = none)
+# Mirrors RuntimeState.apply_event / zone_inside; {run_id} alone means skipped.
+# The actor and event JSON are assembled by concatenation so ts_ms and the event
+# body round-trip untouched. last_seen_ms and the expiry score never move back.
+_APPLY_EVENT_LUA = """
+local run_id = ARGV[5]
+if run_id == '' then
+  run_id = redis.call('GET', KEYS[3])
+  if not run_id then
+    return false
+  end
+end
+local zones = {}
+local last_seen = ARGV[4]
+local seen = nil
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+if raw then
+  local ok, data = pcall(cjson.decode, raw)
+  if ok and type(data) == 'table' then
+    if type(data['zones']) == 'table' then
+      zones = data['zones']
+    end
+    seen = tonumber(data['last_seen_ms'])
+  end
+end
+if ARGV[8] ~= '' and (not seen or seen > tonumber(ARGV[8])) then
+  return {run_id}
+end
+if seen and seen > tonumber(last_seen) then
+  last_seen = string.format('%d', seen)
+end
+local zone_id, event_type = ARGV[2], ARGV[3]
+if string.find(event_type, 'ENTER', 1, true) then
+  zones[zone_id] = true
+elseif string.find(event_type, 'EXIT', 1, true) then
+  zones[zone_id] = false
+elseif zones[zone_id] == nil then
+  zones[zone_id] = false
+end
+local actor = '{"last_seen_ms":' .. last_seen .. ',"zones":' .. cjson.encode(zones) .. '}'
+redis.call('HSET', KEYS[1], ARGV[1], actor)
+redis.call('ZADD', KEYS[4], 'GT', last_seen, ARGV[1])
+redis.call('LPUSH', KEYS[2], '{"run_id":' .. cjson.encode(run_id) .. ',' .. string.sub(ARGV[6], 2))
+redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[7]) - 1)
+return {run_id, actor}
+"""
+
+# KEYS: actors hash, last-seen sorted set. ARGV: cutoff_ms, limit
+# ZREM claims each actor, so only one replica emits its implicit exits.
+_CLAIM_EXPIRED_LUA = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local out = {}
+for _, actor_id in ipairs(ids) do
+  redis.call('ZREM', KEYS[2], actor_id)
+  local raw = redis.call('HGET', KEYS[1], actor_id)
+  if raw then
+    table.insert(out, actor_id)
+    table.insert(out, raw)
+  end
+end
+return out
+"""
+
+# KEYS: actors hash, last-seen sorted set. ARGV: actor_id, last_seen_ms
+# The claim removed the score; an event since then has added a later one.
+_REMOVE_ACTOR_LUA = """
+local score = redis.call('ZSCORE', KEYS[2], ARGV[1])
+if score and tonumber(score) > tonumber(ARGV[2]) then
+  return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+return redis.call('HDEL', KEYS[1], ARGV[1])
+"""
+
+
 class RedisRuntimeState:
     def __init__(self, client: "redis.Redis", max_events: int = 5000):
         self.client = client
@@ -69,27 +302,76 @@ class RedisRuntimeState:
         self.key_actors = "ropt:actors"
         self.key_events = "ropt:events"
         self.key_active_run = "ropt:active_run_id"
-
-    async def upsert_actor(self, actor_id: str, ts_ms: int) -> ActorState:
-        raw = await self.client.hget(self.key_actors, actor_id)
-        if raw:
-            data = json.loads(raw)
-            zones = data.get("zones", {})
-        else:
-            zones = {}
-        st = ActorState(last_seen_ms=ts_ms, zones=zones)
-        await self.client.hset(self.key_actors, actor_id, json.dumps(asdict(st)))
-        return st
+        self.key_last_seen = "ropt:actors:last_seen"
+        # EVALSHA, falling back to EVAL once if the script cache was flushed.
+        self._apply_event = client.register_script(_APPLY_EVENT_LUA)
+        self._claim_expired = client.register_script(_CLAIM_EXPIRED_LUA)
+        self._remove_actor = client.register_script(_REMOVE_ACTOR_LUA)
 
     async def push_event(self, evt: dict) -> None:
-        await self.client.lpush(self.key_events, json.dumps(evt))
-        await self.client.ltrim(self.key_events, 0, self.max_events - 1)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.lpush(self.key_events, json.dumps(evt))
+            pipe.ltrim(self.key_events, 0, self.max_events - 1)
+            await pipe.execute()
+
+    async def apply_event(
+        self, evt: dict, if_last_seen_ms: Optional[int] = None
+    ) -> Tuple[Optional[str], Optional[ActorState]]:
+        """
+        Same contract as RuntimeState.apply_event, in one atomic round-trip.
+        """
+        body = json.dumps({k: v for k, v in evt.items() if k != "run_id"})
+        out = await self._apply_event(
+            keys=[self.key_actors, self.key_events, self.key_active_run, self.key_last_seen],
+            args=[
+                evt["actor_id"],
+                evt["zone_id"],
+                evt["event_type"],
+                int(evt["ts_ms"]),
+                evt.get("run_id") or "",
+                body,
+                self.max_events,
+                "" if if_last_seen_ms is None else int(if_last_seen_ms),
+            ],
+        )
+        if not out:
+            return None, None
+        if len(out) < 2:
+            return _text(out[0]), None
+        run_id, raw_actor = (_text(v) for v in out)
+        evt["run_id"] = run_id
+        data = json.loads(raw_actor)
+        return run_id, ActorState(last_seen_ms=data["last_seen_ms"], zones=data.get("zones") or {})
+
+    async def claim_expired_actors(
+        self, cutoff_ms: int, limit: int = 500
+    ) -> List[Tuple[str, ActorState]]:
+        flat = await self._claim_expired(
+            keys=[self.key_actors, self.key_last_seen], args=[cutoff_ms, limit]
+        )
+        out: List[Tuple[str, ActorState]] = []
+        for actor_id, raw in zip(flat[::2], flat[1::2]):
+            try:
+                data = json.loads(raw)
+            except Exception:
+                continue
+            actor = ActorState(last_seen_ms=data.get("last_seen_ms", 0), zones=data.get("zones") or {})
+            out.append((_text(actor_id), actor))
+        return out
 
-    async def save_actor(self, actor_id: str, actor: ActorState) -> None:
-        await self.client.hset(self.key_actors, actor_id, json.dumps(asdict(actor)))
+    async def remove_actor(self, actor_id: str, last_seen_ms: int) -> bool:
+        removed = await self._remove_actor(
+            keys=[self.key_actors, self.key_last_seen], args=[actor_id, last_seen_ms]
+        )
+        return bool(removed)
 
     async def snapshot(self) -> dict:
-        raw_actors = await self.client.hgetall(self.key_actors)
+        # One MULTI/EXEC round-trip, so actors, events and run id are consistent.
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hgetall(self.key_actors)
+            pipe.lrange(self.key_events, 0, 99)
+            pipe.get(self.key_active_run)
+            raw_actors, raw_events, active_run_id = await pipe.execute()
         actors = {}
         for actor_id, raw in raw_actors.items():
             try:
@@ -97,14 +379,12 @@ class RedisRuntimeState:
                 actors[actor_id] = data
             except Exception:
                 continue
-        raw_events = await self.client.lrange(self.key_events, 0, 99)
         recent_events = []
         for raw in reversed(raw_events):
             try:
                 recent_events.append(json.loads(raw))
             except Exception:
                 continue
-        active_run_id = await self.client.get(self.key_active_run)
         return {
             "ts_ms": now_ms(),
             "active_run_id": active_run_id,
@@ -120,3 +400,7 @@ class RedisRuntimeState:
             await self.client.delete(self.key_active_run)
         else:
             await self.client.set(self.key_active_run, run_id)
+
+
+def _text(value) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
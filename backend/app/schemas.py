@@ -3,7 +3,7 @@
 # This file handles all the data objects for our safety system.
 # It makes sure the JSON we send back and forth actually makes sense.
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from typing import Dict, Any, List, Optional
 
 
@@ -14,6 +14,10 @@ class SafetyEventIn(BaseModel):
     zone_id: str
     run_id: Optional[str] = None
     payload: Dict[str, Any] = Field(default_factory=dict)
+    # Stage -> wall-clock ms stamps (see tracing.STAGES); the edge fills the first two.
+    trace: Dict[str, float] = Field(default_factory=dict)
+    # time.monotonic() when POST /events queued it; feeds processor-lag metrics.
+    _accepted_at: float = PrivateAttr(default=0.0)
 
 
 class SafetyEventOut(SafetyEventIn):
@@ -33,6 +37,14 @@ class ZonesPayload(BaseModel):
     zones: List[ZoneDef]
 
 
+class GraphPatchIn(BaseModel):
+    graph_version: int  # version the edit is based on (GET /planning/graph)
+    upsert_nodes: List[Dict[str, Any]] = Field(default_factory=list)  # add, or merge into existing (move)
+    remove_nodes: List[str] = Field(default_factory=list)  # also drops their edges
+    upsert_edges: List[Dict[str, Any]] = Field(default_factory=list)  # add, or change weight by from/to
+    remove_edges: List[Dict[str, Any]] = Field(default_factory=list)  # by from/to
+
+
 class RunStartIn(BaseModel):
     notes: Optional[str] = None
 
@@ -52,3 +64,8 @@ class MetricIn(BaseModel):
     cuopt_solve_ms: float = 0.0
     end_to_end_ms: float = 0.0
     notes: Optional[str] = None
+    source: Optional[str] = None  # camera / edge node id
+
+
+class MetricBatchIn(BaseModel):
+    metrics: List[MetricIn]
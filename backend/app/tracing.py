@@ -0,0 +1,157 @@
+"""
+tracing.py
+Per-event stage timestamps, from the edge queue to the solver.
+
+Every SafetyEventIn carries a `trace` dict of wall-clock ms stamps:
+edge_enqueue_ms / edge_send_ms (set by the edge), then accept_ms, dequeue_ms,
+persisted_ms, broadcast_ms and solve_done_ms (set here). The event is inserted
+with the stamps known at that point; the completed trace is written back in
+batches by TraceWriter so the hot path pays no extra round-trip.
+
+broadcast_ms is when the snapshot was handed to fan-out, or marked for the
+next tick when snapshots are coalesced (add up to 1/ROPT_WS_TICK_HZ).
+Segments that cross the edge/backend boundary include any clock skew.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import instrumentation
+from .repos import events_repo
+
+logger = logging.getLogger(__name__)
+
+STAGES = (
+    "edge_enqueue_ms",
+    "edge_send_ms",
+    "accept_ms",
+    "dequeue_ms",
+    "persisted_ms",
+    "broadcast_ms",
+    "solve_done_ms",
+)
+
+# segment name, start stamp, end stamp
+SEGMENTS = (
+    ("edge_queue", "edge_enqueue_ms", "edge_send_ms"),
+    ("network", "edge_send_ms", "accept_ms"),
+    ("backend_queue", "accept_ms", "dequeue_ms"),
+    ("persist", "dequeue_ms", "persisted_ms"),
+    ("broadcast", "persisted_ms", "broadcast_ms"),
+    ("solve", "broadcast_ms", "solve_done_ms"),
+)
+
+
+def stamp(trace: Dict[str, float], stage: str) -> None:
+    trace[stage] = round(time.time() * 1000.0, 3)
+
+
+def segments(trace: Dict[str, float], ts_ms: Optional[float] = None) -> Dict[str, float]:
+    """
+    Durations in ms for every segment whose two stamps are present, plus end_to_end.
+    """
+    out: Dict[str, float] = {}
+    for name, start, end in SEGMENTS:
+        if start in trace and end in trace:
+            out[name] = trace[end] - trace[start]
+    first = trace.get("edge_enqueue_ms", ts_ms)
+    last = trace.get("solve_done_ms", trace.get("broadcast_ms"))
+    if first is not None and last is not None:
+        out["end_to_end"] = last - first
+    return out
+
+
+def breakdown(values: Dict[str, List[float]], count: int) -> Dict[str, Any]:
+    """
+    Exact min/mean/p50/p95/p99/max per segment from collected durations.
+    """
+    stats: Dict[str, Any] = {}
+    for name, vals in values.items():
+        if not vals:
+            continue
+        vals.sort()
+        n = len(vals)
+        stats[name] = {
+            "count": n,
+            "min": vals[0],
+            "mean": sum(vals) / n,
+            "p50": vals[min(n - 1, int(0.50 * n))],
+            "p95": vals[min(n - 1, int(0.95 * n))],
+            "p99": vals[min(n - 1, int(0.99 * n))],
+            "max": vals[-1],
+        }
+    return {"count": count, "segments": stats}
+
+
+async def breakdown_from_batches(batches) -> Dict[str, Any]:
+    values: Dict[str, List[float]] = {}
+    count = 0
+    async for batch in batches:
+        for evt in batch:
+            trace = evt.get("trace")
+            if not trace or (evt.get("payload") or {}).get("implicit"):
+                continue
+            count += 1
+            for name, ms in segments(trace, evt.get("ts_ms")).items():
+                values.setdefault(name, []).append(ms)
+    return breakdown(values, count)
+
+
+class TraceWriter:
+    """
+    Buffers completed traces and writes them back with one unordered bulk_write
+    per flush. Also feeds the ropt_event_segment_seconds histogram.
+    """
+
+    def __init__(self, flush_ms: int = 500, flush_max: int = 1000):
+        self.flush_s = max(1, flush_ms) / 1000.0
+        self.flush_max = max(1, flush_max)
+        self._pending: List[Tuple[str, Dict[str, float]]] = []
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self.written = 0
+        self.flush_errors = 0
+
+    def record(self, event_id: Optional[str], trace: Dict[str, float], ts_ms: Optional[float] = None) -> None:
+        for name, ms in segments(trace, ts_ms).items():
+            if ms >= 0:
+                instrumentation.EVENT_SEGMENT_SECONDS.labels(segment=name).observe(ms / 1000.0)
+        if not event_id:
+            return
+        self._pending.append((event_id, dict(trace)))
+        if len(self._pending) >= self.flush_max:
+            self._wake.set()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                with instrumentation.MONGO_WRITE_SECONDS.labels(op="event_traces").time():
+                    self.written += await events_repo.update_traces(batch)
+            except Exception as exc:
+                # Traces are diagnostics; drop the batch rather than grow without bound.
+                self.flush_errors += 1
+                instrumentation.MONGO_WRITE_ERRORS.labels(op="event_traces").inc()
+                logger.warning("trace flush of %s events failed: %s", len(batch), exc)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "written": self.written,
+            "flush_errors": self.flush_errors,
+        }
@@ -1,44 +1,317 @@
 """
 ws.py
 WebSocket connection manager for broadcasting state snapshots.
+
+Each payload is serialized once and handed to bounded per-connection send
+queues; every client is drained by its own task so a slow dashboard never
+stalls the event processor or the other viewers.
+
+Messages carry topics ("type:snapshot", "zone:A1", "actor:person_3",
+"robot:robot_1"). Clients that never subscribe get everything; clients that
+send {"action": "subscribe", "zones": [...], "types": [...]} only get
+messages routed to them through the topic -> connection index.
 """
 
 from __future__ import annotations
 
-from typing import Set, Optional
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+import asyncio
 import json
+import logging
+import time
 
 from fastapi import WebSocket
 
+from . import instrumentation
+
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "disconnect")
+
+# Subscribe message field -> topic prefix.
+TOPIC_KINDS = {"zones": "zone", "actors": "actor", "robots": "robot", "types": "type"}
+
+logger = logging.getLogger(__name__)
+
+
+def encode_payload(payload: dict) -> str:
+    # Same wire format as WebSocket.send_json, done once per broadcast.
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+class _Client:
+    def __init__(self, websocket: WebSocket, queue_max: int):
+        self.websocket = websocket
+        self.queue: "asyncio.Queue[Tuple[float, str]]" = asyncio.Queue(maxsize=queue_max)
+        self.task: Optional[asyncio.Task] = None
+        self.connected_ms = int(time.time() * 1000)
+        self.sent = 0
+        self.dropped = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        # Empty means "everything" for that dimension.
+        self.entity_topics: Set[str] = set()
+        self.type_topics: Set[str] = set()
+
+    def subscription(self) -> dict:
+        out: Dict[str, list] = {field: [] for field in TOPIC_KINDS}
+        prefixes = {prefix: field for field, prefix in TOPIC_KINDS.items()}
+        for topic in self.entity_topics | self.type_topics:
+            prefix, _, value = topic.partition(":")
+            out[prefixes[prefix]].append(value)
+        return {field: sorted(values) for field, values in out.items()}
+
+    def stats(self) -> dict:
+        peer = self.websocket.client
+        return {
+            "client": f"{peer.host}:{peer.port}" if peer else None,
+            "connected_ms": self.connected_ms,
+            "queued": self.queue.qsize(),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "last_lag_ms": round(self.last_lag_ms, 3),
+            "max_lag_ms": round(self.max_lag_ms, 3),
+            "subscription": self.subscription(),
+        }
+
 
 class ConnectionManager:
-    def __init__(self, redis_client: Optional[object] = None, channel: str = "ropt:ws"):
-        self._connections: Set[WebSocket] = set()
+    def __init__(
+        self,
+        redis_client: Optional[object] = None,
+        channel: str = "ropt:ws",
+        send_queue_max: int = 256,
+        slow_consumer_policy: str = "drop_oldest",
+        tick_interval_s: float = 0.0,
+    ):
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"unknown slow consumer policy: {slow_consumer_policy}")
+        self._connections: Dict[WebSocket, _Client] = {}
+        # topic -> clients subscribed to it, plus clients with no filter per dimension.
+        self._index: Dict[str, Set[_Client]] = {}
+        self._all_entities: Set[_Client] = set()
+        self._all_types: Set[_Client] = set()
+        self._dirty_topics: Set[str] = set()
         self._redis = redis_client
         self._channel = channel
+        self._send_queue_max = max(1, send_queue_max)
+        self._policy = slow_consumer_policy
+        # Snapshot coalescing: events mark the state dirty, the ticker emits
+        # at most one snapshot per interval. 0 disables ticking.
+        self._tick_interval_s = max(0.0, tick_interval_s)
+        self._dirty = False
+        self._ticks_emitted = 0
+        self._marks_coalesced = 0
 
     async def connect(self, websocket: WebSocket) -> None:
         await websocket.accept()
-        self._connections.add(websocket)
+        client = _Client(websocket, self._send_queue_max)
+        client.task = asyncio.create_task(self._sender(client))
+        self._connections[websocket] = client
+        instrumentation.WS_CONNECTIONS.inc()
+        self._all_entities.add(client)
+        self._all_types.add(client)
 
     def disconnect(self, websocket: WebSocket) -> None:
-        self._connections.discard(websocket)
+        client = self._connections.pop(websocket, None)
+        if client is None:
+            return
+        instrumentation.WS_CONNECTIONS.dec()
+        self._unindex(client)
+        if client.task and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> None:
+        client = self._connections.get(websocket)
+        if client is None:
+            return
+        self._unindex(client)
+        for topic in topics:
+            if topic.startswith("type:"):
+                client.type_topics.add(topic)
+            else:
+                client.entity_topics.add(topic)
+        self._reindex(client)
 
-    async def broadcast_json(self, payload: dict) -> None:
-        if self._redis is not None:
-            await self._redis.publish(self._channel, json.dumps(payload))
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str] | None = None) -> None:
+        """
+        Drop the given topics, or every filter when topics is None.
+        """
+        client = self._connections.get(websocket)
+        if client is None:
             return
-        await self._broadcast_local(payload)
+        self._unindex(client)
+        if topics is None:
+            client.entity_topics.clear()
+            client.type_topics.clear()
+        else:
+            for topic in topics:
+                client.entity_topics.discard(topic)
+                client.type_topics.discard(topic)
+        self._reindex(client)
+
+    def handle_client_message(self, websocket: WebSocket, text: str) -> Optional[dict]:
+        """
+        Apply a subscribe/unsubscribe control message; returns the ack to send back.
+        """
+        try:
+            msg = json.loads(text)
+        except (TypeError, ValueError):
+            return {"type": "error", "data": {"error": "invalid_json"}}
+        if not isinstance(msg, dict):
+            return {"type": "error", "data": {"error": "invalid_message"}}
+        action = msg.get("action")
+        if action not in ("subscribe", "unsubscribe"):
+            return None
+        topics = subscription_topics(msg)
+        if action == "subscribe":
+            self.subscribe(websocket, topics)
+        else:
+            self.unsubscribe(websocket, topics if topics else None)
+        client = self._connections.get(websocket)
+        subscription = client.subscription() if client else {}
+        return {"type": "subscription", "data": subscription}
+
+    def _unindex(self, client: _Client) -> None:
+        self._all_entities.discard(client)
+        self._all_types.discard(client)
+        for topic in client.entity_topics | client.type_topics:
+            members = self._index.get(topic)
+            if members is None:
+                continue
+            members.discard(client)
+            if not members:
+                del self._index[topic]
+
+    def _reindex(self, client: _Client) -> None:
+        if not client.entity_topics:
+            self._all_entities.add(client)
+        if not client.type_topics:
+            self._all_types.add(client)
+        for topic in client.entity_topics | client.type_topics:
+            self._index.setdefault(topic, set()).add(client)
+
+    def send_json(self, websocket: WebSocket, payload: dict) -> None:
+        """
+        Queue a payload for a single connection, keeping order with broadcasts.
+        """
+        client = self._connections.get(websocket)
+        if client is not None:
+            self._enqueue(client, encode_payload(payload))
 
-    async def _broadcast_local(self, payload: dict) -> None:
-        dead = []
-        for ws in self._connections:
+    async def broadcast_json(self, payload: dict, topics: Iterable[str] = ()) -> None:
+        with instrumentation.WS_FANOUT_SECONDS.time():
+            text = encode_payload(payload)
+            routed = set(topics)
+            if payload.get("type"):
+                routed.add(f"type:{payload['type']}")
+            if self._redis is not None:
+                # Topics ride in a one-line header so receivers route without parsing JSON.
+                await self._redis.publish(self._channel, "\t".join(sorted(routed)) + "\n" + text)
+                return
+            self._broadcast_local(text, routed)
+
+    @property
+    def ticking(self) -> bool:
+        return self._tick_interval_s > 0
+
+    def mark_dirty(self, topics: Iterable[str] = ()) -> None:
+        if self._dirty:
+            self._marks_coalesced += 1
+        self._dirty = True
+        self._dirty_topics.update(topics)
+
+    async def broadcast_snapshot(self, payload: dict, topics: Iterable[str] = ()) -> None:
+        # An immediate snapshot supersedes whatever the next tick would send.
+        routed = self._dirty_topics | set(topics)
+        self._dirty = False
+        self._dirty_topics = set()
+        await self.broadcast_json(payload, routed)
+
+    async def run_ticker(self, build_payload: Callable[[], Awaitable[dict]]) -> None:
+        """
+        Emit one coalesced snapshot per tick while the state is dirty.
+        """
+        if not self.ticking:
+            return
+        while True:
+            await asyncio.sleep(self._tick_interval_s)
+            if not self._dirty:
+                continue
+            self._dirty = False
+            topics, self._dirty_topics = self._dirty_topics, set()
             try:
-                await ws.send_json(payload)
-            except Exception:
-                dead.append(ws)
-        for ws in dead:
-            self.disconnect(ws)
+                payload = await build_payload()
+                await self.broadcast_json(payload, topics)
+                self._ticks_emitted += 1
+            except Exception as exc:
+                logger.warning("snapshot tick failed: %s", exc)
+
+    def _broadcast_local(self, text: str, topics: Set[str]) -> None:
+        for client in self._recipients(topics):
+            self._enqueue(client, text)
+
+    def _recipients(self, topics: Set[str]) -> list:
+        if len(self._all_entities) == len(self._all_types) == len(self._connections):
+            # Nobody filters: skip the index entirely.
+            return list(self._connections.values())
+        by_entity = set(self._all_entities)
+        by_type = set(self._all_types)
+        for topic in topics:
+            members = self._index.get(topic)
+            if not members:
+                continue
+            if topic.startswith("type:"):
+                by_type |= members
+            else:
+                by_entity |= members
+        return list(by_entity & by_type)
+
+    def _enqueue(self, client: _Client, text: str) -> None:
+        item = (time.monotonic(), text)
+        try:
+            client.queue.put_nowait(item)
+            return
+        except asyncio.QueueFull:
+            client.dropped += 1
+            instrumentation.WS_DROPPED.inc()
+        if self._policy == "disconnect":
+            self.disconnect(client.websocket)
+            asyncio.create_task(_close_quietly(client.websocket, code=1013))
+            return
+        # drop_oldest: the newest snapshot supersedes whatever is stale.
+        try:
+            client.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        client.queue.put_nowait(item)
+
+    async def _sender(self, client: _Client) -> None:
+        try:
+            while True:
+                enqueued, text = await client.queue.get()
+                await client.websocket.send_text(text)
+                lag_ms = (time.monotonic() - enqueued) * 1000.0
+                client.sent += 1
+                client.last_lag_ms = lag_ms
+                if lag_ms > client.max_lag_ms:
+                    client.max_lag_ms = lag_ms
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Socket is gone; drop the client so broadcasts stop queueing for it.
+            if self._connections.get(client.websocket) is client:
+                self.disconnect(client.websocket)
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self._connections),
+            "send_queue_max": self._send_queue_max,
+            "slow_consumer_policy": self._policy,
+            "tick_interval_s": self._tick_interval_s,
+            "ticks_emitted": self._ticks_emitted,
+            "marks_coalesced": self._marks_coalesced,
+            "clients": [c.stats() for c in self._connections.values()],
+        }
 
     async def start_redis_listener(self) -> None:
         if self._redis is None:
@@ -48,8 +321,32 @@ class ConnectionManager:
         async for msg in pubsub.listen():
             if msg.get("type") != "message":
                 continue
-            try:
-                payload = json.loads(msg.get("data"))
-            except Exception:
+            data = msg.get("data")
+            if isinstance(data, bytes):
+                data = data.decode("utf-8", errors="replace")
+            if not isinstance(data, str):
                 continue
-            await self._broadcast_local(payload)
+            header, sep, text = data.partition("\n")
+            if not sep:
+                continue
+            # Already serialized by the publisher; forward as-is.
+            self._broadcast_local(text, set(header.split("\t")) if header else set())
+
+
+def subscription_topics(msg: dict) -> Set[str]:
+    topics: Set[str] = set()
+    for field, prefix in TOPIC_KINDS.items():
+        values = msg.get(field) or []
+        if isinstance(values, str):
+            values = [values]
+        for value in values:
+            if isinstance(value, str) and value:
+                topics.add(f"{prefix}:{value}")
+    return topics
+
+
+async def _close_quietly(websocket: WebSocket, code: int = 1000) -> None:
+    try:
+        await websocket.close(code=code)
+    except Exception:
+        pass
@@ -0,0 +1,4 @@
+"""
+bench
+End-to-end load benchmark (load.py) against local stand-ins (stack.py).
+"""
@@ -0,0 +1,535 @@
+"""
+bench/load.py
+What this file does:
+- Starts the backend on local stand-ins (bench/stack.py) in a subprocess.
+- Seeds zones, a grid graph and a run, then drives POST /events from
+  synthetic edge clients at a fixed open-loop rate while /ws clients listen.
+- Reports throughput, client-side POST p50/p99 (from the scheduled send
+  time, so a stalled server is not hidden), per-stage and per-segment p50/p99
+  from /internal/metrics, queue-full rate and WebSocket message rates.
+- With --baseline, runs the baseline's scenario and exits 1 on regressions.
+  Latency baselines are scaled by an in-run CPU calibration (calibrate()), so
+  a slower or faster machine is not reported as a regression or a win.
+
+Usage:
+  python -m bench.load                                   # default scenario
+  python -m bench.load --baseline bench/baseline.json    # regression check
+  python -m bench.load --baseline bench/baseline.json --write-baseline
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import websockets
+from prometheus_client.parser import text_string_to_metric_families
+
+SCENARIO = {
+    "seed": 7,
+    "actors": 200,
+    "zones": 16,
+    "rate": 50.0,
+    "edge_clients": 8,
+    "ws_clients": 4,
+    "duration_s": 15.0,
+    "warmup_s": 2.0,
+    "transition_ratio": 0.2,
+    "graph_side": 20,
+    "cuopt_latency_ms": 2.0,
+    "redis": False,
+    "storage": "mongo",
+    "queue_max": 20000,
+    "ws_tick_hz": 15.0,
+}
+
+HELP = {
+    "seed": "seed for the event mix (which actor moves, enters or exits)",
+    "actors": "distinct actor_ids the edge clients report",
+    "zones": "zones laid over the graph; actors enter and exit these",
+    "rate": "events/s across all edge clients, open loop; the stand-in stack saturates near 90",
+    "edge_clients": "concurrent HTTP clients posting to /events; they share the rate",
+    "ws_clients": "/ws listeners counting snapshot and route messages",
+    "duration_s": "measured seconds of traffic",
+    "warmup_s": "unmeasured seconds of traffic before the measured run",
+    "transition_ratio": "share of events that enter or exit a zone (and trigger a replan)",
+    "graph_side": "the planning graph is graph_side x graph_side nodes",
+    "cuopt_latency_ms": "fixed delay of the stub cuOpt solver",
+    "redis": "ingest through the Redis event stream (fakeredis) instead of the in-process queue",
+    "storage": "mongo (mongomock) or embedded (the file-backed store in a temp directory)",
+    "queue_max": "ROPT_EVENT_QUEUE_MAX; events posted to a full queue are refused and counted",
+    "ws_tick_hz": "ROPT_WS_TICK_HZ; 0 broadcasts a snapshot per event",
+}
+
+# metric -> (direction, absolute slack). Relative tolerance comes from --tolerance, or
+# --tail-tolerance for p99s: tails move with scheduling noise even on one machine.
+CHECKS = {
+    "throughput_eps": ("higher", 0.0),
+    "processed_eps": ("higher", 0.0),
+    "post_p50_ms": ("lower", 1.0),
+    "post_p99_ms": ("lower", 2.0),
+    "queue_full_rate": ("lower", 0.005),
+}
+STAGE_CHECK = ("lower", 1.0)  # applied to every stages.*.p99_ms / segments.*.p99_ms
+CALIBRATION_ROUNDS = 7
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    lo, hi = math.floor(k), math.ceil(k)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def calibrate(rounds: int = CALIBRATION_ROUNDS) -> float:
+    """
+    Fastest ms of a fixed single-threaded workload shaped like the ingest path
+    (event JSON round-trips, dict updates, sorting). The backend is CPU-bound
+    Python too, so the ratio of two machines' calibrations is used to scale
+    latency baselines between them.
+    """
+    rng = random.Random(0)
+    events = [
+        {"event_type": "MOVE", "actor_id": f"a{i % 200}", "zone_id": f"Z{i % 16}", "ts_ms": i, "x": rng.random()}
+        for i in range(2000)
+    ]
+    samples = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        state: Dict[str, Dict[str, Any]] = {}
+        for _ in range(5):
+            for evt in json.loads(json.dumps(events)):
+                state.setdefault(evt["actor_id"], {}).update(evt)
+            sorted(state.values(), key=lambda a: (a["zone_id"], a["x"]))
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return round(min(samples), 3)
+
+
+def _histograms(text: str, name: str, label: str) -> Dict[str, List[Tuple[float, float]]]:
+    """
+    Cumulative (le, count) buckets per label value of one Prometheus histogram.
+    """
+    out: Dict[str, List[Tuple[float, float]]] = {}
+    for family in text_string_to_metric_families(text):
+        if family.name != name:
+            continue
+        for sample in family.samples:
+            if sample.name == f"{name}_bucket":
+                out.setdefault(sample.labels[label], []).append(
+                    (float(sample.labels["le"]), sample.value)
+                )
+    return {k: sorted(v) for k, v in out.items()}
+
+
+def _gauge(text: str, name: str) -> float:
+    for family in text_string_to_metric_families(text):
+        if family.name == name:
+            return sum(s.value for s in family.samples)
+    return 0.0
+
+
+def _bucket_quantile(buckets: List[Tuple[float, float]], q: float) -> float:
+    # Same interpolation as PromQL histogram_quantile.
+    total = buckets[-1][1] if buckets else 0.0
+    if total <= 0:
+        return 0.0
+    rank = q * total
+    prev_le, prev_count = 0.0, 0.0
+    for le, count in buckets:
+        if count >= rank:
+            if math.isinf(le):
+                return prev_le
+            return prev_le + (le - prev_le) * ((rank - prev_count) / max(count - prev_count, 1e-12))
+        prev_le, prev_count = le, count
+    return prev_le
+
+
+def _delta_summary(
+    before: Dict[str, List[Tuple[float, float]]], after: Dict[str, List[Tuple[float, float]]]
+) -> Dict[str, Dict[str, float]]:
+    out = {}
+    for key, buckets in after.items():
+        base = dict(before.get(key, []))
+        delta = [(le, count - base.get(le, 0.0)) for le, count in buckets]
+        n = delta[-1][1] if delta else 0
+        if n <= 0:
+            continue
+        out[key] = {
+            "count": int(n),
+            "p50_ms": round(_bucket_quantile(delta, 0.50) * 1000.0, 3),
+            "p99_ms": round(_bucket_quantile(delta, 0.99) * 1000.0, 3),
+        }
+    return out
+
+
+def _zones(count: int, side: int) -> List[Dict[str, Any]]:
+    cols = math.ceil(math.sqrt(count))
+    cell = side / cols
+    zones = []
+    for i in range(count):
+        x0, y0 = (i % cols) * cell, (i // cols) * cell
+        zones.append(
+            {
+                "zone_id": f"Z{i}",
+                "polygon": [[x0, y0], [x0 + cell, y0], [x0 + cell, y0 + cell], [x0, y0 + cell]],
+                "severity": "emergency" if i == 0 else "soft",
+            }
+        )
+    return zones
+
+
+def _graph(side: int) -> Dict[str, Any]:
+    nodes = [{"id": f"n{x}_{y}", "x": x + 0.5, "y": y + 0.5} for x in range(side) for y in range(side)]
+    edges = []
+    for x in range(side):
+        for y in range(side):
+            for nx, ny in ((x + 1, y), (x, y + 1)):
+                if nx < side and ny < side:
+                    edges.append({"from": f"n{x}_{y}", "to": f"n{nx}_{ny}", "weight": 1.0})
+                    edges.append({"from": f"n{nx}_{ny}", "to": f"n{x}_{y}", "weight": 1.0})
+    return {"nodes": nodes, "edges": edges}
+
+
+class EventMix:
+    """
+    Deterministic actor movement: each event either moves an actor within its
+    zone or, with transition_ratio, exits its zone / enters a random one.
+    """
+
+    def __init__(self, scenario: Dict[str, Any]):
+        self.rng = random.Random(scenario["seed"])
+        self.zones = [f"Z{i}" for i in range(scenario["zones"])]
+        self.actors = [f"person_{i}" for i in range(scenario["actors"])]
+        self.inside: Dict[str, Optional[str]] = {a: None for a in self.actors}
+        self.transition_ratio = scenario["transition_ratio"]
+
+    def next(self) -> Dict[str, Any]:
+        actor = self.rng.choice(self.actors)
+        zone = self.inside[actor]
+        if self.rng.random() < self.transition_ratio:
+            if zone is not None:
+                self.inside[actor] = None
+                return {"event_type": "ZONE_EXIT", "actor_id": actor, "zone_id": zone}
+            zone = self.inside[actor] = self.rng.choice(self.zones)
+            return {"event_type": "ZONE_ENTER", "actor_id": actor, "zone_id": zone}
+        return {"event_type": "MOVE", "actor_id": actor, "zone_id": zone or self.rng.choice(self.zones)}
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.accepted = 0
+        self.queue_full = 0
+        self.errors = 0
+        self.latencies_ms: List[float] = []
+        self.ws_messages: Dict[str, int] = {}
+
+
+async def _edge_client(
+    base: str, mix: EventMix, start: float, end: float, interval: float, offset: float, stats: Stats
+) -> None:
+    async with httpx.AsyncClient(base_url=base, timeout=10.0) as client:
+        due = start + offset
+        while due < end:
+            now = time.monotonic()
+            if due > now:
+                await asyncio.sleep(due - now)
+            event = mix.next()
+            sched_ms = time.time() * 1000.0 - (time.monotonic() - due) * 1000.0
+            event["ts_ms"] = int(sched_ms)
+            event["trace"] = {"edge_enqueue_ms": round(sched_ms, 3), "edge_send_ms": round(time.time() * 1000.0, 3)}
+            stats.sent += 1
+            try:
+                resp = await client.post("/events", json=event)
+                body = resp.json()
+                if resp.status_code != 200:
+                    stats.errors += 1
+                elif body.get("ok"):
+                    stats.accepted += 1
+                elif body.get("error") == "event_queue_full":
+                    stats.queue_full += 1
+                else:
+                    stats.errors += 1
+            except httpx.HTTPError:
+                stats.errors += 1
+            # Measured from the scheduled time: includes any backlog on our side.
+            stats.latencies_ms.append((time.monotonic() - due) * 1000.0)
+            due += interval
+
+
+async def _ws_client(url: str, stop: asyncio.Event, stats: Stats) -> None:
+    async with websockets.connect(url, max_size=None) as ws:
+        while not stop.is_set():
+            try:
+                msg = await asyncio.wait_for(ws.recv(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            kind = json.loads(msg).get("type", "?")
+            stats.ws_messages[kind] = stats.ws_messages.get(kind, 0) + 1
+
+
+async def _wait_ready(client: httpx.AsyncClient, proc: subprocess.Popen, timeout_s: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"backend exited with {proc.returncode}")
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("backend did not become ready")
+
+
+async def _drive(port: int, scenario: Dict[str, Any]) -> Dict[str, Any]:
+    base = f"http://127.0.0.1:{port}"
+    stats = Stats()
+    async with httpx.AsyncClient(base_url=base, timeout=30.0) as admin:
+        (await admin.put("/zones", json={"zones": _zones(scenario["zones"], scenario["graph_side"])})).raise_for_status()
+        (await admin.put("/planning/graph", json=_graph(scenario["graph_side"]))).raise_for_status()
+        (await admin.post("/runs/start", json={"notes": "bench"})).raise_for_status()
+
+        stop = asyncio.Event()
+        ws_tasks = [
+            asyncio.create_task(_ws_client(f"ws://127.0.0.1:{port}/ws", stop, stats))
+            for _ in range(scenario["ws_clients"])
+        ]
+        mix = EventMix(scenario)
+        clients = max(1, scenario["edge_clients"])
+        interval = clients / scenario["rate"]
+
+        # Warm-up traffic is not measured.
+        warm = Stats()
+        t0 = time.monotonic()
+        await asyncio.gather(
+            *(
+                _edge_client(base, mix, t0, t0 + scenario["warmup_s"], interval, i * interval / clients, warm)
+                for i in range(clients)
+            )
+        )
+        await _drain(admin)
+        before = (await admin.get("/internal/metrics")).text
+        stats.ws_messages.clear()
+
+        t0 = time.monotonic()
+        await asyncio.gather(
+            *(
+                _edge_client(base, mix, t0, t0 + scenario["duration_s"], interval, i * interval / clients, stats)
+                for i in range(clients)
+            )
+        )
+        send_s = time.monotonic() - t0
+        await _drain(admin)
+        drain_s = time.monotonic() - t0
+        # Let the trace writer flush segment timings.
+        await asyncio.sleep(1.0)
+        after = (await admin.get("/internal/metrics")).text
+        stop.set()
+        await asyncio.gather(*ws_tasks, return_exceptions=True)
+
+    stages = _delta_summary(
+        _histograms(before, "ropt_event_stage_seconds", "stage"),
+        _histograms(after, "ropt_event_stage_seconds", "stage"),
+    )
+    segments = _delta_summary(
+        _histograms(before, "ropt_event_segment_seconds", "segment"),
+        _histograms(after, "ropt_event_segment_seconds", "segment"),
+    )
+    processed = stages.get("state_update", {}).get("count", 0)
+    return {
+        "sent": stats.sent,
+        "accepted": stats.accepted,
+        "queue_full": stats.queue_full,
+        "errors": stats.errors,
+        "throughput_eps": round(stats.accepted / send_s, 2),
+        "processed_eps": round(processed / drain_s, 2),
+        "post_p50_ms": round(_percentile(stats.latencies_ms, 0.50), 3),
+        "post_p99_ms": round(_percentile(stats.latencies_ms, 0.99), 3),
+        "queue_full_rate": round(stats.queue_full / max(stats.sent, 1), 4),
+        "stages": stages,
+        "segments": segments,
+        "ws_messages_per_s": {
+            k: round(v / drain_s / max(scenario["ws_clients"], 1), 2)
+            for k, v in sorted(stats.ws_messages.items())
+        },
+    }
+
+
+async def _drain(admin: httpx.AsyncClient, timeout_s: float = 60.0) -> None:
+    # The queue-depth gauge is set by the processor on every dequeue.
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        text = (await admin.get("/internal/metrics")).text
+        if _gauge(text, "ropt_event_queue_depth") <= 0:
+            stream = (await admin.get("/events/stream/stats")).json()
+            if not stream.get("enabled") or not any(stream.get("backlog", {}).values()):
+                return
+        await asyncio.sleep(0.1)
+
+
+def run(scenario: Dict[str, Any], verbose: bool = False) -> Dict[str, Any]:
+    port, cuopt_port = _free_port(), _free_port()
+    env = {
+        **os.environ,
+        "ROPT_CUOPT_URL": f"http://127.0.0.1:{cuopt_port}",
+        "ROPT_CUOPT_TIMEOUT_S": "1.0",
+        "ROPT_EVENT_QUEUE_MAX": str(scenario["queue_max"]),
+        "ROPT_WS_TICK_HZ": str(scenario["ws_tick_hz"]),
+        "ROPT_EVENT_STREAM": "true" if scenario["redis"] else "false",
+        "ROPT_STORAGE": scenario["storage"],
+    }
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    if scenario["redis"]:
+        env["ROPT_REDIS_URL"] = "redis://stand-in"
+    else:
+        env.pop("ROPT_REDIS_URL", None)
+    cmd = [
+        sys.executable,
+        "-m",
+        "bench.stack",
+        "--port",
+        str(port),
+        "--cuopt-port",
+        str(cuopt_port),
+        "--cuopt-latency-ms",
+        str(scenario["cuopt_latency_ms"]),
+    ]
+    if scenario["redis"]:
+        cmd.append("--redis")
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = None if verbose else subprocess.DEVNULL
+    storage_dir = tempfile.mkdtemp(prefix="ropt-bench-")
+    env["ROPT_STORAGE_DIR"] = storage_dir
+    # Before the stack starts and after it stops (the backend must not compete
+    # with it); the mean follows machines whose speed drifts during the run.
+    calibration_ms = calibrate()
+    proc = subprocess.Popen(cmd, cwd=backend_dir, env=env, stdout=out, stderr=out)
+    try:
+
+        async def main() -> Dict[str, Any]:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+                await _wait_ready(client, proc)
+            return await _drive(port, scenario)
+
+        results = asyncio.run(main())
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(storage_dir, ignore_errors=True)
+    results["calibration_ms"] = round((calibration_ms + calibrate()) / 2.0, 3)
+    return results
+
+
+def compare(
+    results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, tail_tolerance: float = 0.5
+) -> List[str]:
+    """
+    Regressions of results against baseline results, as readable lines.
+    Latency (*_ms) baselines are multiplied by calibration_ms of this run over
+    the baseline's; throughput is not scaled (the load is open-loop at a fixed
+    rate) and neither is the queue-full rate.
+    """
+    scale = 1.0
+    if results.get("calibration_ms") and baseline.get("calibration_ms"):
+        scale = results["calibration_ms"] / baseline["calibration_ms"]
+    checks = [(name, results.get(name), baseline.get(name), *rule) for name, rule in CHECKS.items()]
+    for group in ("stages", "segments"):
+        for key, summary in baseline.get(group, {}).items():
+            current = results.get(group, {}).get(key, {}).get("p99_ms")
+            checks.append((f"{group}.{key}.p99_ms", current, summary.get("p99_ms"), *STAGE_CHECK))
+    failures = []
+    for name, current, base, direction, slack in checks:
+        if base is None:
+            continue
+        if name.endswith("_ms"):
+            base = round(base * scale, 3)
+        allowed = tail_tolerance if name.endswith("p99_ms") else tolerance
+        if current is None:
+            failures.append(f"{name}: missing (baseline {base})")
+        elif direction == "higher" and current < base * (1 - allowed) - slack:
+            failures.append(f"{name}: {current} < baseline {base} (-{allowed:.0%})")
+        elif direction == "lower" and current > base * (1 + allowed) + slack:
+            failures.append(f"{name}: {current} > baseline {base} (+{allowed:.0%})")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="End-to-end ingest load benchmark. Scenario options override the --baseline"
+        " file's scenario, which overrides the defaults shown."
+    )
+    for key, default in SCENARIO.items():
+        flag = f"--{key.replace('_', '-')}"
+        help_text = f"{HELP[key]} (default: {default})"
+        if isinstance(default, bool):
+            parser.add_argument(flag, dest=key, action="store_const", const=True, default=None, help=help_text)
+        else:
+            parser.add_argument(flag, dest=key, type=type(default), default=None, help=help_text)
+    parser.add_argument("--baseline", help="baseline JSON; its scenario is used unless overridden")
+    parser.add_argument("--write-baseline", action="store_true", help="save this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument(
+        "--tail-tolerance", type=float, default=0.5, help="allowed relative regression of p99 latencies"
+    )
+    parser.add_argument("--output", help="also write the result JSON here")
+    parser.add_argument("--verbose", action="store_true", help="show backend output")
+    args = parser.parse_args()
+
+    baseline: Dict[str, Any] = {}
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    scenario = {**SCENARIO, **baseline.get("scenario", {})}
+    scenario.update({k: getattr(args, k) for k in SCENARIO if getattr(args, k) is not None})
+
+    results = run(scenario, verbose=args.verbose)
+    report = {"scenario": scenario, "results": results}
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+    if args.write_baseline:
+        if not args.baseline:
+            parser.error("--write-baseline needs --baseline")
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        return
+    if baseline.get("results"):
+        failures = compare(results, baseline["results"], args.tolerance, args.tail_tolerance)
+        if baseline["results"].get("calibration_ms"):
+            scale = results["calibration_ms"] / baseline["results"]["calibration_ms"]
+            print(f"latency baselines scaled x{scale:.2f} by calibration", file=sys.stderr)
+        if failures:
+            print("REGRESSIONS:\n  " + "\n  ".join(failures), file=sys.stderr)
+            sys.exit(1)
+        print("no regressions against baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
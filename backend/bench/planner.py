@@ -0,0 +1,288 @@
+"""
+bench/planner.py
+What this file does:
+- Micro-benchmarks the planning hot paths on synthetic warehouse floors:
+  GraphManager.get_cost_matrix, build_weighted_graph, refresh_zone_index,
+  SpatialManager.recompute_mappings and main._build_constraints_from_event.
+- Floors are aisle grids of 100 to 50k nodes; zone sets mix rectangles,
+  diamonds, octagons and L-shapes, with a share of them blocked.
+- recompute_mappings reads from the embedded store (db/embedded.py) in a
+  temp dir, so no MongoDB is needed and the store cost is included.
+- Each op is timed over --repeat runs (capped by --budget-s), then run once
+  more under tracemalloc for its peak allocation. Results are JSON.
+
+Usage:
+  python -m bench.planner                                  # default sweep
+  python -m bench.planner --sizes 100,1000 --zones 16 --output planner.json
+  python -m bench.planner --ops refresh_zone_index,recompute_mappings
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import inspect
+import json
+import math
+import platform
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List, Union
+
+import shapely
+
+OPS = (
+    "get_cost_matrix",
+    "build_weighted_graph",
+    "refresh_zone_index",
+    "recompute_mappings",
+    "build_constraints_from_event",
+)
+
+DEFAULTS = {
+    "seed": 7,
+    "sizes": "100,1000,5000,10000,50000",
+    "zones": "16",
+    "repeat": 5,
+    "budget_s": 10.0,
+    "coverage": 0.4,
+    "blocked_ratio": 0.25,
+    "robots": 8,
+    "matrix_max_nodes": 5000,
+}
+
+HELP = {
+    "seed": "seed for the zone layout, blocked zones and robot fleet",
+    "sizes": "comma-separated floor sizes, in nodes",
+    "zones": "comma-separated zone counts; every size is run with each",
+    "repeat": "timed runs per op and case",
+    "budget_s": "seconds per op and case; at least one timed run always happens",
+    "coverage": "share of the floor covered by zones (they may overlap)",
+    "blocked_ratio": "share of zones that are blocked",
+    "robots": "robots in the fleet passed to build_constraints_from_event",
+    "matrix_max_nodes": "skip get_cost_matrix above this many nodes; the dense matrix is n^2",
+}
+
+
+def _floor(size: int) -> Dict[str, Any]:
+    """
+    Warehouse-like grid of exactly `size` nodes: rows are storage aisles,
+    every fifth column is a cross aisle (cheaper to travel). Edges both ways.
+    """
+    cols = max(1, math.ceil(math.sqrt(size)))
+    nodes = []
+    for i in range(size):
+        r, c = divmod(i, cols)
+        nodes.append({"id": f"n{r}_{c}", "x": c + 0.5, "y": r + 0.5})
+    edges = []
+    for i in range(size):
+        r, c = divmod(i, cols)
+        if c + 1 < cols and i + 1 < size:
+            edges.append((i, i + 1, 1.0))
+        if i + cols < size:
+            edges.append((i, i + cols, 0.8 if c % 5 == 0 else 1.2))
+    out = []
+    for u, v, w in edges:
+        out.append({"from": nodes[u]["id"], "to": nodes[v]["id"], "weight": w})
+        out.append({"from": nodes[v]["id"], "to": nodes[u]["id"], "weight": w})
+    rows = math.ceil(size / cols)
+    return {"nodes": nodes, "edges": out, "width": float(cols), "height": float(rows)}
+
+
+def _shape(kind: int, cx: float, cy: float, r: float, rng: random.Random) -> List[List[float]]:
+    if kind == 0:
+        # Aisle band: long and thin.
+        w, h = (r * 3.0, r / 3.0) if rng.random() < 0.5 else (r / 3.0, r * 3.0)
+        pts = [(-w, -h), (w, -h), (w, h), (-w, h)]
+    elif kind == 1:
+        pts = [(0.0, -r), (r, 0.0), (0.0, r), (-r, 0.0)]
+    elif kind == 2:
+        pts = [(r * math.cos(k * math.pi / 4), r * math.sin(k * math.pi / 4)) for k in range(8)]
+    else:
+        # L-shape (concave).
+        pts = [(-r, -r), (r, -r), (r, 0.0), (0.0, 0.0), (0.0, r), (-r, r)]
+    return [[round(cx + x, 3), round(cy + y, 3)] for x, y in pts]
+
+
+def _zone_set(count: int, floor: Dict[str, Any], coverage: float, rng: random.Random) -> List[Dict[str, Any]]:
+    width, height = floor["width"], floor["height"]
+    # Each shape above has area of roughly 2-4 r^2; aim for coverage overall.
+    r = max(0.75, math.sqrt(coverage * width * height / (3.0 * count)))
+    zones = []
+    for i in range(count):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        zones.append(
+            {
+                "zone_id": f"Z{i}",
+                "polygon": _shape(i % 4, cx, cy, r, rng),
+                "severity": "emergency" if i % 8 == 0 else "soft",
+            }
+        )
+    return zones
+
+
+async def _time(fn: Callable[[], Union[Any, Awaitable[Any]]], repeat: int, budget_s: float) -> Dict[str, Any]:
+    samples: List[float] = []
+    deadline = time.perf_counter() + budget_s
+    while len(samples) < repeat and (not samples or time.perf_counter() < deadline):
+        gc.collect()
+        t0 = time.perf_counter()
+        out = fn()
+        if inspect.isawaitable(out):
+            out = await out
+        samples.append((time.perf_counter() - t0) * 1000.0)
+        del out
+
+    # Separate untimed run: tracemalloc slows allocation-heavy code several-fold.
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    out = fn()
+    if inspect.isawaitable(out):
+        out = await out
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del out
+    return {
+        "runs": len(samples),
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "max_ms": round(max(samples), 3),
+        "peak_alloc_kb": round((peak - base) / 1024.0, 1),
+        # Still referenced when the op returned: its result (and any cache it filled).
+        "result_kb": round((current - base) / 1024.0, 1),
+    }
+
+
+async def _case(size: int, zone_count: int, cfg: Dict[str, Any], ops: List[str], log) -> List[Dict[str, Any]]:
+    from app.db import mongo
+    from app.db.embedded import EmbeddedClient
+    from app.main import _build_constraints_from_event
+    from app.planning import GraphManager, SpatialManager
+    from app.schemas import SafetyEventIn
+
+    rng = random.Random(f"{cfg['seed']}:{size}:{zone_count}")
+    floor = _floor(size)
+    zones = _zone_set(zone_count, floor, cfg["coverage"], rng)
+    graph = {"nodes": floor["nodes"], "edges": floor["edges"]}
+
+    gm = GraphManager()
+    gm.set_base_graph(graph)
+    gm.refresh_zone_index(zones)
+    blocked = [z["zone_id"] for z in zones if rng.random() < cfg["blocked_ratio"]]
+    for zone_id in blocked:
+        gm.update_zone_block(zone_id, blocked=True)
+    # The largest blocked zone is the one whose ENTER triggers the replan.
+    event_zone = max(blocked or [zones[0]["zone_id"]], key=lambda z: len(gm.zone_to_nodes.get(z, ())))
+    event = SafetyEventIn(event_type="ZONE_ENTER", ts_ms=0, actor_id="a1", zone_id=event_zone)
+    ids = list(gm.nodes)
+    fleet = [(f"robot_{k}", rng.choice(ids), rng.choice(ids)) for k in range(cfg["robots"])]
+    node_map = {"node_map": gm.node_index()}
+
+    case = {
+        "nodes": size,
+        "edges": len(floor["edges"]),
+        "zones": zone_count,
+        "blocked_zones": len(blocked),
+        "blocked_nodes": len(gm.blocked_nodes),
+        "zoned_nodes": len({n for members in gm.zone_to_nodes.values() for n in members}),
+    }
+    results = []
+
+    async def record(op: str, fn: Callable[[], Any]) -> None:
+        row = {"op": op, **case, **await _time(fn, cfg["repeat"], cfg["budget_s"])}
+        log(f"{op:<30} n={size:<6} zones={zone_count:<4} median={row['median_ms']:>10.3f} ms  "
+            f"peak={row['peak_alloc_kb']:>10.1f} KiB  runs={row['runs']}")
+        results.append(row)
+
+    for op in ops:
+        if op == "get_cost_matrix":
+            if size > cfg["matrix_max_nodes"]:
+                results.append({"op": op, **case, "skipped": f"nodes > matrix_max_nodes ({cfg['matrix_max_nodes']})"})
+                continue
+            await record(op, gm.get_cost_matrix)
+        elif op == "build_weighted_graph":
+            await record(op, gm.build_weighted_graph)
+        elif op == "refresh_zone_index":
+            await record(op, lambda: gm.refresh_zone_index(zones))
+        elif op == "build_constraints_from_event":
+            await record(op, lambda: _build_constraints_from_event(gm, event, node_map, fleet))
+        elif op == "recompute_mappings":
+            directory = tempfile.mkdtemp(prefix="ropt-bench-planner-")
+            # Long flush interval: the seed writes are not what is measured.
+            mongo._client, mongo._db = EmbeddedClient(directory, flush_ms=1000), None
+            try:
+                await mongo.ensure_indexes()
+                await mongo.col_graph().insert_many([{**n, "type": "node"} for n in floor["nodes"]])
+                await mongo.col_graph().insert_many([{**e, "type": "edge"} for e in floor["edges"]])
+                await mongo.col_zones().insert_many([dict(z) for z in zones])
+                spatial = SpatialManager()
+                await record(op, spatial.recompute_mappings)
+            finally:
+                await mongo.close_client()
+                shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+async def run(cfg: Dict[str, Any], ops: List[str], log=lambda line: None) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    for size in [int(s) for s in str(cfg["sizes"]).split(",") if s]:
+        for zone_count in [int(z) for z in str(cfg["zones"]).split(",") if z]:
+            results.extend(await _case(size, zone_count, cfg, ops, log))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Planner micro-benchmarks across graph and zone sizes")
+    for key, default in DEFAULTS.items():
+        parser.add_argument(
+            f"--{key.replace('_', '-')}",
+            dest=key,
+            type=type(default),
+            default=default,
+            help=f"{HELP[key]} (default: {default})",
+        )
+    parser.add_argument("--ops", default=",".join(OPS), help="comma-separated subset of: " + ", ".join(OPS))
+    parser.add_argument("--output", help="also write the result JSON here")
+    parser.add_argument("--quiet", action="store_true", help="no per-op progress on stderr")
+    args = parser.parse_args()
+
+    ops = [op for op in args.ops.split(",") if op]
+    unknown = sorted(set(ops) - set(OPS))
+    if unknown:
+        parser.error(f"unknown ops: {', '.join(unknown)}")
+    cfg = {key: getattr(args, key) for key in DEFAULTS}
+    log = (lambda line: None) if args.quiet else (lambda line: print(line, file=sys.stderr, flush=True))
+
+    started = time.time()
+    results = asyncio.run(run(cfg, ops, log))
+    report = {
+        "config": cfg,
+        "environment": {
+            "python": platform.python_version(),
+            "shapely": shapely.__version__,
+            "platform": platform.platform(),
+            "started_ms": int(started * 1000),
+            "duration_s": round(time.time() - started, 1),
+            # Linux reports KiB.
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+bench/stack.py
+What this file does:
+- Runs the backend in one process against local stand-ins, for bench/load.py.
+- Mongo: mongomock-motor, unless ROPT_STORAGE=embedded (then the real embedded
+  store is measured). Redis (--redis): fakeredis with Lua. cuOpt: a tiny HTTP
+  server that answers /health and /cuopt/routes after a fixed delay.
+- Configuration comes from ROPT_* env vars set by the caller, as in production.
+
+Usage: python -m bench.stack --port 8765 --cuopt-port 8766 [--redis]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def start_cuopt(port: int, latency_ms: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._reply({"status": "ok"})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            time.sleep(latency_ms / 1000.0)
+            fleet = body.get("fleet_data", {})
+            tasks = body.get("task_data", {}).get("task_locations", [])
+            routes = {
+                vid: [loc[0], *tasks, loc[-1]]
+                for vid, loc in zip(fleet.get("vehicle_ids", []), fleet.get("vehicle_locations", []))
+            }
+            self._reply({"response": {"solver_response": {"routes": routes}}})
+
+        def _reply(self, payload: dict) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def install_stand_ins(use_redis: bool) -> None:
+    # Must run before app.main is imported: create_app() runs at import time.
+    from app.config import settings
+    from app.db import mongo
+
+    if settings.storage != "embedded":
+        from mongomock_motor import AsyncMongoMockClient
+
+        mongo._client = AsyncMongoMockClient()
+        # mongomock has no time-series collections; a plain one satisfies ensure_indexes.
+        asyncio.run(mongo.get_db().create_collection(mongo.col_metrics().name))
+
+    if use_redis:
+        import fakeredis
+        import redis.asyncio as aioredis
+
+        server = fakeredis.FakeServer()
+        aioredis.from_url = lambda url, **kw: fakeredis.FakeAsyncRedis(server=server, **kw)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backend on local stand-ins")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--cuopt-port", type=int, required=True)
+    parser.add_argument("--cuopt-latency-ms", type=float, default=2.0)
+    parser.add_argument("--redis", action="store_true")
+    args = parser.parse_args()
+
+    start_cuopt(args.cuopt_port, args.cuopt_latency_ms)
+    install_stand_ins(args.redis)
+
+    import uvicorn
+
+    from app.main import app
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
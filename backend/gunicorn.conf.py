@@ -0,0 +1,25 @@
+"""
+gunicorn.conf.py
+What this file does:
+- Loaded automatically by gunicorn from the working directory.
+- Keeps Prometheus multiprocess metrics correct across worker restarts.
+"""
+
+import glob
+import os
+
+
+def on_starting(server):
+    # Stale mmap files from a previous container run would be summed in.
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for f in glob.glob(os.path.join(path, "*.db")):
+            os.remove(f)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,43 @@
+"""
+tests/conftest.py
+What this file does:
+- Puts backend/ on sys.path so tests import the service as `app`.
+- Swaps the storage client behind db/mongo.py for one test at a time:
+  the embedded store in a temp directory, or mongomock standing in for a
+  real MongoDB server.
+Run from backend/: python -m pytest -q tests
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db import mongo  # noqa: E402
+from app.db.embedded import EmbeddedClient  # noqa: E402
+
+
+async def open_storage(kind: str, directory: str) -> None:
+    """
+    Point db/mongo.py at a fresh store of the given kind and build the
+    service's indexes, as startup does.
+    """
+    if kind == "embedded":
+        mongo._client = EmbeddedClient(directory, flush_ms=0)
+        mongo._db = None
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+
+        mongo._client = AsyncMongoMockClient()
+        mongo._db = None
+        # mongomock has no time-series collections; a plain one takes its place.
+        await mongo.get_db().create_collection("metrics_ts")
+    await mongo.ensure_indexes()
+
+
+async def close_storage() -> None:
+    await mongo.close_client()
+    mongo._client = None
+    mongo._db = None
@@ -0,0 +1,301 @@
+"""
+tests/test_embedded_store.py
+What this file does:
+- Runs the repos' queries against the embedded store and against mongomock
+  and checks both return the same documents in the same order.
+- Covers unique-index conflicts, recovery from a torn WAL record, and
+  compaction followed by reopening the store.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.db.embedded import EmbeddedClient
+from app.repos import actors_repo, checkpoints_repo, events_repo, metric_repo, runs_repo, zones_repo
+from conftest import close_storage, open_storage
+
+pytest.importorskip("mongomock_motor")
+
+# Mixed types on purpose: filters and sorts must follow MongoDB's type brackets.
+# Booleans and descending array sorts are where mongomock departs from the
+# server; _server_semantics() checks those against the embedded store alone.
+VALUES = [None, 1, 2.5, 7, -3, "a", "b", "10", {"x": 1}, {"x": 2}, [1, 5], [],
+          datetime(2024, 1, 1, tzinfo=timezone.utc), ObjectId("0" * 24)]
+
+QUERIES = [
+    {},
+    {"v": 1},
+    {"v": 5},
+    {"v": None},
+    {"v": {"$exists": False}},
+    {"v": {"$gt": 1}},
+    {"v": {"$gte": 1, "$lt": 7}},
+    {"v": {"$lt": "b"}},
+    {"v": {"$gte": "10"}},
+    {"v": {"$ne": 1}},
+    {"v": {"$in": [1, "a", None]}},
+    {"v": {"$nin": [1, "a"]}},
+    {"v.x": {"$gte": 2}},
+    {"g": "k1", "v": {"$gt": 0}},
+    {"$or": [{"v": {"$gt": 2}}, {"g": "k2"}]},
+    {"$or": [{"g": "k0", "n": {"$gt": 10}}, {"g": "k1", "n": {"$gte": 40}}]},
+    {"$and": [{"n": {"$gte": 5}}, {"n": {"$lt": 30}}], "g": {"$in": ["k0", "k2"]}},
+]
+
+SORTS = [[("n", 1)], [("g", 1), ("n", -1)], [("v", 1), ("n", 1)], [("v", 1), ("n", -1)]]
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+async def _matcher_results(kind: str, directory: str):
+    await open_storage(kind, directory)
+    try:
+        from app.db import mongo
+
+        col = mongo.get_db()["probe"]
+        await col.create_index([("v", 1)])
+        await col.create_index([("g", 1), ("n", 1)])
+        docs = [{"n": i, "g": f"k{i % 3}"} for i in range(50)]
+        for i, doc in enumerate(docs):
+            if i % 17 != 16:
+                doc["v"] = VALUES[i % len(VALUES)]
+        await col.insert_many(docs)
+        out = []
+        for q in QUERIES:
+            out.append(sorted([d["n"] async for d in col.find(q)]))
+            out.append(await col.count_documents(q))
+        for spec in SORTS:
+            out.append([d["n"] async for d in col.find({}, sort=spec)])
+            out.append([d["n"] async for d in col.find({"n": {"$gte": 10}}, sort=spec).skip(5).limit(12)])
+        return out
+    finally:
+        await close_storage()
+
+
+async def _repo_results(kind: str, directory: str):
+    await open_storage(kind, directory)
+    try:
+        rng = random.Random(1)
+        run = await runs_repo.start_run("a")
+        other = await runs_repo.start_run("b")
+        ids = []
+        for i in range(400):
+            ids.append(await events_repo.insert_event({
+                "event_type": rng.choice(["ENTER", "EXIT", "MOVE"]),
+                "ts_ms": 1000 + i // 3,
+                "actor_id": f"a{i % 7}",
+                "zone_id": f"z{i % 4}",
+                "run_id": run if i % 5 else other,
+                "payload": {},
+            }))
+        pos = {oid: i for i, oid in enumerate(ids)}
+        out = {}
+
+        pages, cursor = [], None
+        while True:
+            page, cursor = await events_repo.query_events_page(
+                run_id=run, since_ms=1010, limit=37, cursor=cursor, fields="zone_id"
+            )
+            pages.append([(pos[p["_id"]], sorted(p)) for p in page])
+            if not cursor:
+                break
+        out["pages"] = pages
+        out["recent"] = [pos[e["_id"]] for e in await events_repo.query_events(run_id=other, limit=10)]
+        out["batches"] = [
+            [pos[str(e["_id"])] for e in batch]
+            async for batch in events_repo.iter_event_batches(run, since_ms=1050, until_ms=1100, batch_size=20)
+        ]
+        out["traces"] = await events_repo.update_traces([(ids[1], {"x": 1.0}), (ids[2], {"y": 2.0})])
+        out["deleted"] = await events_repo.delete_events(ids[:50])
+
+        await runs_repo.stop_run(run, "done")
+        out["runs"] = sorted((r["notes"], r["ended_at_ms"] is not None) for r in await runs_repo.list_runs())
+        out["claim"] = await runs_repo.claim_run_for_archive(10**15, 1000) == run
+        out["claim_again"] = await runs_repo.claim_run_for_archive(10**15, 1000)
+
+        await zones_repo.upsert_zones([{"zone_id": "b", "polygon": [[0, 0], [1, 0], [1, 1]]}, {"zone_id": "a"}])
+        await zones_repo.upsert_zones([{"zone_id": "b", "severity": "emergency"}])
+        out["zones"] = [{k: v for k, v in z.items() if k != "_id"} for z in await zones_repo.get_zones()]
+
+        await metric_repo.insert_metrics([
+            {"ts_ms": 5000 + i * 10, "run_id": run if i % 2 else None, "source": "cam", "pipeline_fps": float(i)}
+            for i in range(120)
+        ])
+        metrics, _ = await metric_repo.query_metrics_page(run_id=run, limit=25, fields="pipeline_fps,run_id")
+        out["metrics"] = [(m["ts_ms"], m.get("pipeline_fps")) for m in metrics]
+
+        await actors_repo.upsert_actor_states([
+            {"actor_id": f"p{i}", "last_seen_ms": i, "zones": {"z1": i % 2 == 0, "z2": i % 3 == 0}}
+            for i in range(20)
+        ])
+        await actors_repo.upsert_actor_states([{"actor_id": "p1", "last_seen_ms": 100, "zones": {"z9": True}}])
+        out["live"] = sorted((a["actor_id"], a["inside"]) for a in await actors_repo.live_actor_states(5))
+        out["pruned"] = await actors_repo.prune_actor_states(10)
+
+        for t in (10, 20, 30):
+            await checkpoints_repo.insert_checkpoint({"run_id": run, "ts_ms": t, "v": t})
+        out["checkpoints"] = [
+            (await checkpoints_repo.nearest_checkpoint(run, t) or {}).get("v") for t in (5, 10, 25, None)
+        ]
+        return out
+    finally:
+        await close_storage()
+
+
+async def _server_semantics(directory: str):
+    client = EmbeddedClient(directory, flush_ms=0)
+    col = client["ropt"]["probe"]
+    await col.insert_many([{"n": 0, "v": True}, {"n": 1, "v": 1}, {"n": 2, "v": [1, 5]}, {"n": 3, "v": 3}, {"n": 4, "v": []}])
+    for indexed in (False, True):
+        if indexed:
+            await col.create_index([("v", 1)])
+        assert sorted([d["n"] async for d in col.find({"v": 1})]) == [1, 2]
+        assert [d["n"] async for d in col.find({}, sort=[("v", -1)])] == [0, 2, 3, 1, 4]
+        assert [d["n"] async for d in col.find({}, sort=[("v", 1)])] == [4, 1, 2, 3, 0]
+        assert [d["n"] async for d in col.find({"v": None})] == []
+    await client.aclose()
+
+
+def test_matcher_agrees_with_mongomock(tmp_path):
+    assert _run(_matcher_results("embedded", str(tmp_path))) == _run(_matcher_results("mongomock", ""))
+    _run(_server_semantics(str(tmp_path / "server")))
+
+
+def test_repo_queries_agree_with_mongomock(tmp_path):
+    embedded = _run(_repo_results("embedded", str(tmp_path)))
+    assert embedded == _run(_repo_results("mongomock", ""))
+    assert sum(len(p) for p in embedded["pages"]) == 296  # run's events with ts_ms >= 1010
+
+
+async def _unique_conflicts(directory: str):
+    client = EmbeddedClient(directory, flush_ms=0)
+    col = client["ropt"]["actors_state"]
+    await col.create_index([("actor_id", 1)], unique=True)
+    await col.create_index([("run_id", 1), ("seq", 1)], unique=True)
+    await col.insert_one({"actor_id": "a", "run_id": "r", "seq": 1})
+    await col.insert_one({"actor_id": "b", "run_id": "r", "seq": 2})
+
+    with pytest.raises(DuplicateKeyError):
+        await col.insert_one({"actor_id": "a"})
+    with pytest.raises(DuplicateKeyError):
+        await col.insert_one({"actor_id": "c", "run_id": "r", "seq": 2})
+    with pytest.raises(DuplicateKeyError):
+        await col.update_one({"actor_id": "b"}, {"$set": {"actor_id": "a"}})
+    with pytest.raises(DuplicateKeyError):
+        await col.update_one({"actor_id": "z"}, {"$set": {"run_id": "r", "seq": 1}}, upsert=True)
+    # A refused write leaves no trace in the data or the indexes.
+    assert await col.count_documents({}) == 2
+    assert await col.find_one({"actor_id": "b"}, {"_id": 0}) == {"actor_id": "b", "run_id": "r", "seq": 2}
+    assert await col.count_documents({"actor_id": "z"}) == 0
+
+    await col.delete_one({"actor_id": "a"})
+    await col.insert_one({"actor_id": "a", "run_id": "r", "seq": 1})
+    await client.aclose()
+
+    client = EmbeddedClient(directory, flush_ms=0)
+    col = client["ropt"]["actors_state"]
+    with pytest.raises(DuplicateKeyError):
+        await col.insert_one({"actor_id": "a"})
+    await client.aclose()
+
+
+def test_unique_index_conflicts(tmp_path):
+    _run(_unique_conflicts(str(tmp_path)))
+
+
+def _crash(client: EmbeddedClient) -> None:
+    # Stop without the final flush aclose() does, as a killed process would.
+    for db in client._dbs.values():
+        db._closed = True
+        if db._task is not None:
+            db._task.cancel()
+        db._lock_fh.close()
+
+
+async def _write_then_tear(directory: str) -> str:
+    client = EmbeddedClient(directory, flush_ms=0)
+    db = client["ropt"]
+    col = db["events"]
+    await col.create_index([("run_id", 1), ("ts_ms", 1)])
+    await col.insert_many([{"run_id": f"r{i % 3}", "ts_ms": i} for i in range(300)])
+    await col.update_many({"run_id": "r1"}, {"$set": {"trace.b": 2.0}})
+    await col.delete_many({"run_id": "r2"})
+    path, size = db._wal.path(db._wal.seq), db._wal.size
+    # Length prefix promises 64 bytes; the process died partway through writing them.
+    db._wal._fh.write(b"\x40\x00\x00\x00partial")
+    db._wal._fh.flush()
+    _crash(client)
+    assert os.path.getsize(path) > size
+    return path, size
+
+
+async def _recover(directory: str, path: str, size: int):
+    client = EmbeddedClient(directory, flush_ms=0)
+    db = client["ropt"]
+    col = db["events"]
+    assert os.path.getsize(path) == size
+    assert db.recovered_records > 0
+    assert await col.count_documents({}) == 200
+    assert await col.count_documents({"run_id": "r1", "trace.b": 2.0}) == 100
+    found = [d["ts_ms"] async for d in col.find({"run_id": "r0", "ts_ms": {"$gte": 30, "$lt": 40}}, sort=[("ts_ms", 1)])]
+    assert found == [30, 33, 36, 39]
+    # Appends after the truncation point replay cleanly next time.
+    await col.insert_one({"run_id": "after", "ts_ms": -1})
+    await client.aclose()
+
+    client = EmbeddedClient(directory, flush_ms=0)
+    assert await client["ropt"]["events"].count_documents({}) == 201
+    await client.aclose()
+
+
+def test_recovers_from_torn_wal_record(tmp_path):
+    path, size = _run(_write_then_tear(str(tmp_path)))
+    _run(_recover(str(tmp_path), path, size))
+
+
+async def _compact(directory: str):
+    client = EmbeddedClient(directory, flush_ms=0)
+    db = client["ropt"]
+    col = db["events"]
+    await col.create_index([("run_id", 1), ("ts_ms", 1)])
+    await db["actors_state"].create_index([("actor_id", 1)], unique=True)
+    await db.create_collection("metrics_ts", timeseries={"timeField": "ts", "metaField": "meta"})
+    await db["scratch"].insert_one({"x": 1})
+    await col.insert_many([{"run_id": f"r{i % 3}", "ts_ms": i, "blob": "x" * 50} for i in range(500)])
+    await db["actors_state"].insert_one({"actor_id": "a"})
+    await db["scratch"].drop()
+    first_seq = db._wal.seq
+    await db.compact()
+    assert db._wal.seq > first_seq
+    assert not os.path.exists(db._wal.path(first_seq))
+    # Writes after the snapshot land in the new segment and must survive too.
+    await col.update_many({"run_id": "r0"}, {"$set": {"seen": True}})
+    await col.delete_many({"run_id": "r2"})
+    await client.aclose()
+
+    client = EmbeddedClient(directory, flush_ms=0)
+    db = client["ropt"]
+    col = db["events"]
+    assert sorted(await db.list_collection_names()) == ["actors_state", "events", "metrics_ts"]
+    assert await col.count_documents({}) == 334
+    assert await col.count_documents({"seen": True}) == 167
+    found = [d["ts_ms"] async for d in col.find({"run_id": "r1", "ts_ms": {"$gt": 480}}, sort=[("ts_ms", -1)])]
+    assert found == [499, 496, 493, 490, 487, 484, 481]
+    assert "run_id_1_ts_ms_1" in col._indexes
+    with pytest.raises(DuplicateKeyError):
+        await db["actors_state"].insert_one({"actor_id": "a"})
+    await client.aclose()
+
+
+def test_compaction_then_reopen(tmp_path):
+    _run(_compact(str(tmp_path)))
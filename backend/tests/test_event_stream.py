@@ -0,0 +1,117 @@
+"""
+tests/test_event_stream.py
+What this file does:
+- Drives RedisEventStream against fakeredis (with Lua): the put script
+  refusing a full partition, leases rebalancing between two consumers, and
+  a new owner reclaiming a dead consumer's unacked entries with XAUTOCLAIM.
+"""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from app.event_stream import RedisEventStream
+from app.schemas import SafetyEventIn
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+
+def _client(server):
+    return fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+
+
+def _event(i: int, actor_id: str = "p0") -> SafetyEventIn:
+    return SafetyEventIn(event_type="MOVE", ts_ms=1000 + i, actor_id=actor_id, zone_id="A")
+
+
+async def _full_partition():
+    stream = RedisEventStream(_client(fakeredis.FakeServer()), partitions=1, max_len=3)
+    await stream.ensure_groups()
+    assert [await stream.put(_event(i)) for i in range(4)] == [True, True, True, False]
+    key = stream.stream_key(0)
+    assert await stream.client.xlen(key) == 3
+
+    # Handled entries are acked and deleted, which frees room again.
+    seen = []
+
+    async def handler(e):
+        seen.append(e.ts_ms)
+
+    resp = await stream.client.xreadgroup(stream.group, stream.consumer, {key: ">"}, count=10)
+    await stream._handle(key, resp[0][1], handler)
+    assert seen == [1000, 1001, 1002]
+    assert await stream.client.xlen(key) == 0
+    assert await stream.put(_event(3))
+
+
+def test_put_refuses_when_partition_is_full():
+    asyncio.run(_full_partition())
+
+
+async def _rebalance():
+    server = fakeredis.FakeServer()
+    a = RedisEventStream(_client(server), partitions=4)
+    b = RedisEventStream(_client(server), partitions=4)
+    await a.ensure_groups()
+
+    assert sorted(await a._rebalance()) == [0, 1, 2, 3]
+    # b joins while a still holds every lease; a gives up its extras next pass.
+    assert await b._rebalance() == []
+    await a._rebalance()
+    assert len(a._owned) == 2
+    assert sorted(await b._rebalance()) == sorted({0, 1, 2, 3} - a._owned)
+    assert a._owned.isdisjoint(b._owned)
+
+    # A lease renewed by its owner stays put.
+    owned = set(a._owned)
+    await a._rebalance()
+    await b._rebalance()
+    assert a._owned == owned
+
+    # b leaving releases its leases at once; a takes them all back.
+    await b.close()
+    await a._rebalance()
+    assert a._owned == {0, 1, 2, 3}
+
+
+def test_leases_rebalance_across_two_consumers():
+    asyncio.run(_rebalance())
+
+
+async def _reclaim():
+    server = fakeredis.FakeServer()
+    dead = RedisEventStream(_client(server), partitions=1)
+    await dead.ensure_groups()
+    assert await dead._rebalance() == [0]
+    for i in range(5):
+        await dead.put(_event(i))
+    key = dead.stream_key(0)
+    # Delivered to the first owner, which dies before acking.
+    resp = await dead.client.xreadgroup(dead.group, dead.consumer, {key: ">"}, count=3)
+    assert len(resp[0][1]) == 3
+    await dead.client.delete(dead._lease_key(0))  # as if the lease expired
+
+    owner = RedisEventStream(_client(server), partitions=1)
+    assert await owner._rebalance() == [0]
+    seen = []
+
+    async def handler(e):
+        seen.append(e.ts_ms)
+
+    await owner._reclaim(0, handler)
+    assert seen == [1000, 1001, 1002]
+    assert owner.reclaimed == 3
+
+    # The rest was never delivered and arrives through the normal read path.
+    resp = await owner.client.xreadgroup(owner.group, owner.consumer, {key: ">"}, count=10)
+    await owner._handle(key, resp[0][1], handler)
+    assert seen == [1000, 1001, 1002, 1003, 1004]
+    assert await owner.client.xlen(key) == 0
+    assert (await owner.client.xpending(key, owner.group))["pending"] == 0
+
+
+def test_new_owner_reclaims_dead_consumers_entries():
+    asyncio.run(_reclaim())
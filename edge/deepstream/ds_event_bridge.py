@@ -50,6 +50,8 @@ def pop_buffered_event(conn: sqlite3.Connection) -> Dict[str, Any] | None:
 
 def post_event(backend_url: str, evt: Dict[str, Any]) -> None:
     url = f"{backend_url.rstrip('/')}/events"
+    # Stage trace: the backend adds its own stamps and reports per-stage latency.
+    evt.setdefault("trace", {})["edge_send_ms"] = round(time.time() * 1000, 3)
     resp = requests.post(url, json=evt, timeout=2)
     resp.raise_for_status()
 
@@ -99,6 +101,7 @@ def run_demo(backend_url: str, actor_id: str, q: "queue.Queue[dict]") -> None:
     ]
     for e in events:
         e["ts_ms"] = ts_ms()
+        e["trace"] = {"edge_enqueue_ms": round(time.time() * 1000, 3)}
         try:
             q.put_nowait(e)
         except queue.Full:
@@ -118,6 +121,7 @@ def stream_stdin(backend_url: str, q: "queue.Queue[dict]") -> None:
         evt = json.loads(line)
         if "ts_ms" not in evt:
             evt["ts_ms"] = int(time.time() * 1000)
+        evt.setdefault("trace", {})["edge_enqueue_ms"] = round(time.time() * 1000, 3)
         try:
             q.put_nowait(evt)
         except queue.Full:
@@ -74,6 +74,8 @@ def post_event(backend_url: str, evt: dict, api_key: str | None, retries: int =
     for attempt in range(retries):
         try:
             headers = {"X-API-Key": api_key} if api_key else None
+            # Re-stamped per attempt so retries show up as network time, not edge queue time.
+            evt.setdefault("trace", {})["edge_send_ms"] = round(time.time() * 1000, 3)
             resp = requests.post(url, json=evt, headers=headers, timeout=2)
             resp.raise_for_status()
             return
@@ -128,6 +130,7 @@ def _emit_zone_transitions(ctx: ProbeContext, actor_id: str, point_xy: Tuple[flo
             "actor_id": actor_id,
             "zone_id": zone.zone_id,
             "payload": {"probe_x": point_xy[0], "probe_y": point_xy[1], "camera_view": ctx.camera_view},
+            "trace": {"edge_enqueue_ms": round(time.time() * 1000, 3)},
         }
         try:
             ctx.event_queue.put_nowait(evt)